@@ -1,4 +1,5 @@
-from .tree_element import TreeElement
+from types import SimpleNamespace
+from .tree_element import TreeElement, sibling_key
 from .lawdata import ElementNumber, LawData
 
 def get_etypes():
@@ -24,23 +25,47 @@ def get_etypes_core(globals_dict):
 def sort_etypes(etypes, *args, **kwargs):
     return sorted(etypes, key=lambda x: (x.LEVEL, x.SUBLEVEL), *args, **kwargs)
 
+# 同じ階層定義を持ち、__dict__を持たない(__slots__のみの)etype群を生成する
+# mixinは__slots__ = ()を宣言している必要があり、mixinが使う属性はslotsで渡す
+# 生成したクラスはmoduleのnamespaceという名前の属性として置くこと(pickleはmodule.namespace.etype名で探す)
+# moduleを省略した場合は元のetypeのモジュール
+def make_compact_etypes(etypes_dict, mixins=(), slots=(), namespace="compact", module=None):
+    compact = SimpleNamespace()
+    etypes = get_etypes_core(etypes_dict)
+    for etype in etypes:
+        bases = tuple(mixins) + ((RootExpansion,) if etype.is_root() else ()) + (TreeElement,)
+        attrs = {
+            name: getattr(etype, name)
+            for name in ("LEVEL", "SUBLEVEL", "CHILDREN_PATTERNS", "JNAME")
+            }
+        attrs["__slots__"] = tuple(slots) + (("_lawdata",) if etype.is_root() else ())
+        attrs["__module__"] = etype.__module__ if module is None else module
+        attrs["__qualname__"] = namespace + "." + etype.__name__
+        attrs["ETYPES_DICT"] = vars(compact)
+        setattr(compact, etype.__name__, type(etype.__name__, bases, attrs))
+    for etype in etypes:
+        getattr(compact, etype.__name__).PARENT_CANDIDATES = tuple(
+            getattr(compact, parent.__name__) for parent in etype.PARENT_CANDIDATES
+            )
+    return compact
+
 def convert_recursively(src_root, _tar_root=None, etypes_dict=None):
     etypes_dict = globals() if etypes_dict is None else etypes_dict
     tar_root = etypes_dict[src_root.etype.__name__].convert(src_root) if _tar_root is None else _tar_root
     tar_root._children = dict()
-    for src_elem in src_root.children.values():
+    for src_elem in sorted(src_root.children.values(), key=sibling_key):
         new_etype = etypes_dict[src_elem.etype.__name__].convert(src_elem)
         new_etype.parent = tar_root
         tar_root.children[new_etype.name] = convert_recursively(src_elem, new_etype, etypes_dict)
     return tar_root
 
 class RootExpansion(object):
+    __slots__ = ()
+
     def __init__(self, lawdata):
-        self.parent = None
+        super().__init__(None)
         self._lawdata = lawdata
         self._num = ElementNumber("1")
-        self._children = None
-        self._text = None
 
     @classmethod
     def convert(cls, src_elem):
@@ -74,9 +99,8 @@ class RootExpansion(object):
 
     @property
     def code(self):
-        if "_code" not in self.__dict__:
-            nums = [self.num.main_num] + self.num.branch_nums
-            self._code = self.lawdata.code + "/{etype}({num})".format(etype=self.etype.__name__, num="_".join([str(n) for n in nums]))
+        if self._code is None:
+            self._code = self.etype.build_code(self.lawdata.code, self.num)
         return self._code
 
 class Law(RootExpansion, TreeElement):
@@ -214,4 +238,6 @@ class Sentence(TreeElement):
         Subitem4Sentence, 
         Subitem5Sentence
         )
-    JNAME = "第{num}文"
\ No newline at end of file
+    JNAME = "第{num}文"
+
+compact = make_compact_etypes(globals())
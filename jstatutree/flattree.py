@@ -0,0 +1,150 @@
+import numpy as np
+from . import etypes
+from .lawdata import ElementNumber
+
+ETYPE_NAMES = [etype.__name__ for etype in etypes.get_etypes()]
+ETYPE_IDS = {name: i for i, name in enumerate(ETYPE_NAMES)}
+ETYPE_LEVELS = np.array([etype.LEVEL for etype in etypes.get_etypes()], dtype=np.int16)
+ETYPE_SUBLEVELS = np.array([etype.SUBLEVEL for etype in etypes.get_etypes()], dtype=np.int16)
+
+def etype_id(etype):
+    return ETYPE_IDS[etype if isinstance(etype, str) else etype.__name__]
+
+# 要素木(の集合)を前順の配列で表したもの
+# 部分木は[i, subtree_ends[i])の連続した範囲になる
+class FlatTree(object):
+    def __init__(self, law_codes, tree_ids, parents, etype_ids, main_nums, branch_nums, subtree_ends, text_offsets, text):
+        self.law_codes = law_codes
+        self.tree_ids = tree_ids
+        self.parents = parents
+        self.etype_ids = etype_ids
+        self.levels = ETYPE_LEVELS[etype_ids]
+        self.sublevels = ETYPE_SUBLEVELS[etype_ids]
+        self.main_nums = main_nums
+        self.branch_nums = branch_nums
+        self.subtree_ends = subtree_ends
+        self.text_offsets = text_offsets
+        self.text = text
+
+    @classmethod
+    def from_tree(cls, root):
+        return cls.from_trees([root])
+
+    @classmethod
+    def from_trees(cls, roots):
+        law_codes = []
+        tree_ids, parents, etype_ids, nums, texts = [], [], [], [], []
+        subtree_ends = []
+        for tree_id, root in enumerate(roots):
+            law_codes.append(root.lawdata.code)
+            # (要素, 親の番号)のスタックで前順に走査する
+            stack = [(root, -1)]
+            open_indices = []
+            while len(stack) > 0:
+                elem, parent = stack.pop()
+                while len(open_indices) > 0 and open_indices[-1] != parent:
+                    subtree_ends[open_indices.pop()] = len(parents)
+                i = len(parents)
+                tree_ids.append(tree_id)
+                parents.append(parent)
+                etype_ids.append(ETYPE_IDS[elem.etype.__name__])
+                nums.append(elem.num.key)
+                texts.append(elem.text)
+                subtree_ends.append(-1)
+                open_indices.append(i)
+                stack.extend((child, i) for child in reversed(list(elem.children.values())))
+            for i in open_indices:
+                subtree_ends[i] = len(parents)
+        branch_width = max([len(key) - 1 for key in nums] + [0])
+        branch_nums = np.zeros((len(nums), branch_width), dtype=np.int32)
+        for i, key in enumerate(nums):
+            branch_nums[i, :len(key)-1] = key[1:]
+        text_offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+        np.cumsum([len(t) for t in texts], out=text_offsets[1:])
+        return cls(
+            law_codes=law_codes,
+            tree_ids=np.array(tree_ids, dtype=np.int32),
+            parents=np.array(parents, dtype=np.int32),
+            etype_ids=np.array(etype_ids, dtype=np.int16),
+            main_nums=np.array([key[0] for key in nums], dtype=np.int32),
+            branch_nums=branch_nums,
+            subtree_ends=np.array(subtree_ends, dtype=np.int32),
+            text_offsets=text_offsets,
+            text="".join(texts)
+            )
+
+    def __len__(self):
+        return len(self.parents)
+
+    @property
+    def root_indices(self):
+        return np.flatnonzero(self.parents < 0)
+
+    def get_text(self, i):
+        return self.text[self.text_offsets[i]:self.text_offsets[i+1]]
+
+    def get_texts(self, indices):
+        return [self.text[s:e] for s, e in zip(self.text_offsets[indices], self.text_offsets[np.asarray(indices)+1])]
+
+    def get_num(self, i):
+        return ElementNumber.from_key((int(self.main_nums[i]),) + tuple(int(n) for n in self.branch_nums[i]))
+
+    def get_code(self, i):
+        path = []
+        while i >= 0:
+            path.append(i)
+            i = self.parents[i]
+        code = self.law_codes[self.tree_ids[path[-1]]]
+        for i in reversed(path):
+            code = "{0}/{1}({2})".format(code, ETYPE_NAMES[self.etype_ids[i]], str(self.get_num(i)))
+        return code
+
+    def get_codes(self, indices):
+        return [self.get_code(i) for i in indices]
+
+    # 祖先にLEVELがlevel以上の要素を持つ要素のマスク
+    def _below_level_mask(self, level):
+        blocked = np.flatnonzero(self.levels >= level)
+        diff = np.zeros(len(self) + 1, dtype=np.int32)
+        np.add.at(diff, blocked + 1, 1)
+        np.add.at(diff, self.subtree_ends[blocked], -1)
+        return np.cumsum(diff[:-1]) > 0
+
+    # TreeElement.depth_first_search(target_etype)に相当する要素の番号(前順)
+    # 対象の階層を持たない枝では、その手前の要素を一度だけ返す
+    def depth_first_search(self, target_etype):
+        level, sublevel = target_etype.LEVEL, target_etype.SUBLEVEL
+        reachable = ~self._below_level_mask(level)
+        hits = reachable & (self.levels == level) & (self.sublevels == sublevel)
+        deeper = reachable & (self.levels > level) & (self.parents >= 0)
+        deeper &= self.levels[np.maximum(self.parents, 0)] < level
+        hits[self.parents[deeper]] = True
+        return np.flatnonzero(hits)
+
+    def indices_of(self, target_etype):
+        return np.flatnonzero(self.etype_ids == etype_id(target_etype))
+
+    def iter_sentences(self):
+        return iter(self.get_texts(self.indices_of("Sentence")))
+
+    # target_etypeの各要素について、部分木に含まれる文の範囲を返す
+    def sentence_ranges(self, target_etype):
+        indices = self.depth_first_search(target_etype)
+        sentences = self.indices_of("Sentence")
+        starts = np.searchsorted(sentences, indices, side="left")
+        ends = np.searchsorted(sentences, self.subtree_ends[indices], side="left")
+        return indices, sentences, starts, ends
+
+    def aggregate_texts(self, target_etype, sep=""):
+        indices, sentences, starts, ends = self.sentence_ranges(target_etype)
+        texts = self.get_texts(sentences)
+        return indices, [sep.join(texts[s:e]) for s, e in zip(starts, ends)]
+
+    def aggregate_text_lengths(self, target_etype):
+        indices, sentences, starts, ends = self.sentence_ranges(target_etype)
+        lengths = np.zeros(len(sentences) + 1, dtype=np.int64)
+        np.cumsum(self.text_offsets[sentences+1] - self.text_offsets[sentences], out=lengths[1:])
+        return indices, lengths[ends] - lengths[starts]
+
+    def count_per_tree(self, target_etype):
+        return np.bincount(self.tree_ids[self.depth_first_search(target_etype)], minlength=len(self.law_codes))
@@ -1,12 +1,19 @@
 import numpy as np
 from collections import OrderedDict
-from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED, ALL_COMPLETED
 import multiprocessing
+import threading
+import queue
+import time
+import hashlib
 from itertools import combinations
 from .lawdata import SourceInterface
 from .kvsdict import KVSDict, KVSPrefixDict
 from . import etypes
 from .tree_element import TreeElement
+from .myexceptions import XMLStructureError
+from .xmltree.xml_lawdata import ReikiXMLReader
+from .mltree import ml_etypes
 import re
 import os
 
@@ -122,59 +129,204 @@ class JSSentenceKVSDict(KVSPrefixDict):
             prefix = self.PREFIX + level + "-"
         super().__init__(db=db, kvsdict=kvsdict, prefix=prefix, *args, **kwargs)
 
-"""
 QSIZE = 1000
-class JSFMultiExecutor(JSForest):
-        def __init__():
-            self.executor = {
-            "process":  ProcessPoolExecutor(self.proc_count),
-            "thread":   ThreadPoolExecutor(self.thread_count)
-            }
-
-        def executor_deco(executor_type):
-        def _executor_deco(func):
-            import functools
-            @functools.wraps(func)
-            def inner(self, queue, *args, **kwargs):
-                futures = [
-                    self.executor[executor_type].submit(func, self, queue, *arg, **kwargs) for arg in args
-                    ]
-                for f in as_completed(futures):
-                    res = f.result()
-                    if res is None:
-                        continue
-                    else:
-                        queue.put(res)
-                if executor_type is "thread":
-                    queue.put(None)
-            return inner
-        return _executor_deco
-
-    def add_tree_sources_from_paths(self, *tree_source_paths):
-        q = multiprocessing.Queue(QSIZE)
-        self._enqueue_tree_sources_from_paths(queue, *tree_source_paths)
-        unfinished_thread_count = self.proc_count * self.thread_count
-        while unfinished_thread_count > 0:
-            item = q.get()
-            if item is None:
-                unfinished_thread_count -= 1
-                continue
-            tree_source = item
-            self.tree_source_dict[tree_source.code] = tree_source
+BATCH_SIZE = 100
+
+def find_all_files(basepath, extensions):
+    for dirpath, dirnames, filenames in os.walk(basepath):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if os.path.splitext(filename)[1] in extensions:
+                yield os.path.join(dirpath, filename)
+
+def file_digest(path, chunk_size=1<<20):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _read_tree_source(reader_cls, path):
+    reader = reader_cls(path)
+    reader.open()
+    if reader.is_closed():
+        raise XMLStructureError(error_detail="Cannot parse {}".format(path))
+    try:
+        return reader.lawdata, ml_etypes.convert_recursively(reader.get_tree())
+    finally:
+        reader.close()
+
+class IngestionStats(object):
+    def __init__(self):
+        self.submitted = 0
+        self.processed = 0
+        self.written = 0
+        self.failed = 0
+        self.unchanged = 0
+        self.removed = 0
+        self.errors = []
+        self.start_time = time.time()
+        self.end_time = None
+
+    @property
+    def elapsed(self):
+        end_time = time.time() if self.end_time is None else self.end_time
+        return end_time - self.start_time
+
+    @property
+    def throughput(self):
+        elapsed = self.elapsed
+        return self.processed / elapsed if elapsed > 0 else 0.0
+
+    def __str__(self):
+        return "{processed}/{submitted} files ({written} written, {failed} failed, {unchanged} unchanged, {removed} removed) in {elapsed:.1f} sec, {throughput:.1f} files/sec".format(
+            processed=self.processed,
+            submitted=self.submitted,
+            written=self.written,
+            failed=self.failed,
+            unchanged=self.unchanged,
+            removed=self.removed,
+            elapsed=self.elapsed,
+            throughput=self.throughput
+            )
 
+# XMLのパースと木の構築をプロセスプールで並列に行い、書き込みは単一のスレッドがキューから取り出してまとめて行う
+class JSFMultiExecutor(object):
+    # indexにNgramIndexを渡すと、書き込んだ木の文を索引にも追加する
+    def __init__(self, kvs, proc_count=None, qsize=QSIZE, batch_size=BATCH_SIZE, reader_cls=ReikiXMLReader, index=None):
+        self.kvs = kvs
+        self.index = index
+        self.proc_count = multiprocessing.cpu_count() if proc_count is None else proc_count
+        self.qsize = qsize
+        self.batch_size = batch_size
+        self.reader_cls = reader_cls
 
-    def setup_from_basepath(self, basepath):
-        self.add_tree_sources_from_paths(find_all_files(basepath, [".xml"]))
+    def setup_from_basepath(self, basepath, *args, **kwargs):
+        return self.add_tree_sources_from_paths(find_all_files(basepath, [".xml"]), *args, **kwargs)
 
-    def __iter__(self):
-        q = multiprocessing.Queue(QSIZE)
-        self._enqueue_leaves(self.tree_source_dict.values())
-        unfinished_thread_count = self.proc_count * self.thread_count
-        while unfinished_thread_count > 0:
-            item = q.get()
-            if item is None:
-                unfinished_thread_count -= 1
+    # basepath以下のファイルのうち、manifestの記録から変わったものだけを読み直す
+    # サイズと更新時刻が同じファイルは読まず、違う場合も内容のハッシュ値が同じなら記録だけ更新する
+    # 消えたファイルの例規は要素ごと消す
+    # 木とmanifestは同じバッチで書き込むので、中断しても次の実行で書き込まれていないファイルから再開できる
+    def update_from_basepath(self, basepath, *args, **kwargs):
+        basepath = os.path.abspath(basepath)
+        manifest = self.kvs["manifest"]
+        paths = list(find_all_files(basepath, [".xml"]))
+        removed = set(manifest.keys(prefix=os.path.join(basepath, ""))) - set(paths)
+        changed, refreshed = dict(), dict()
+        for path, old in zip(paths, manifest.get_many(paths)):
+            st = os.stat(path)
+            if old is not None and old[0] == st.st_size and old[1] == st.st_mtime_ns:
                 continue
-            leaf = item
-            yield leaf
-"""
\ No newline at end of file
+            digest = file_digest(path)
+            if old is not None and old[2] == digest:
+                refreshed[path] = (st.st_size, st.st_mtime_ns, digest, old[3])
+            else:
+                changed[path] = (st.st_size, st.st_mtime_ns, digest, None if old is None else old[3])
+        with self.kvs.write_batch() as wb:
+            for path in sorted(removed):
+                self._delete_tree(wb, manifest[path][3])
+                wb.delete_manifest(path)
+            for path, entry in refreshed.items():
+                wb.set_manifest(path, entry)
+        if self.index is not None:
+            self.index.flush()
+        stats = self.add_tree_sources_from_paths(sorted(changed), *args, manifest=changed, **kwargs)
+        stats.unchanged = len(paths) - len(changed)
+        stats.removed = len(removed)
+        return stats
+
+    def _delete_tree(self, wb, code):
+        for sentence_code in wb.delete_tree(code):
+            if self.index is not None:
+                self.index.remove(sentence_code)
+
+    # manifestを渡すと、書き込んだファイルの記録も同じバッチで更新する
+    def add_tree_sources_from_paths(self, tree_source_paths, callback=None, callback_interval=1000, manifest=None):
+        stats = IngestionStats()
+        q = queue.Queue(self.qsize)
+        writer_errors = []
+        writer = threading.Thread(
+            target=self._write_from_queue,
+            args=(q, stats, writer_errors, callback, callback_interval, manifest)
+            )
+        writer.start()
+        try:
+            with ProcessPoolExecutor(self.proc_count) as executor:
+                futures = dict()
+                for path in tree_source_paths:
+                    if len(futures) >= self.qsize:
+                        self._enqueue_completed(q, futures, FIRST_COMPLETED)
+                    if len(writer_errors) > 0:
+                        break
+                    futures[executor.submit(_read_tree_source, self.reader_cls, path)] = path
+                    stats.submitted += 1
+                self._enqueue_completed(q, futures, ALL_COMPLETED)
+        finally:
+            q.put(None)
+            writer.join()
+            stats.end_time = time.time()
+        if len(writer_errors) > 0:
+            raise writer_errors[0]
+        return stats
+
+    def _enqueue_completed(self, q, futures, return_when):
+        done, _ = wait(futures, return_when=return_when)
+        for f in done:
+            path = futures.pop(f)
+            try:
+                q.put((path, f.result(), None))
+            except Exception as e:
+                q.put((path, None, e))
+
+    def _write_from_queue(self, q, stats, writer_errors, callback, callback_interval, manifest=None):
+        batch = []
+        finished = False
+        try:
+            while True:
+                item = q.get()
+                if item is None:
+                    finished = True
+                    break
+                path, result, error = item
+                stats.processed += 1
+                if error is not None:
+                    stats.failed += 1
+                    stats.errors.append((path, error))
+                else:
+                    batch.append((path, result))
+                    if len(batch) >= self.batch_size:
+                        self._write_batch(batch, stats, manifest)
+                if callback is not None and stats.processed % callback_interval == 0:
+                    callback(stats)
+            self._write_batch(batch, stats, manifest)
+        except Exception as e:
+            writer_errors.append(e)
+            # 書き込みに失敗してもキューを空にしてパース側を止めないようにする
+            while not finished and q.get() is not None:
+                pass
+
+    def _write_batch(self, batch, stats, manifest=None):
+        if len(batch) == 0:
+            return
+        with self.kvs.write_batch() as wb:
+            for path, (lawdata, tree) in batch:
+                if manifest is not None:
+                    # 古い要素が残らないよう、以前の内容を消してから書き込む
+                    old_code = manifest[path][3]
+                    if old_code is not None:
+                        self._delete_tree(wb, old_code)
+                    if old_code != lawdata.code and self.kvs["lawdata"].get(lawdata.code) is not None:
+                        self._delete_tree(wb, lawdata.code)
+                    wb.set_manifest(path, manifest[path][:3] + (lawdata.code,))
+                    is_new = True
+                else:
+                    is_new = self.kvs["lawdata"].get(lawdata.code) is None
+                # 例規コードの下のキーは消したか元々無いので、要素ごとに存在を確かめない
+                wb.set_tree(lawdata, tree, is_new=is_new)
+        if self.index is not None:
+            for path, (lawdata, tree) in batch:
+                self.index.add_tree(tree)
+            self.index.flush()
+        stats.written += len(batch)
+        del batch[:]
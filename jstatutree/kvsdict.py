@@ -1,16 +1,146 @@
 import plyvel
 import pickle
-from collections import UserDict
+import marshal
+from collections import UserDict, namedtuple, OrderedDict, Counter
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from itertools import islice
 import os
+
+Codec = namedtuple("Codec", "name dumps loads")
+
+# 文字列のリスト: 各要素の後ろに\x00を置いて連結する(\x00を含む要素はValueError)
+def _dump_strlist(val):
+    for s in val:
+        if "\x00" in s:
+            raise ValueError("strlist element must not contain \\x00: {!r}".format(s))
+    return "".join(s + "\x00" for s in val).encode("utf8")
+
+def _load_strlist(data):
+    return data.decode("utf8").split("\x00")[:-1]
+
+CODECS = {
+    "pickle": Codec("pickle", pickle.dumps, pickle.loads),
+    "marshal": Codec("marshal", marshal.dumps, marshal.loads),
+    "utf8": Codec("utf8", lambda val: val.encode("utf8"), lambda data: data.decode("utf8")),
+    "strlist": Codec("strlist", _dump_strlist, _load_strlist),
+    "bytes": Codec("bytes", bytes, bytes),
+    }
+
+def register_codec(name, dumps, loads):
+    CODECS[name] = Codec(name, dumps, loads)
+    return CODECS[name]
+
+# 管理用のキーは物理的なDB上で\xffから始める(utf8でエンコードしたキーは\xffで始まらない)
+META_PREFIX = b"\xff"
+
+# prefixで始まるキーの直後の境界(prefix範囲の終端)
+def prefix_stop(prefix):
+    prefix = prefix.rstrip(b"\xff")
+    if len(prefix) == 0:
+        return None
+    return prefix[:-1] + bytes([prefix[-1] + 1])
+
+# 物理的なDBごとに一つ作り、その上の全てのKVSDictで共有する件数の表
+# 件数を管理しているprefixについて、書き込みと同じバッチで件数もDBに記録する
+# (LevelDBは一つのプロセスからしか開けないので、メモリ上の値を正とする)
+class KVSCounts(object):
+    KEY = META_PREFIX + b"count\x00"
+
+    def __init__(self, root_db):
+        self.root_db = root_db
+        self.counts = {k[len(self.KEY):]: int(v) for k, v in root_db.iterator(prefix=self.KEY)}
+        # 件数を管理するprefixが増えるたびに変わる(BatchWriterはprefixの絞り込みをこれでキャッシュする)
+        self.version = 0
+
+    def get(self, prefix):
+        return self.counts.get(prefix)
+
+    def prefixes_of(self, full_key):
+        return [p for p in self.counts if full_key.startswith(p)]
+
+    def register(self, prefix, count):
+        self.root_db.put(self.KEY + prefix, str(count).encode())
+        self.counts[prefix] = count
+        self.version += 1
+
+    def put_deltas(self, wb, deltas):
+        for prefix, delta in deltas.items():
+            if delta != 0:
+                wb.put(self.KEY + prefix, str(self.counts[prefix] + delta).encode())
+
+    def commit_deltas(self, deltas):
+        for prefix, delta in deltas.items():
+            self.counts[prefix] += delta
+
+_MISSING = object()
+_ABSENT = object()
+
+# デコード済みの値を最近使った順に保持するキャッシュ(件数またはバイト数で上限を決める)
+# 値のバイト数はDB上のエンコード済みの長さで数え、DBに無いキーも_ABSENTとして覚える
+# キャッシュした値は読み出し元で共有されるので、書き換えないこと
+class LRUCache(object):
+    def __init__(self, max_entries=None, max_bytes=None):
+        assert max_entries is not None or max_bytes is not None, "Specify max_entries or max_bytes."
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+    def get(self, key):
+        item = self.entries.get(key)
+        if item is None:
+            self.misses += 1
+            return _MISSING
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return item[0]
+
+    def put(self, key, val, size):
+        self.discard(key)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        self.entries[key] = (val, size)
+        self.nbytes += size
+        while (self.max_entries is not None and len(self.entries) > self.max_entries) or \
+                (self.max_bytes is not None and self.nbytes > self.max_bytes):
+            _, (_, s) = self.entries.popitem(last=False)
+            self.nbytes -= s
+
+    def discard(self, key):
+        item = self.entries.pop(key, None)
+        if item is not None:
+            self.nbytes -= item[1]
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+
 class KVSDict(object):
     ENCODING = "utf8"
     PREFIX = "example-"
+    CODEC = "pickle"
+    # 件数の管理で書き込み前に読む無いキーを、ファイルを読まずに判定できるようにする
+    BLOOM_FILTER_BITS = 10
+    cache = None
 
-    def __init__(self, path, create_if_missing=True, _called_by_classmethod=False, *args, **kwargs):
+    def __init__(self, path, create_if_missing=True, _called_by_classmethod=False, *args, codec=None, **kwargs):
         if _called_by_classmethod:
             return self
         self.path = path
-        self.db = plyvel.DB(self.path, create_if_missing=create_if_missing)
+        self.db = plyvel.DB(self.path, create_if_missing=create_if_missing, bloom_filter_bits=self.BLOOM_FILTER_BITS)
+        self._counts = KVSCounts(self.db)
+        self._caches = []
+        self._init_meta(codec)
 
     def to_dict(self):
         return {k:v for k, v in self.items()}
@@ -39,6 +169,9 @@ class KVSDict(object):
         instance = cls(path=kvsdict.path, _called_by_classmethod=True, *args, **kwargs)
         instance.prefix = prefix
         instance.db = kvsdict.db.prefixed_db(instance.prefix)
+        instance._counts = kvsdict._counts
+        instance._caches = kvsdict._caches
+        instance._init_meta(kwargs.get("codec"))
         return instance
 
     @property
@@ -54,6 +187,66 @@ class KVSDict(object):
             path += ".ldb"
         self._path = path
 
+    # prefixed_dbの場合も含めた物理的なDBとそのDB上でのprefix
+    @property
+    def root_db(self):
+        return self.db.db if self.is_prefixed_db() else self.db
+
+    @property
+    def full_prefix(self):
+        return self.db.prefix if self.is_prefixed_db() else b""
+
+    def _meta_key(self, name):
+        return META_PREFIX + name.encode(self.ENCODING) + b"\x00" + self.full_prefix
+
+    # codecを省略した場合はDBに記録されたものを使う
+    # 記録がなく、既に値がある辞書はcodec導入以前のものなのでpickleとみなす
+    # 件数は空の辞書なら0から数え始め、既に値がある場合は最初のlen()で数える
+    def _init_meta(self, codec=None):
+        is_empty = self.is_empty()
+        if is_empty and self._counts.get(self.full_prefix) is None:
+            self._counts.register(self.full_prefix, 0)
+        stored = self.root_db.get(self._meta_key("codec"))
+        if stored is not None:
+            name = stored.decode(self.ENCODING)
+        elif is_empty:
+            name = self.CODEC if codec is None else codec
+            assert name in CODECS, "Unknown codec: {}".format(name)
+            self.root_db.put(self._meta_key("codec"), name.encode(self.ENCODING))
+        else:
+            name = "pickle"
+        if codec is not None and codec != name:
+            raise ValueError("{0} is stored with codec {1}, not {2}".format(self.path, name, codec))
+        self.codec = CODECS[name]
+
+    # prefix・start・stop(いずれもキーの文字列)をLevelDBのiteratorの範囲[start, stop)に変換する
+    def _iterator(self, db=None, prefix=None, start=None, stop=None, **kwargs):
+        start = None if start is None else self._encode_key(start)
+        stop = None if stop is None else self._encode_key(stop)
+        if prefix is not None:
+            prefix = self._encode_key(prefix)
+            if len(prefix) > 0:
+                start = prefix if start is None else max(start, prefix)
+                stop = prefix_stop(prefix) if stop is None else min(stop, prefix_stop(prefix))
+        if not self.is_prefixed_db():
+            stop = META_PREFIX if stop is None else min(stop, META_PREFIX)
+        if start is not None and stop is not None and start >= stop:
+            return iter(())
+        return (self.db if db is None else db).iterator(start=start, stop=stop, **kwargs)
+
+    # キャッシュは同じ物理的なDB上の全てのKVSDict・BatchWriterからの書き込みで無効化される
+    def enable_cache(self, max_entries=None, max_bytes=None):
+        self.disable_cache()
+        self.cache = LRUCache(max_entries=max_entries, max_bytes=max_bytes)
+        self.cache.prefix = self.full_prefix
+        self._caches.append(self.cache)
+        return self.cache
+
+    def disable_cache(self):
+        if self.cache is not None:
+            self._caches.remove(self.cache)
+            self.cache = None
+
     def _encode_key(self, key):
         return key.encode(self.ENCODING)
 
@@ -71,37 +264,117 @@ class KVSDict(object):
     def snapshot(self):
         return SnapShot(self)
 
+    # 件数を管理しているprefixのキーの追加・削除は、件数の更新と一つのバッチで書き込む
+    def _write_counted(self, key, val=None, delete=False):
+        k = self._encode_key(key)
+        prefixes = self._counts.prefixes_of(self.full_prefix + k)
+        # 件数が変わらない書き込み(既存キーの上書き、無いキーの削除)はそのまま行う
+        if len(prefixes) == 0 or (self.db.get(k) is None) == delete:
+            if delete:
+                self.db.delete(k)
+            else:
+                self.db.put(k, self.codec.dumps(val))
+            invalidate_caches(self._caches, [self.full_prefix + k])
+            return
+        deltas = {p: -1 if delete else 1 for p in prefixes}
+        with self.root_db.write_batch(transaction=True) as wb:
+            if delete:
+                wb.delete(self.full_prefix + k)
+            else:
+                wb.put(self.full_prefix + k, self.codec.dumps(val))
+            self._counts.put_deltas(wb, deltas)
+        self._counts.commit_deltas(deltas)
+        invalidate_caches(self._caches, [self.full_prefix + k])
+
     def __setitem__(self, key, val):
-        self.db.put(self._encode_key(key), pickle.dumps(val))
+        self._write_counted(key, val)
+
+    def _get(self, k):
+        cache = self.cache
+        if cache is not None:
+            val = cache.get(k)
+            if val is not _MISSING:
+                return val
+        raw = self.db.get(k)
+        val = _ABSENT if raw is None else self.codec.loads(raw)
+        if cache is not None:
+            cache.put(k, val, len(k) if raw is None else len(raw))
+        return val
 
     def __getitem__(self, key):
-        return pickle.loads(self.db.get(self._encode_key(key)))
+        val = self._get(self._encode_key(key))
+        if val is _ABSENT:
+            raise KeyError(key)
+        return val
 
     def __delitem__(self, key):
-        self.db.delete(self._encode_key(key))
+        self._write_counted(key, delete=True)
 
-    def items(self):
-        return ((self._decode_key(k), pickle.loads(v)) for k, v in self.db.iterator(include_key=True, include_value=True))
+    def items(self, prefix=None, start=None, stop=None, reverse=False):
+        loads = self.codec.loads
+        iterator = self._iterator(prefix=prefix, start=start, stop=stop, reverse=reverse, include_key=True, include_value=True)
+        return ((self._decode_key(k), loads(v)) for k, v in iterator)
 
-    def keys(self):
-        return (self._decode_key(k) for k in self.db.iterator(include_key=True, include_value=False))
+    def keys(self, prefix=None, start=None, stop=None, reverse=False):
+        iterator = self._iterator(prefix=prefix, start=start, stop=stop, reverse=reverse, include_key=True, include_value=False)
+        return (self._decode_key(k) for k in iterator)
 
-    def values(self):
-        return (pickle.loads(v) for v in self.db.iterator(include_key=False, include_value=True))
+    def values(self, prefix=None, start=None, stop=None, reverse=False):
+        loads = self.codec.loads
+        iterator = self._iterator(prefix=prefix, start=start, stop=stop, reverse=reverse, include_key=False, include_value=True)
+        return (loads(v) for v in iterator)
 
     def get(self, key, default=None):
-        val = self.db.get(self._encode_key(key))
-        if val is None:
-            return default
-        else:
-            return pickle.loads(val)
+        val = self._get(self._encode_key(key))
+        return default if val is _ABSENT else val
+
+    # キーをソートして一つのiteratorで順に読み、keysの順で値を返す
+    def get_many(self, keys, default=None):
+        encoded = [self._encode_key(key) for key in keys]
+        found = dict()
+        cache = self.cache
+        if cache is not None:
+            for k in encoded:
+                val = cache.get(k)
+                if val is not _MISSING:
+                    found[k] = val
+        targets = sorted(set(k for k in encoded if k not in found))
+        if len(targets) > 0:
+            raws = dict()
+            with self.db.iterator(include_key=True, include_value=True) as iterator:
+                item = None
+                for k in targets:
+                    # 直前に読んだキーより後ろにある場合だけseekする
+                    if item is None or item[0] < k:
+                        iterator.seek(k)
+                        item = next(iterator, None)
+                    if item is None:
+                        break
+                    if item[0] == k:
+                        raws[k] = item[1]
+            loads = self.codec.loads
+            for k in targets:
+                raw = raws.get(k)
+                found[k] = _ABSENT if raw is None else loads(raw)
+                if cache is not None:
+                    cache.put(k, found[k], len(k) if raw is None else len(raw))
+        return [default if found[k] is _ABSENT else found[k] for k in encoded]
 
     def __len__(self):
-        l = 0
-        for _ in self.keys():
-            l += 1
+        l = self._counts.get(self.full_prefix)
+        if l is None:
+            l = 0
+            for _ in self.keys():
+                l += 1
+            self._counts.register(self.full_prefix, l)
         return l
 
+    # LevelDBの推定値(バイト数)で、まだファイルに書き出されていない書き込みは含まれない
+    def approximate_size(self, prefix=None):
+        start = self.full_prefix + (b"" if prefix is None else self._encode_key(prefix))
+        stop = prefix_stop(start) if len(start) > 0 else META_PREFIX
+        return self.root_db.approximate_size(start, stop)
+
     def is_prefixed_db(self):
         return isinstance(self.db, plyvel._plyvel.PrefixedDB)
 
@@ -113,7 +386,7 @@ class KVSDict(object):
         self.close()
 
     def is_empty(self):
-        with self.db.iterator(include_key=True, include_value=False) as iterator:
+        with self._iterator(include_key=True, include_value=False) as iterator:
             for _ in iterator:
                 return False
         return True
@@ -121,27 +394,37 @@ class KVSDict(object):
 class SnapShot(object):
     def __init__(self, kvsdict):
         self.ss = kvsdict.db.snapshot()
+        self.codec = kvsdict.codec
         self._encode_key = kvsdict._encode_key
         self._decode_key = kvsdict._decode_key
+        self._iterator = lambda **kwargs: kvsdict._iterator(db=self.ss, **kwargs)
 
     def __getitem__(self, key):
-        return pickle.loads(self.ss.get(self._encode_key(key)))
+        val = self.ss.get(self._encode_key(key))
+        if val is None:
+            raise KeyError(key)
+        return self.codec.loads(val)
 
-    def items(self):
-        return ((self._decode_key(k), pickle.loads(v)) for k, v in self.ss.iterator(include_key=True, include_value=True))
+    def items(self, prefix=None, start=None, stop=None, reverse=False):
+        loads = self.codec.loads
+        iterator = self._iterator(prefix=prefix, start=start, stop=stop, reverse=reverse, include_key=True, include_value=True)
+        return ((self._decode_key(k), loads(v)) for k, v in iterator)
 
-    def keys(self):
-        return (self._decode_key(k) for k in self.ss.iterator(include_key=True, include_value=False))
+    def keys(self, prefix=None, start=None, stop=None, reverse=False):
+        iterator = self._iterator(prefix=prefix, start=start, stop=stop, reverse=reverse, include_key=True, include_value=False)
+        return (self._decode_key(k) for k in iterator)
 
-    def values(self):
-        return (pickle.loads(v) for v in self.ss.iterator(include_key=False, include_value=True))
+    def values(self, prefix=None, start=None, stop=None, reverse=False):
+        loads = self.codec.loads
+        iterator = self._iterator(prefix=prefix, start=start, stop=stop, reverse=reverse, include_key=False, include_value=True)
+        return (loads(v) for v in iterator)
 
     def get(self, key, default=None):
         val = self.ss.get(self._encode_key(key))
         if val is None:
             return default
         else:
-            return pickle.loads(val)
+            return self.codec.loads(val)
 
     def __enter__(self):
         return self
@@ -155,17 +438,74 @@ class SnapShot(object):
     def close(self):
         self.ss.close()
 
+def invalidate_caches(caches, full_keys):
+    for cache in caches:
+        for full_key in full_keys:
+            if full_key.startswith(cache.prefix):
+                cache.discard(full_key[len(cache.prefix):])
+
+# 物理的なDBのWriteBatchに書き込む
+# 同じDB上のBatchWriterをwbに渡すと、複数のKVSDict(prefixが異なるもの)への書き込みを一つのバッチにまとめられる
 class BatchWriter(object):
-    def __init__(self, kvsdict, *args, **kwargs):
-        self.wb = kvsdict.db.write_batch(*args, **kwargs)
+    def __init__(self, kvsdict, *args, wb=None, **kwargs):
+        if wb is None:
+            self.wb = kvsdict.root_db.write_batch(*args, **kwargs)
+            # 件数を管理しているキーについて、このバッチでの書き込み後に存在するか
+            self.touched = dict()
+            self.deltas = dict()
+            self.written = set()
+        else:
+            assert isinstance(wb, BatchWriter), "wb must be a BatchWriter on the same db"
+            self.wb, self.touched, self.deltas, self.written = wb.wb, wb.touched, wb.deltas, wb.written
+        self.caches = kvsdict._caches
+        self.root_db = kvsdict.root_db
+        self.counts = kvsdict._counts
+        self.prefix = kvsdict.full_prefix
+        self.dumps = kvsdict.codec.dumps
         self._encode_key = kvsdict._encode_key
         self.ENCODING = kvsdict.ENCODING
+        self._prefixes_version = None
+
+    # 全てのキーはself.prefixで始まるので、件数を管理するprefixのうちself.prefixの前方部分であるものは毎回調べない
+    def _prefixes_of(self, full_key):
+        if self._prefixes_version != self.counts.version:
+            self._prefixes_version = self.counts.version
+            self._outer = tuple(p for p in self.counts.counts if self.prefix.startswith(p))
+            self._inner = [p for p in self.counts.counts if p.startswith(self.prefix) and len(p) > len(self.prefix)]
+        if len(self._inner) == 0:
+            return self._outer
+        return self._outer + tuple(p for p in self._inner if full_key.startswith(p))
+
+    # is_new=Trueなら、このバッチで書き込んでいないキーはDBに無いものとして読まずに数える
+    def _count(self, full_key, exists, is_new=False):
+        prefixes = self._prefixes_of(full_key)
+        if len(prefixes) == 0:
+            return
+        existed = self.touched.get(full_key)
+        if existed is None:
+            existed = False if is_new else self.root_db.get(full_key) is not None
+        self.touched[full_key] = exists
+        # 増減はprefixの組ごとにまとめ、writeでprefixごとに展開する
+        if existed != exists:
+            self.deltas[prefixes] = self.deltas.get(prefixes, 0) + (1 if exists else -1)
 
     def __setitem__(self, key, val):
-        self.wb.put(self._encode_key(key), pickle.dumps(val))
+        self.put(key, val)
+
+    # DBに無いことが分かっているキー(消したばかりの例規の要素など)はis_new=Trueとすると件数の確認を省ける
+    def put(self, key, val, is_new=False):
+        full_key = self.prefix + self._encode_key(key)
+        self._count(full_key, True, is_new)
+        if len(self.caches) > 0:
+            self.written.add(full_key)
+        self.wb.put(full_key, self.dumps(val))
 
     def __delitem__(self, key):
-        self.wb.delete(self._encode_key(key))
+        full_key = self.prefix + self._encode_key(key)
+        self._count(full_key, False)
+        if len(self.caches) > 0:
+            self.written.add(full_key)
+        self.wb.delete(full_key)
 
     def __enter__(self):
         return self
@@ -177,26 +517,100 @@ class BatchWriter(object):
         return True
 
     def write(self):
+        deltas = dict()
+        for prefixes, delta in self.deltas.items():
+            for p in prefixes:
+                deltas[p] = deltas.get(p, 0) + delta
+        self.counts.put_deltas(self.wb, deltas)
         self.wb.write()
+        self.counts.commit_deltas(deltas)
+        invalidate_caches(self.caches, self.written)
+        self.wb.clear()
+        self.touched.clear()
+        self.deltas.clear()
+        self.written.clear()
 
 class KVSPrefixDict(KVSDict):
-    def __init__(self, kvsdict, prefix=None, *args, **kwargs):
+    def __init__(self, kvsdict, prefix=None, *args, codec=None, **kwargs):
         self.prefix = prefix
         self.path = kvsdict.path
         self.db = kvsdict.db.prefixed_db(self.prefix)
+        self._counts = kvsdict._counts
+        self._caches = kvsdict._caches
+        self._init_meta(codec)
+
+# 値をデコードして数える(KVSValuesCounter.add_from_kvsのworker)
+def _count_raw_values(codec_name, raws):
+    loads = CODECS[codec_name].loads
+    return Counter(loads(raw) for raw in raws)
 
 class KVSCounterBase(KVSDict):
-    def __init__(self, kvsdict, overwrite=False):
+    CODEC = "marshal"
+    MAX_ENTRIES = 1000000
+    CHUNK_SIZE = 10000
+
+    def __init__(self, kvsdict, overwrite=False, **kwargs):
         dirpath, dbfilename = os.path.split(kvsdict.path)
         path = os.path.join(dirpath, "Counter-"+dbfilename)
         super().__init__(path=path)
         if overwrite or self.is_empty():
             print("count begin")
-            self.add_from_kvs(kvsdict)
+            if overwrite:
+                self.clear()
+            self.add_from_kvs(kvsdict, **kwargs)
+
+    def clear(self):
+        with self.write_batch() as wb:
+            for k in self.keys():
+                del wb[k]
+
+    # 増分(負でもよい)をDBの件数に足す
+    # キーをソートしてget_manyで読み、書き込みは一つのバッチで行う
+    def update(self, counts):
+        counts = counts if isinstance(counts, Counter) else Counter(counts)
+        keys = sorted(counts)
+        with self.write_batch() as wb:
+            for key, count in zip(keys, self.get_many(keys, default=0)):
+                count += counts[key]
+                if count > 0:
+                    wb[key] = count
+                elif count < 0:
+                    raise ValueError("count of {} becomes negative".format(key))
+                else:
+                    del wb[key]
+
+    def subtract(self, counts):
+        counts = counts if isinstance(counts, Counter) else Counter(counts)
+        self.update(Counter({k: -v for k, v in counts.items()}))
 
 class KVSValuesCounter(KVSCounterBase):
-    def add_from_kvs(self, kvsdict):
+    # メモリ上で数え、異なる値がmax_entriesを超えたらDBに書き出す
+    # proc_countを指定すると、値のデコードと集計をCHUNK_SIZE件ずつworkerプロセスに分担させる
+    # (LevelDBは一つのプロセスからしか開けないので、読み出しはこのプロセスで行う)
+    # prefix・start・stopで後から追加された範囲だけを数え足すこともできる
+    def add_from_kvs(self, kvsdict, max_entries=None, proc_count=None, prefix=None, start=None, stop=None):
+        max_entries = self.MAX_ENTRIES if max_entries is None else max_entries
+        counts = Counter()
+        def add(partial):
+            counts.update(partial)
+            if len(counts) >= max_entries:
+                self.update(counts)
+                counts.clear()
         with kvsdict.snapshot() as snapshot:
-            for v in snapshot.values():
-                self[v] = self.get(v, 0)+1
-
+            raws = snapshot._iterator(prefix=prefix, start=start, stop=stop, include_key=False, include_value=True)
+            chunks = iter(lambda: list(islice(raws, self.CHUNK_SIZE)), [])
+            if proc_count is None:
+                for chunk in chunks:
+                    add(_count_raw_values(kvsdict.codec.name, chunk))
+            else:
+                with ProcessPoolExecutor(proc_count) as executor:
+                    futures = set()
+                    for chunk in chunks:
+                        if len(futures) >= proc_count * 2:
+                            done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                            for f in done:
+                                add(f.result())
+                        futures.add(executor.submit(_count_raw_values, kvsdict.codec.name, chunk))
+                    for f in futures:
+                        add(f.result())
+        self.update(counts)
@@ -136,44 +136,132 @@ class ReikiData(LawData):
         return hash(self.code)
 
 
+_NO_ARG = object()
+NUM_PATTERN = re.compile("^[0-9]+(?:_[0-9]+)*$")
+
+# 要素番号を(本番号, 枝番号, ...)のタプルで保持する
+# 不変オブジェクトなので、よく使われる番号は使い回す
 class ElementNumber(object):
-    def __init__(self, arg):
+    __slots__ = ("key", "_str")
+    INTERN_RANGE = range(0, 201)
+
+    def __new__(cls, arg=_NO_ARG):
+        if arg is _NO_ARG:
+            # unpickle時
+            return object.__new__(cls)
+        if isinstance(arg, ElementNumber):
+            return arg
         if isinstance(arg, int):
-            self.num = Decimal(arg)     
+            key = (arg,)
         elif isinstance(arg, str):
-            self.num = self.str_to_decimal(arg)
+            key = cls.str_to_key(arg)
         elif isinstance(arg, (Decimal,)):
-            self.num = arg
-        elif isinstance(arg, (ElementNumber,)):
-            self.num = arg.num
+            key = cls.decimal_to_key(arg)
         else:
             raise TypeError("Invalid type for init ElementNumber: {}".format(arg.__class__.__name__))
+        return cls.from_key(key)
+
+    @classmethod
+    def from_key(cls, key):
+        while len(key) > 1 and key[-1] == 0:
+            key = key[:-1]
+        if len(key) == 1 and key[0] in cls.INTERN_RANGE and _INTERNED is not None:
+            return _INTERNED[key[0]]
+        num = object.__new__(cls)
+        num.key = key
+        num._str = None
+        return num
 
-    def __float__(self):
-        return float(self.num)
-
-    @property
-    def main_num(self):
-        return self.num.quantize(Decimal('1'))
-
-    @property
-    def branch_nums(self):
-        branch_nums = []
-        num = self.num - self.main_num
-        while num.quantize(Decimal('1')) != Decimal(0):
-            num *= 100
-            branch_nums += [num.quantize(Decimal('1'))]
-            num = num - num.quantize(Decimal('1'))
-        return branch_nums
-
-    def str_to_decimal(self, strnum):
+    @staticmethod
+    def str_to_key(strnum):
         if strnum == "":
-            return Decimal(1)
-        if re.match("^[0-9]+(?:_[0-9]+)*$", strnum) is None:
+            return (1,)
+        if strnum.isdecimal() and strnum.isascii():
+            return (int(strnum),)
+        if NUM_PATTERN.match(strnum) is None:
             raise LawElementNumberError(error_detail="Invalid Format {}".format(strnum))
+        return tuple(int(n) for n in strnum.split("_"))
+
+    # 旧形式(枝番号を1000分の1ずつ小数部に詰めたDecimal)との互換用
+    @staticmethod
+    def decimal_to_key(num):
+        main_num = int(num)
+        key = [main_num]
+        frac = num - main_num
+        while frac != 0:
+            frac *= 1000
+            key.append(int(frac))
+            frac -= int(frac)
+        return tuple(key)
+
+    @property
+    def num(self):
         num = Decimal(0)
         mul = Decimal(1)
-        for n in strnum.split("_"):
+        for n in self.key:
             num += Decimal(n) * mul
             mul /= Decimal(1000)
         return num
+
+    @property
+    def main_num(self):
+        return self.key[0]
+
+    @property
+    def branch_nums(self):
+        return list(self.key[1:])
+
+    def __float__(self):
+        return float(self.num)
+
+    def __int__(self):
+        return self.key[0]
+
+    def __str__(self):
+        if self._str is None:
+            self._str = "_".join([str(n) for n in self.key])
+        return self._str
+
+    def __repr__(self):
+        return "ElementNumber('{}')".format(str(self))
+
+    def __eq__(self, other):
+        if not isinstance(other, ElementNumber):
+            return NotImplemented
+        return self.key == other.key
+
+    def __ne__(self, other):
+        if not isinstance(other, ElementNumber):
+            return NotImplemented
+        return self.key != other.key
+
+    def __lt__(self, other):
+        return self.key < other.key
+
+    def __le__(self, other):
+        return self.key <= other.key
+
+    def __gt__(self, other):
+        return self.key > other.key
+
+    def __ge__(self, other):
+        return self.key >= other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __reduce__(self):
+        return (ElementNumber, (str(self),))
+
+    # 旧形式でpickleされたElementNumber({"num": Decimal})の読み込み
+    def __setstate__(self, state):
+        if isinstance(state, tuple):
+            state = state[-1] if state[0] is None else state[0]
+        if isinstance(state, dict) and "num" in state:
+            self.key = self.decimal_to_key(state["num"])
+        else:
+            self.key = state["key"]
+        self._str = None
+
+_INTERNED = None
+_INTERNED = [ElementNumber.from_key((n,)) for n in ElementNumber.INTERN_RANGE]
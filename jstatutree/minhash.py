@@ -0,0 +1,160 @@
+import hashlib
+import numpy as np
+from .kvsdict import KVSDict, KVSPrefixDict
+
+PRIME = np.uint64(4294967291)
+MAX_HASH = np.uint64(0xffffffff)
+CHUNK_SIZE = 4096
+
+# 文字n-gramごとの64bitハッシュ値(textがn文字未満なら空)
+# 文字コードの多項式ハッシュをnumpyで計算するので、プロセスをまたいでも同じ値になる
+def ngram_hashes(text, n):
+    codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    h = np.zeros(max(len(codes) - n + 1, 0), dtype=np.uint64)
+    for j in range(n):
+        h = h * np.uint64(1000003) + codes[j:j+len(h)]
+    return h ^ (h >> np.uint64(32))
+
+# 文字k-gram(shingle)のハッシュ値(32bit)の集合
+def shingle_hashes(text, k=5):
+    if len(text) == 0:
+        return np.zeros(0, dtype=np.uint64)
+    return np.unique(ngram_hashes(text, min(k, len(text))) & MAX_HASH)
+
+def element_text(elem):
+    return "".join(e.text for e in elem.depth_first_iteration())
+
+class MinHasher(object):
+    def __init__(self, num_perm=128, k=5, seed=1):
+        rng = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self.k = k
+        self.a = rng.randint(1, int(PRIME), size=num_perm).astype(np.uint64)
+        self.b = rng.randint(0, int(PRIME), size=num_perm).astype(np.uint64)
+
+    # (a*x+b) mod PRIMEの最小値をnum_perm通り求める(a, x < 2**32なので64bitで溢れない)
+    def signature(self, text):
+        hashes = shingle_hashes(text, self.k)
+        sig = np.full(self.num_perm, MAX_HASH, dtype=np.uint64)
+        for i in range(0, len(hashes), CHUNK_SIZE):
+            x = hashes[i:i+CHUNK_SIZE]
+            np.minimum(sig, ((self.a[:, None] * x[None, :] + self.b[:, None]) % PRIME).min(axis=1), out=sig)
+        return sig.astype(np.uint32)
+
+def estimate_similarity(sig, other):
+    return float(np.mean(sig == other))
+
+# MinHashの署名をbands個の帯に分け、帯ごとのバケットをLevelDBに保存する
+# buckets: "帯番号+帯のハッシュ値\x00code" -> b"", sigs: code -> 署名
+# 一つでも帯が一致した組を候補とし、署名の一致率でJaccard係数を推定する
+class MinHashLSH(object):
+    def __init__(self, path, num_perm=128, bands=32, k=5, seed=1):
+        assert num_perm % bands == 0, "num_perm must be a multiple of bands"
+        self.db = KVSDict(path=path)
+        self.meta = KVSPrefixDict(self.db, prefix="meta-", codec="marshal")
+        params = (num_perm, bands, k, seed)
+        stored = self.meta.get("params")
+        if stored is None:
+            self.meta["params"] = params
+        elif tuple(stored) != params:
+            raise ValueError("{0} is built with (num_perm, bands, k, seed)={1}".format(path, tuple(stored)))
+        self.hasher = MinHasher(num_perm=num_perm, k=k, seed=seed)
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.sigs = KVSPrefixDict(self.db, prefix="sig-", codec="bytes")
+        self.buckets = KVSPrefixDict(self.db, prefix="band-", codec="bytes")
+
+    def close(self):
+        self.db.close()
+
+    def __len__(self):
+        return len(self.sigs)
+
+    def _bucket_prefixes(self, sig):
+        return [
+            "{0:03d}{1}\x00".format(i, hashlib.blake2b(sig[i*self.rows:(i+1)*self.rows].tobytes(), digest_size=8).hexdigest())
+            for i in range(self.bands)
+            ]
+
+    def _load_sig(self, data):
+        return np.frombuffer(data, dtype=np.uint32)
+
+    # 既に登録されているcodeは署名を置き換える
+    def add(self, code, text):
+        if len(text) == 0:
+            return
+        self.add_signature(code, self.hasher.signature(text))
+
+    def add_signature(self, code, sig):
+        with self.db.write_batch() as wb:
+            sigs, buckets = self.sigs.write_batch(wb=wb), self.buckets.write_batch(wb=wb)
+            self._remove(code, sigs, buckets)
+            sigs[code] = sig.tobytes()
+            for prefix in self._bucket_prefixes(sig):
+                buckets[prefix + code] = b""
+
+    def remove(self, code):
+        with self.db.write_batch() as wb:
+            self._remove(code, self.sigs.write_batch(wb=wb), self.buckets.write_batch(wb=wb))
+
+    def _remove(self, code, sigs, buckets):
+        old = self.sigs.get(code)
+        if old is None:
+            return
+        del sigs[code]
+        for prefix in self._bucket_prefixes(self._load_sig(old)):
+            del buckets[prefix + code]
+
+    # target_etypeを指定すると、木全体ではなくその階層の要素(条など)ごとに登録する
+    def add_tree(self, tree, target_etype=None):
+        if target_etype is None:
+            self.add(tree.lawdata.code, element_text(tree))
+            return
+        for elem in tree.depth_first_search(target_etype):
+            self.add(elem.code, element_text(elem))
+
+    def query(self, text, threshold=0.0, exclude=None):
+        return self.query_signature(self.hasher.signature(text), threshold=threshold, exclude=exclude)
+
+    def query_tree(self, tree, threshold=0.0):
+        code = tree.lawdata.code if tree.is_root() else tree.code
+        return self.query(element_text(tree), threshold=threshold, exclude=code)
+
+    # 候補を推定した類似度の降順で(code, 類似度)のリストとして返す
+    def query_signature(self, sig, threshold=0.0, exclude=None):
+        candidates = set()
+        for prefix in self._bucket_prefixes(sig):
+            candidates.update(key[len(prefix):] for key in self.buckets.keys(prefix=prefix))
+        candidates.discard(exclude)
+        codes = sorted(candidates)
+        results = []
+        for code, data in zip(codes, self.sigs.get_many(codes)):
+            sim = estimate_similarity(sig, self._load_sig(data))
+            if sim >= threshold:
+                results.append((code, sim))
+        return sorted(results, key=lambda x: (-x[1], x[0]))
+
+    # 全ての候補の組(code_a < code_b, 類似度)を生成する
+    # バケットを順に読み、組が最初に一致した帯でだけ出力するので、組の集合をメモリに持たない
+    # max_bucket_sizeを超えるバケット(定型文など)は読み飛ばす
+    def all_pairs(self, threshold=0.5, max_bucket_size=None):
+        bucket, members = None, []
+        for key in self.buckets.keys():
+            prefix, code = key.split("\x00", 1)
+            if prefix != bucket:
+                yield from self._bucket_pairs(bucket, members, threshold, max_bucket_size)
+                bucket, members = prefix, []
+            members.append(code)
+        yield from self._bucket_pairs(bucket, members, threshold, max_bucket_size)
+
+    def _bucket_pairs(self, bucket, members, threshold, max_bucket_size):
+        if len(members) < 2 or (max_bucket_size is not None and len(members) > max_bucket_size):
+            return
+        band = int(bucket[:3])
+        sigs = np.stack([self._load_sig(data) for data in self.sigs.get_many(members)])
+        for i in range(len(members) - 1):
+            eq = sigs[i+1:] == sigs[i]
+            first_band = eq.reshape(len(eq), self.bands, self.rows).all(axis=2).argmax(axis=1)
+            sims = eq.mean(axis=1)
+            for j in np.flatnonzero((first_band == band) & (sims >= threshold)):
+                yield (members[i], members[i+1+j], float(sims[j]))
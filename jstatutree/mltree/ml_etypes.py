@@ -12,24 +12,61 @@ def get_text(b, e_val):
 def get_etypes():
     return etypes.get_etypes_core(globals())
 
-def convert_recursively(src_root):
-    return etypes.convert_recursively(src_root, _tar_root=None, etypes_dict=globals())
+def get_compact_etypes():
+    return etypes.get_etypes_core(vars(compact))
+
+def convert_recursively(src_root, compact=False):
+    etypes_dict = vars(globals()["compact"]) if compact else globals()
+    return etypes.convert_recursively(src_root, _tar_root=None, etypes_dict=etypes_dict)
 
 class MLExpansion(object):
+    __slots__ = ()
+
     @property
     def db(self):
-        return self.parent.db if "_db" not in self.__dict__ else self._db
-    
+        db = getattr(self, "_db", None)
+        return self.parent.db if db is None else db
+
     @db.setter
     def db(self, val):
         self._db = val
 
-    def _read_children_list(self):
-        raise Exception("Unexpected Error")
+    def _find_root(self):
+        elem = self
+        while elem.parent is not None:
+            elem = elem.parent
+        return elem
+
+    # 文はDBから読み出した木であれば読み直せる
+    # 子要素はlayout="node"で保存された木(KVSReaderBase._build_rootで作った根の_node_layout)でなければ読み直せない
+    def _is_reloadable(self, value_tag):
+        root = self._find_root()
+        if getattr(root, "_db", None) is None:
+            return False
+        if value_tag == "children":
+            return getattr(root, "_node_layout", False) and self._children is not None and len(self._children) > 0
+        return True
+
+    # layout="node"で保存された要素の子要素を読む
+    # recordsを渡した場合はDBを読まずにそれを使う
+    def _read_children_list(self, records=None):
+        etypes_dict = globals() if self.ETYPES_DICT is None else self.ETYPES_DICT
+        records = self.db["node"].get(self.code, []) if records is None else records
+        for etype_name, num_key in records:
+            child = etypes_dict[etype_name].inheritance(self)
+            child._num = ElementNumber.from_key(num_key)
+            yield child
 
     def _read_num(self):
         raise Exception("Unexpected Error")
 
+    # sentenceには正規化済みの文(TreeElement.text)を保存しているので、読み出し時には正規化しない
+    @property
+    def text(self):
+        if self._text is None:
+            self._text = self._read_text()
+        return self._text
+
     def _read_text(self):
         return self.db["sentence"].get(self.code, "")
 
@@ -109,4 +146,6 @@ class Subitem5Sentence(MLExpansion, etypes.Subitem5Sentence):
     pass
 
 class Sentence(MLExpansion, etypes.Sentence):
-    pass
\ No newline at end of file
+    pass
+
+compact = etypes.make_compact_etypes(globals(), mixins=(MLExpansion,), slots=("_db", "_node_layout"))
@@ -4,9 +4,11 @@ import unicodedata
 import re
 import inspect
 import xml.etree.ElementTree as ET
-from jstatutree.lawdata import SourceInterface, ReikiData, LawData
+from jstatutree.lawdata import SourceInterface, ReikiData, LawData, ElementNumber
+from jstatutree.tree_element import normalize_str
 from . import ml_etypes
-from jstatutree.kvsdict import KVSDict
+from jstatutree.kvsdict import KVSDict, KVSPrefixDict, BatchWriter
+from jstatutree import textblob
 from time import sleep
 
 def get_text(b, e_val):
@@ -17,19 +19,101 @@ def get_text(b, e_val):
 
 ETYPES = ml_etypes.get_etypes()
 
+# layout="tree": 例規ごとに木全体をpickleしてrootに保存する
+# layout="node": 要素ごとに子要素の(etype名, 番号)の列をnodeに保存し、読み出し時に必要な部分だけ読む
+# 各辞書は一つのLevelDB(jstatutree.ldb)をprefixで分けたもので、一つの例規の書き込みは一つのバッチで行う
 class JStatutreeKVS(object):
-    def __init__(self, path):
+    LAYOUTS = ("tree", "node")
+    DBNAME = "jstatutree.ldb"
+    DICT_NAMES = ("lawdata", "root", "node", "sentence", "manifest")
+    DICT_CODECS = {"lawdata": "pickle", "root": "pickle", "node": "marshal", "sentence": "utf8", "manifest": "marshal"}
+
+    def __init__(self, path, layout="tree", cache_entries=None, cache_bytes=None):
+        assert layout in self.LAYOUTS, "Invalid layout: {}".format(layout)
         self.path = os.path.abspath(path)
+        self.layout = layout
         self.kvsdicts = dict()
-        self.kvsdicts["lawdata"] = KVSDict(path=os.path.join(self.path, "lawdata.ldb"))
-        self.kvsdicts["root"] = KVSDict(path=os.path.join(self.path, "root.ldb"))
-        self.kvsdicts["sentence"] = KVSDict(path=os.path.join(self.path, "sentence.ldb"))
+        self.text_blob = None
+        if self.is_legacy_store(self.path):
+            # 辞書ごとに別のLevelDBを使う旧形式(書き込みはアトミックにならない)
+            self.db = None
+            for name in self.DICT_NAMES:
+                self.kvsdicts[name] = KVSDict(path=os.path.join(self.path, name + ".ldb"))
+        else:
+            # 既存のDBでは各辞書に記録されたcodecを使う
+            is_new = not os.path.exists(os.path.join(self.path, self.DBNAME))
+            self.db = KVSDict(path=os.path.join(self.path, self.DBNAME))
+            for name in self.DICT_NAMES:
+                codec = self.DICT_CODECS[name] if is_new else None
+                self.kvsdicts[name] = KVSPrefixDict(self.db, prefix=name + "-", codec=codec)
+        if cache_entries is not None or cache_bytes is not None:
+            self.enable_cache(max_entries=cache_entries, max_bytes=cache_bytes)
+
+    # get_tree・read_lawdataで読む値を辞書ごとにキャッシュする(キャッシュされた木は呼び出し元で共有される)
+    def enable_cache(self, max_entries=None, max_bytes=None):
+        for kvsdict in self.kvsdicts.values():
+            kvsdict.enable_cache(max_entries=max_entries, max_bytes=max_bytes)
+
+    def cache_stats(self):
+        return {name: (d.cache.hits, d.cache.misses) for name, d in self.kvsdicts.items() if d.cache is not None}
+
+    # 例規コードの前方一致("01/010001/"など)でLevelDB上の範囲だけを読む
+    def law_codes(self, prefix=None):
+        return self["lawdata"].keys(prefix=prefix)
+
+    # codeの要素とその子孫の文をキーの(文書順ではない)順で返す
+    def sentences_under(self, code):
+        sentences = self["sentence"]
+        text = sentences.get(code)
+        if text is not None:
+            yield code, text
+        yield from sentences.items(prefix=code + "/")
+
+    # 文をmmapで読む一つのファイルに書き出す(書き出した後の変更は反映されない)
+    def export_text_blob(self, dirpath, prefix=None, normalize=False):
+        return textblob.export_text_blob(self.kvsdicts["sentence"], dirpath, prefix=prefix, normalize=normalize)
+
+    # 以降、self["sentence"]の読み出しはexport_text_blobで書き出したファイルから行う
+    # 書き込みは引き続きLevelDBに対して行う
+    def open_text_blob(self, dirpath):
+        self.close_text_blob()
+        self.text_blob = textblob.TextBlob(dirpath)
+
+    def close_text_blob(self):
+        if self.text_blob is not None:
+            self.text_blob.close()
+            self.text_blob = None
+
+    # 正規化せずに保存された文(古いバージョンで書いたものなど)を一つのバッチで正規化し直す
+    # 書き換えた文の数を返す
+    def normalize_sentences(self, prefix=None):
+        sentences = self.kvsdicts["sentence"]
+        count = 0
+        with sentences.write_batch() as wb:
+            for code, text in sentences.items(prefix=prefix):
+                normalized = normalize_str(text)
+                if normalized == text:
+                    continue
+                if len(normalized) > 0:
+                    wb[code] = normalized
+                else:
+                    del wb[code]
+                count += 1
+        return count
+
+    @classmethod
+    def is_legacy_store(cls, path):
+        return os.path.exists(os.path.join(path, "lawdata.ldb")) and not os.path.exists(os.path.join(path, cls.DBNAME))
 
     def close(self):
+        self.close_text_blob()
         for k in list(self.kvsdicts.keys()):
             self.kvsdicts[k].close()
             del self.kvsdicts[k]
         self.kvsdicts = dict()
+        if self.db is not None:
+            self.db.close()
+            self.db = None
 
     def is_closed(self):
         return len(self.kvsdicts) == 0
@@ -39,16 +123,90 @@ class JStatutreeKVS(object):
             self.close()
 
     def __getitem__(self, key):
+        if key == "sentence" and self.text_blob is not None:
+            return self.text_blob
         return self.kvsdicts[key]
 
     def set_from_reader(self, reader):
-        tree = reader.get_tree()
-        code = reader.lawdata.code
-        self.kvsdicts["lawdata"][code] = reader.lawdata
-        self.kvsdicts["root"][code] = ml_etypes.convert_recursively(tree)
-        for e in tree.depth_first_iteration():
-            if len(e.text) > 0:
-                self.kvsdicts["sentence"][code] = e.text
+        self.set_tree(reader.lawdata, ml_etypes.convert_recursively(reader.get_tree()))
+
+    def set_tree(self, lawdata, tree):
+        with self.write_batch() as wb:
+            wb.set_tree(lawdata, tree)
+
+    def delete_tree(self, code):
+        with self.write_batch() as wb:
+            return wb.delete_tree(code)
+
+    def write_batch(self, *args, **kwargs):
+        return JStatutreeKVSBatchWriter(self, *args, **kwargs)
+
+# dictsはBatchWriterの辞書。is_new=Trueなら例規のキーがDBに無いものとして件数の確認を省く
+def set_tree_to_dicts(dicts, lawdata, tree, layout="tree", is_new=False):
+    code = lawdata.code
+    dicts["lawdata"].put(code, lawdata, is_new)
+    if layout == "node":
+        dicts["node"].put(code, (tree.etype.__name__, tree.num.key), is_new)
+    else:
+        dicts["root"].put(code, tree, is_new)
+    for e in tree.depth_first_iteration():
+        if layout == "node" and len(e.children) > 0:
+            dicts["node"].put(e.code, [(c.etype.__name__, c.num.key) for c in e.children.values()], is_new)
+        if len(e.text) > 0:
+            dicts["sentence"].put(e.code, e.text, is_new)
+
+class JStatutreeKVSBatchWriter(object):
+    def __init__(self, kvs, *args, **kwargs):
+        self.kvs = kvs
+        self.layout = kvs.layout
+        if kvs.db is None:
+            self.wb = None
+            self.wbs = {k: v.write_batch(*args, **kwargs) for k, v in kvs.kvsdicts.items()}
+        else:
+            kwargs.setdefault("transaction", True)
+            self.wb = kvs.db.write_batch(*args, **kwargs)
+            self.wbs = {k: BatchWriter(v, wb=self.wb) for k, v in kvs.kvsdicts.items()}
+
+    def set_from_reader(self, reader):
+        self.set_tree(reader.lawdata, ml_etypes.convert_recursively(reader.get_tree()))
+
+    # 例規がまだ無いこと(delete_treeで消した直後など)が分かっている場合はis_new=Trueとする
+    def set_tree(self, lawdata, tree, is_new=False):
+        set_tree_to_dicts(self.wbs, lawdata, tree, self.layout, is_new)
+
+    # 例規の全ての要素を消し、消した文のcodeのリストを返す
+    def delete_tree(self, code):
+        for name in ("lawdata", "root", "node"):
+            del self.wbs[name][code]
+        for key in list(self.kvs["node"].keys(prefix=code + "/")):
+            del self.wbs["node"][key]
+        sentence_codes = list(self.kvs.kvsdicts["sentence"].keys(prefix=code + "/"))
+        for key in sentence_codes:
+            del self.wbs["sentence"][key]
+        return sentence_codes
+
+    # ファイルのpathに(サイズ, 更新時刻(ns), 内容のハッシュ値, 例規コード)を記録する
+    def set_manifest(self, path, entry):
+        self.wbs["manifest"][path] = tuple(entry)
+
+    def delete_manifest(self, path):
+        del self.wbs["manifest"][path]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            return False
+        self.write()
+        return True
+
+    def write(self):
+        if self.wb is not None:
+            self.wb.write()
+            return
+        for wb in self.wbs.values():
+            wb.write()
 
 class KVSReaderBase(SourceInterface):
     def __init__(self, code, db):
@@ -76,11 +234,76 @@ class KVSReaderBase(SourceInterface):
         return self.db is None
 
     def get_tree(self):
-        root = self.db["root"][self.code]
+        if "_tree" in self.__dict__:
+            return self._tree
+        root_record = self.db["node"].get(self.code)
+        if root_record is None:
+            return self._init_root(self.db["root"][self.code])
+        return self._init_root(self._build_root(root_record))
+
+    # get_treeの木から要素のcodeで要素を探す(codeはこの例規の要素のもの)
+    def get_element(self, code):
+        elem = self.get_tree()
+        while elem.code != code:
+            for child in elem.children.values():
+                if code == child.code or code.startswith(child.code + "/"):
+                    elem = child
+                    break
+            else:
+                raise KeyError(code)
+        return elem
+
+    def _build_root(self, root_record):
+        # 子要素はMLExpansion._read_children_listで必要になった時に読む
+        etype_name, num_key = root_record
+        root = getattr(ml_etypes, etype_name)(self.lawdata)
+        root._num = ElementNumber.from_key(num_key)
+        root._node_layout = True
+        return root
+
+    def _init_root(self, root):
         root.lawdata = self.lawdata
         root.db = self.db
         return root
 
+    # 複数の例規のlawdataと木をまとめて読み、読み込み済みのreaderのリストを返す
+    # 各辞書をキーの順に一つのiteratorで読むので、一つずつ読むより局所性が高い
+    # with_texts=Trueの場合、layout="node"の木も全要素の子要素と文を読み込んでおく
+    @classmethod
+    def read_many(cls, codes, db, with_texts=False):
+        readers = [cls(code=code, db=db) for code in codes]
+        for reader, lawdata in zip(readers, db["lawdata"].get_many(codes)):
+            if lawdata is None:
+                raise KeyError(reader.code)
+            reader._lawdata = lawdata
+        root_records = db["node"].get_many(codes)
+        tree_readers = [r for r, record in zip(readers, root_records) if record is None]
+        for reader, root in zip(tree_readers, db["root"].get_many([r.code for r in tree_readers])):
+            if root is None:
+                raise KeyError(reader.code)
+            reader._tree = reader._init_root(root)
+        node_readers = [(r, record) for r, record in zip(readers, root_records) if record is not None]
+        for reader, record in node_readers:
+            reader._tree = reader._init_root(reader._build_root(record))
+        if with_texts:
+            cls._load_node_trees(db, [reader._tree for reader, _ in node_readers])
+        return readers
+
+    # 木を一段ずつ、その段の全要素の子要素をまとめて読む
+    @staticmethod
+    def _load_node_trees(db, roots):
+        texts = dict()
+        for root in roots:
+            texts.update(db["sentence"].items(prefix=root.lawdata.code + "/"))
+        level = roots
+        while len(level) > 0:
+            next_level = []
+            for elem, records in zip(level, db["node"].get_many([e.code for e in level], default=[])):
+                elem._text = texts.get(elem.code, "")
+                elem._children = elem._find_children(elem._read_children_list(records))
+                next_level.extend(elem._children.values())
+            level = next_level
+
     def read_lawdata(self):
         #print(self.code, list(self.db["lawdata"].items()))
         return self.db["lawdata"][self.code]
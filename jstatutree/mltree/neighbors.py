@@ -0,0 +1,138 @@
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from .vectorizer import load_features, CSRArrays
+from .ml_lawdata import ReikiKVSReader
+
+BLOCK_SIZE = 65536
+MEMORY_LIMIT = 1 << 30
+QUERY_CHUNK = 256
+
+def law_code_of(code):
+    return "/".join(code.split("/")[:3])
+
+# 要素のcodeのリストから、例規ごとにまとめて読んだ木の要素を返す
+def load_elements(kvs, codes):
+    law_codes = sorted(set(law_code_of(code) for code in codes))
+    readers = {r.code: r for r in ReikiKVSReader.read_many(law_codes, db=kvs)}
+    return [readers[law_code_of(code)].get_element(code) for code in codes]
+
+# 二つの上位の候補(件数×クエリ数)を合わせて、クエリごとに上位k件を残す
+def _merge_top(indices, scores, part_indices, part_scores, k):
+    indices = np.concatenate([indices, part_indices])
+    scores = np.concatenate([scores, part_scores])
+    if len(scores) <= k:
+        return indices, scores
+    top = np.argpartition(scores, len(scores) - k, axis=0)[len(scores)-k:]
+    return np.take_along_axis(indices, top, axis=0), np.take_along_axis(scores, top, axis=0)
+
+# export_featuresで書き出した行列に対するコサイン類似度の上位k件の検索
+# 行列をblock_size行ずつ読んで行列積を取り、ブロックごとの上位k件をそれまでの上位k件と合わせていく
+# ブロックはスレッドで並列に処理する(numpyの行列積はGILを解放する)
+# クエリはquery_chunk件ずつ処理し、同時に処理するn_jobs個のブロックの作業領域の合計がmemory_limitバイトに収まるように行数を決める
+# (これに加えて、クエリごとの上位k件の候補の分だけメモリを使う)
+class VectorSearch(object):
+    def __init__(self, matrix, codes, block_size=BLOCK_SIZE, n_jobs=None, memory_limit=MEMORY_LIMIT, query_chunk=QUERY_CHUNK):
+        self.matrix = matrix
+        self.codes = codes
+        self.rows = {code: i for i, code in enumerate(codes)}
+        self.block_size = block_size
+        self.n_jobs = multiprocessing.cpu_count() if n_jobs is None else n_jobs
+        self.memory_limit = memory_limit
+        self.query_chunk = query_chunk
+        self._norms = None
+
+    @classmethod
+    def load(cls, dirpath, **kwargs):
+        return cls(*load_features(dirpath), **kwargs)
+
+    @property
+    def shape(self):
+        return self.matrix.shape
+
+    def _block(self, start, stop):
+        if not isinstance(self.matrix, CSRArrays):
+            return np.asarray(self.matrix[start:stop], dtype=np.float32)
+        m = self.matrix
+        block = np.zeros((stop - start, m.shape[1]), dtype=np.float32)
+        begin, end = m.indptr[start], m.indptr[stop]
+        rows = np.repeat(np.arange(stop - start), np.diff(m.indptr[start:stop+1]))
+        block[rows, m.indices[begin:end]] = m.data[begin:end]
+        return block
+
+    # 一行あたり、行列(float32)と、クエリごとの類似度(float32)・argpartitionの結果(int64)を持つ
+    def _block_rows(self, query_count, n_jobs=1):
+        row_bytes = 4 * self.shape[1] + 12 * query_count
+        return max(1, min(self.block_size, self.memory_limit // (n_jobs * row_bytes)))
+
+    def _blocks(self, block_rows):
+        return [(s, min(s + block_rows, self.shape[0])) for s in range(0, self.shape[0], block_rows)]
+
+    @property
+    def norms(self):
+        if self._norms is None:
+            self._norms = np.zeros(self.shape[0], dtype=np.float32)
+            for start, stop in self._blocks(self._block_rows(0)):
+                self._norms[start:stop] = np.linalg.norm(self._block(start, stop), axis=1)
+        return self._norms
+
+    def vector(self, code):
+        i = self.rows[code]
+        return self._block(i, i+1)[0]
+
+    def _search_block(self, start, stop, queries, k):
+        norms = self.norms[start:stop]
+        scores = self._block(start, stop) @ queries.T
+        scores /= np.where(norms > 0, norms, 1)[:, None]
+        scores[norms == 0] = -np.inf
+        kk = min(k, stop - start)
+        top = np.argpartition(scores, stop - start - kk, axis=0)[stop-start-kk:]
+        return top + start, np.take_along_axis(scores, top, axis=0)
+
+    # queries(q×次元)の各行について[(code, 類似度), ...]を類似度の降順で返す
+    # excludeには各クエリについて結果から除くcode(の集合)を渡せる
+    def search_batch(self, queries, k=20, exclude=None):
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        if self.shape[0] == 0:
+            return [[] for _ in queries]
+        norms = self.norms # 各スレッドで計算しないよう先に求めておく
+        results = []
+        for i in range(0, len(queries), self.query_chunk):
+            chunk_exclude = None if exclude is None else exclude[i:i+self.query_chunk]
+            results.extend(self._search_chunk(queries[i:i+self.query_chunk], k, chunk_exclude))
+        return results
+
+    def _search_chunk(self, queries, k, exclude):
+        qnorms = np.linalg.norm(queries, axis=1)
+        queries = queries / np.where(qnorms > 0, qnorms, 1)[:, None]
+        extra = 0 if exclude is None else max(len(e) for e in exclude)
+        n_jobs = max(1, min(self.n_jobs, -(-self.shape[0] // self.block_size)))
+        blocks = self._blocks(self._block_rows(len(queries), n_jobs))
+        indices = np.empty((0, len(queries)), dtype=np.int64)
+        scores = np.empty((0, len(queries)), dtype=np.float32)
+        # n_jobs個ずつ処理し、終わったブロックの上位を都度まとめるので、ブロックの結果を溜め込まない
+        with ThreadPoolExecutor(n_jobs) as executor:
+            for i in range(0, len(blocks), n_jobs):
+                for part in executor.map(lambda b: self._search_block(b[0], b[1], queries, k + extra), blocks[i:i+n_jobs]):
+                    indices, scores = _merge_top(indices, scores, *part, k + extra)
+        results = []
+        for q in range(len(queries)):
+            order = np.lexsort((indices[:, q], -scores[:, q]))
+            excluded = set() if exclude is None else set(exclude[q])
+            result = []
+            for i in order:
+                if len(result) >= k or scores[i, q] == -np.inf:
+                    break
+                code = self.codes[indices[i, q]]
+                if code not in excluded:
+                    result.append((code, float(scores[i, q])))
+            results.append(result)
+        return results
+
+    def search(self, query, k=20, exclude=()):
+        return self.search_batch([query], k=k, exclude=[exclude])[0]
+
+    # 登録済みの要素に似た要素(自身を除く)
+    def search_codes(self, codes, k=20):
+        queries = np.stack([self.vector(code) for code in codes])
+        return self.search_batch(queries, k=k, exclude=[{code} for code in codes])
@@ -0,0 +1,145 @@
+import os
+import json
+from collections import namedtuple
+import numpy as np
+from jstatutree.minhash import ngram_hashes
+from jstatutree.flattree import FlatTree
+from .ml_lawdata import ReikiKVSReader
+
+CHUNK_SIZE = 100
+DENSE_FILES = {"features": "features.f32"}
+SPARSE_FILES = {"data": "data.f32", "indices": "indices.i32", "indptr": "indptr.i64"}
+CODES_FILE = "codes.txt"
+META_FILE = "meta.json"
+
+CSRArrays = namedtuple("CSRArrays", "data indices indptr shape")
+
+# 文字n-gramをハッシュでn_features次元に割り当てる(辞書を持たないので逐次処理できる)
+# ハッシュの33bit目で符号を変え、衝突による偏りを打ち消す
+class HashingVectorizer(object):
+    def __init__(self, n_features=1024, ngram_range=(1, 3), alternate_sign=True, norm="l2"):
+        assert norm in (None, "l1", "l2"), "Invalid norm: {}".format(norm)
+        self.n_features = n_features
+        self.ngram_range = ngram_range
+        self.alternate_sign = alternate_sign
+        self.norm = norm
+
+    def get_params(self):
+        return {
+            "n_features": self.n_features,
+            "ngram_range": list(self.ngram_range),
+            "alternate_sign": self.alternate_sign,
+            "norm": self.norm
+            }
+
+    # 一つの文の疎ベクトル(昇順の列番号, 値)
+    def transform_one(self, text):
+        hashes = np.concatenate([ngram_hashes(text, n) for n in range(self.ngram_range[0], self.ngram_range[1]+1)])
+        columns = ((hashes & np.uint64(0xffffffff)) % np.uint64(self.n_features)).astype(np.int32)
+        if self.alternate_sign:
+            signs = np.where((hashes >> np.uint64(32)) & np.uint64(1), -1.0, 1.0)
+        else:
+            signs = np.ones(len(hashes))
+        indices, inverse = np.unique(columns, return_inverse=True)
+        values = np.zeros(len(indices), dtype=np.float64)
+        np.add.at(values, inverse, signs)
+        nonzero = values != 0
+        indices, values = indices[nonzero], values[nonzero]
+        if self.norm == "l2" and len(values) > 0:
+            values /= np.sqrt(np.sum(values**2))
+        elif self.norm == "l1" and len(values) > 0:
+            values /= np.sum(np.abs(values))
+        return indices, values.astype(np.float32)
+
+    def transform(self, texts):
+        texts = list(texts)
+        matrix = np.zeros((len(texts), self.n_features), dtype=np.float32)
+        for i, text in enumerate(texts):
+            indices, values = self.transform_one(text)
+            matrix[i, indices] = values
+        return matrix
+
+# JStatutreeKVSの例規をCHUNK_SIZE件ずつ読み、target_etypeの要素ごとに(code, 文を連結したもの)を返す
+def iter_level_texts(kvs, target_etype, prefix=None, chunk_size=CHUNK_SIZE):
+    codes = list(kvs.law_codes(prefix=prefix))
+    for i in range(0, len(codes), chunk_size):
+        readers = ReikiKVSReader.read_many(codes[i:i+chunk_size], db=kvs, with_texts=True)
+        flat = FlatTree.from_trees([r.get_tree() for r in readers])
+        indices, texts = flat.aggregate_texts(target_etype)
+        yield from zip(flat.get_codes(indices), texts)
+
+# 行を順に追記し、closeで行数などをmeta.jsonに書く
+# 密行列はfeatures.f32、疎行列はCSRの3つの配列をそれぞれ別のファイルに書く
+class FeatureWriter(object):
+    def __init__(self, dirpath, vectorizer, sparse=False):
+        os.makedirs(dirpath, exist_ok=True)
+        self.dirpath = dirpath
+        self.vectorizer = vectorizer
+        self.sparse = sparse
+        files = SPARSE_FILES if sparse else DENSE_FILES
+        self.files = {name: open(os.path.join(dirpath, filename), "wb") for name, filename in files.items()}
+        self.codes_file = open(os.path.join(dirpath, CODES_FILE), "w", encoding="utf8")
+        self.rows = 0
+        self.nnz = 0
+        if sparse:
+            self.files["indptr"].write(np.zeros(1, dtype=np.int64).tobytes())
+
+    def add(self, code, text):
+        indices, values = self.vectorizer.transform_one(text)
+        if self.sparse:
+            self.files["data"].write(values.tobytes())
+            self.files["indices"].write(indices.tobytes())
+            self.nnz += len(indices)
+            self.files["indptr"].write(np.array([self.nnz], dtype=np.int64).tobytes())
+        else:
+            row = np.zeros(self.vectorizer.n_features, dtype=np.float32)
+            row[indices] = values
+            self.files["features"].write(row.tobytes())
+        self.codes_file.write(code + "\n")
+        self.rows += 1
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        self.codes_file.close()
+        meta = {"rows": self.rows, "nnz": self.nnz, "sparse": self.sparse, "vectorizer": self.vectorizer.get_params()}
+        with open(os.path.join(self.dirpath, META_FILE), "w") as f:
+            json.dump(meta, f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+def export_features(kvs, dirpath, target_etype, vectorizer=None, prefix=None, sparse=False):
+    vectorizer = HashingVectorizer() if vectorizer is None else vectorizer
+    with FeatureWriter(dirpath, vectorizer, sparse=sparse) as writer:
+        for code, text in iter_level_texts(kvs, target_etype, prefix=prefix):
+            writer.add(code, text)
+    return writer.rows
+
+# (行列, codeのリスト)を返す。行列はnp.memmapで、疎行列の場合はCSRArrays
+def load_features(dirpath, mode="r"):
+    with open(os.path.join(dirpath, META_FILE)) as f:
+        meta = json.load(f)
+    with open(os.path.join(dirpath, CODES_FILE), encoding="utf8") as f:
+        codes = f.read().splitlines()
+    shape = (meta["rows"], meta["vectorizer"]["n_features"])
+    def memmap(filename, dtype, length):
+        if length == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(os.path.join(dirpath, filename), dtype=dtype, mode=mode, shape=(length,))
+    if meta["sparse"]:
+        matrix = CSRArrays(
+            data=memmap(SPARSE_FILES["data"], np.float32, meta["nnz"]),
+            indices=memmap(SPARSE_FILES["indices"], np.int32, meta["nnz"]),
+            indptr=memmap(SPARSE_FILES["indptr"], np.int64, meta["rows"] + 1),
+            shape=shape
+            )
+    elif meta["rows"] == 0:
+        matrix = np.zeros(shape, dtype=np.float32)
+    else:
+        matrix = np.memmap(os.path.join(dirpath, DENSE_FILES["features"]), dtype=np.float32, mode=mode, shape=shape)
+    return matrix, codes
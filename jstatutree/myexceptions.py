@@ -43,3 +43,7 @@ class XMLStructureError(LawError):
 
 class LawElementNumberError(LawError):
     pass
+
+# depth_first_iteration(release=True)などで手放した部分木を読み直そうとした
+class ReleasedElementError(LawError):
+    pass
@@ -0,0 +1,200 @@
+import numpy as np
+from .kvsdict import KVSDict, KVSPrefixDict
+from .tree_element import normalize_str
+
+FLUSH_SIZE = 1000000
+
+# 昇順の整数列を差分のvarint(7bitずつ、続きがあれば最上位bitを立てる)で符号化する
+def encode_postings(ids):
+    deltas = np.diff(np.asarray(ids, dtype=np.uint64), prepend=np.uint64(0))
+    nbytes = np.ones(len(deltas), dtype=np.int64)
+    for k in range(1, 10):
+        nbytes += deltas >= np.uint64(1 << (7*k))
+    width = int(nbytes.max()) if len(deltas) > 0 else 0
+    shifts = np.arange(width, dtype=np.uint64) * np.uint64(7)
+    groups = ((deltas[:, None] >> shifts[None, :]) & np.uint64(0x7f)).astype(np.uint8)
+    groups[np.arange(width)[None, :] < (nbytes[:, None] - 1)] |= 0x80
+    return groups[np.arange(width)[None, :] < nbytes[:, None]].tobytes()
+
+def decode_postings(data):
+    b = np.frombuffer(data, dtype=np.uint8)
+    if len(b) == 0:
+        return np.zeros(0, dtype=np.int64)
+    ends = np.flatnonzero((b & 0x80) == 0)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    pos = np.arange(len(b)) - np.repeat(starts, ends - starts + 1)
+    vals = (b & 0x7f).astype(np.int64) << (7*pos)
+    return np.cumsum(np.add.reduceat(vals, starts))
+
+# 文の文字n-gramから要素のcodeを引く転置索引
+# docs: 文書番号 -> code, ids: code -> 文書番号, texts: 文書番号 -> 正規化した文
+# postings: "n-gram\x00最初の文書番号" -> 文書番号列(flushごとに一つの区間を追加する)
+# 文末のn文字未満のn-gramも登録するので、n文字未満の検索語にもn-gramの前方一致で答えられる
+class NgramIndex(object):
+    ID_FORMAT = "{:012d}"
+    VERIFY_CHUNK = 10000
+
+    def __init__(self, path, n=2, flush_size=FLUSH_SIZE):
+        self.db = KVSDict(path=path)
+        self.meta = KVSPrefixDict(self.db, prefix="meta-", codec="marshal")
+        stored_n = self.meta.get("n")
+        if stored_n is None:
+            self.meta["n"] = n
+        elif stored_n != n:
+            raise ValueError("{0} is indexed with n={1}".format(path, stored_n))
+        self.n = n
+        self.docs = KVSPrefixDict(self.db, prefix="doc-", codec="utf8")
+        self.ids = KVSPrefixDict(self.db, prefix="id-", codec="marshal")
+        self.texts = KVSPrefixDict(self.db, prefix="text-", codec="utf8")
+        self.postings = KVSPrefixDict(self.db, prefix="post-", codec="bytes")
+        self.flush_size = flush_size
+        self.next_id = self.meta.get("next_id", 0)
+        self.pending = dict()
+        self.pending_ids = dict()
+        self.pending_size = 0
+        self.wb = None
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def ngrams(self, text):
+        return set(text[i:i+self.n] for i in range(len(text)))
+
+    def _doc_key(self, doc_id):
+        return self.ID_FORMAT.format(doc_id)
+
+    def _batch(self):
+        if self.wb is None:
+            self.wb = self.db.write_batch()
+            self.wbs = {
+                "docs": self.docs.write_batch(wb=self.wb),
+                "ids": self.ids.write_batch(wb=self.wb),
+                "texts": self.texts.write_batch(wb=self.wb),
+                "postings": self.postings.write_batch(wb=self.wb),
+                "meta": self.meta.write_batch(wb=self.wb)
+                }
+        return self.wbs
+
+    # 既に登録されているcodeは古い文を消してから登録し直す(空の文なら消すだけ)
+    def add(self, code, text):
+        text = normalize_str(text)
+        self.remove(code)
+        if len(text) == 0:
+            return
+        wbs = self._batch()
+        doc_id = self.next_id
+        self.next_id += 1
+        wbs["docs"][self._doc_key(doc_id)] = code
+        wbs["ids"][code] = doc_id
+        self.pending_ids[code] = doc_id
+        wbs["texts"][self._doc_key(doc_id)] = text
+        for gram in self.ngrams(text):
+            self.pending.setdefault(gram, []).append(doc_id)
+        self.pending_size += len(text)
+        if self.pending_size >= self.flush_size:
+            self.flush()
+
+    # 転置リストには番号が残るが、文がないので検索結果から外れる(optimizeで消える)
+    def remove(self, code):
+        # flush前に登録したcodeはまだDBに書かれていない
+        doc_id = self.pending_ids.pop(code, None)
+        if doc_id is None:
+            doc_id = self.ids.get(code)
+        if doc_id is None:
+            return
+        wbs = self._batch()
+        del wbs["docs"][self._doc_key(doc_id)]
+        del wbs["ids"][code]
+        del wbs["texts"][self._doc_key(doc_id)]
+
+    def add_tree(self, tree):
+        for e in tree.depth_first_iteration():
+            if len(e.text) > 0:
+                self.add(e.code, e.text)
+
+    def add_from_kvs(self, sentence_dict, prefix=None):
+        for code, text in sentence_dict.items(prefix=prefix):
+            self.add(code, text)
+
+    def flush(self):
+        if self.wb is None:
+            return
+        wbs = self.wbs
+        for gram in sorted(self.pending):
+            ids = self.pending[gram]
+            wbs["postings"][gram + "\x00" + self._doc_key(ids[0])] = encode_postings(ids)
+        wbs["meta"]["next_id"] = self.next_id
+        self.wb.write()
+        self.wb = None
+        self.pending = dict()
+        self.pending_ids = dict()
+        self.pending_size = 0
+
+    def get_postings(self, gram):
+        segments = list(self.postings.values(prefix=gram + "\x00"))
+        if len(segments) == 0:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate([decode_postings(s) for s in segments])
+
+    # queryより短いn-gramを前方一致でまとめた文書番号
+    def _get_prefix_postings(self, query):
+        ids = [decode_postings(s) for s in self.postings.values(prefix=query)]
+        if len(ids) == 0:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate(ids))
+
+    def candidates(self, query):
+        if len(query) < self.n:
+            return self._get_prefix_postings(query)
+        postings = sorted((self.get_postings(g) for g in self.ngrams(query) if len(g) == self.n), key=len)
+        result = postings[0]
+        for p in postings[1:]:
+            if len(result) == 0:
+                break
+            result = np.intersect1d(result, p, assume_unique=True)
+        return result
+
+    # 転置リストの積で候補を絞り、文に検索語が含まれるかを確かめる
+    # 候補はVERIFY_CHUNK件ずつ確かめ、limit件見つかったところでやめる
+    def search(self, query, limit=None):
+        self.flush()
+        query = normalize_str(query)
+        if len(query) == 0:
+            return []
+        doc_ids = self.candidates(query)
+        hits = []
+        for i in range(0, len(doc_ids), self.VERIFY_CHUNK):
+            keys = [self._doc_key(doc_id) for doc_id in doc_ids[i:i+self.VERIFY_CHUNK]]
+            hits.extend(key for key, text in zip(keys, self.texts.get_many(keys)) if text is not None and query in text)
+            if limit is not None and len(hits) >= limit:
+                hits = hits[:limit]
+                break
+        return self.docs.get_many(hits)
+
+    # n-gramごとに区間を一つにまとめ、消された文書番号を除く
+    def optimize(self):
+        self.flush()
+        with self.postings.write_batch() as wb:
+            gram, segments = None, []
+            for key, data in self.postings.items():
+                g = key.rsplit("\x00", 1)[0]
+                if g != gram:
+                    self._merge_segments(wb, gram, segments)
+                    gram, segments = g, []
+                segments.append((key, data))
+            self._merge_segments(wb, gram, segments)
+
+    def _merge_segments(self, wb, gram, segments):
+        if len(segments) == 0:
+            return
+        ids = np.concatenate([decode_postings(data) for _, data in segments])
+        alive = self.texts.get_many([self._doc_key(i) for i in ids])
+        ids = [i for i, text in zip(ids, alive) if text is not None]
+        for key, _ in segments:
+            del wb[key]
+        if len(ids) > 0:
+            wb[gram + "\x00" + self._doc_key(ids[0])] = encode_postings(ids)
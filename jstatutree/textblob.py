@@ -0,0 +1,156 @@
+import os
+import mmap
+import numpy as np
+from .tree_element import normalize_str
+from .kvsdict import prefix_stop
+
+TEXTS_FILE = "texts.bin"
+CODES_FILE = "codes.bin"
+TEXT_OFFSETS_FILE = "text_offsets.i64"
+CODE_OFFSETS_FILE = "code_offsets.i64"
+
+# 文をcodeの昇順に一つのUTF-8のファイルへ追記し、codeとオフセットの索引を書く
+# codeはLevelDBのキーと同じくUTF-8のバイト列の順で渡すこと
+class TextBlobWriter(object):
+    def __init__(self, dirpath):
+        os.makedirs(dirpath, exist_ok=True)
+        self.dirpath = dirpath
+        self.texts = open(os.path.join(dirpath, TEXTS_FILE), "wb")
+        self.codes = open(os.path.join(dirpath, CODES_FILE), "wb")
+        self.text_offsets = [0]
+        self.code_offsets = [0]
+        self.last_code = None
+
+    def add(self, code, text):
+        code = code.encode("utf8")
+        assert self.last_code is None or self.last_code < code, "codes must be added in ascending order"
+        self.last_code = code
+        data = text.encode("utf8")
+        self.texts.write(data)
+        self.codes.write(code)
+        self.text_offsets.append(self.text_offsets[-1] + len(data))
+        self.code_offsets.append(self.code_offsets[-1] + len(code))
+
+    def close(self):
+        self.texts.close()
+        self.codes.close()
+        np.array(self.text_offsets, dtype=np.int64).tofile(os.path.join(self.dirpath, TEXT_OFFSETS_FILE))
+        np.array(self.code_offsets, dtype=np.int64).tofile(os.path.join(self.dirpath, CODE_OFFSETS_FILE))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+# normalize=TrueならTreeElement.textと同じく正規化した文を書く
+def export_text_blob(sentence_dict, dirpath, prefix=None, normalize=False):
+    with TextBlobWriter(dirpath) as writer:
+        for code, text in sentence_dict.items(prefix=prefix):
+            writer.add(code, normalize_str(text) if normalize else text)
+    return len(writer.text_offsets) - 1
+
+def _mmap_file(path):
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+# export_text_blobで書き出した文を読み取り専用のmmapで読む
+# 複数のプロセスで開いても、OSのページキャッシュが共有される
+# 要素のcodeの他に、codeの順位(整数の要素番号)でも引ける
+# get・items・keys・get_manyを持つので、JStatutreeKVS.open_text_blobでdb["sentence"]の代わりに使える
+class TextBlob(object):
+    def __init__(self, dirpath):
+        self.dirpath = dirpath
+        self.texts = _mmap_file(os.path.join(dirpath, TEXTS_FILE))
+        self.codes = _mmap_file(os.path.join(dirpath, CODES_FILE))
+        self.text_offsets = np.fromfile(os.path.join(dirpath, TEXT_OFFSETS_FILE), dtype=np.int64)
+        self.code_offsets = np.fromfile(os.path.join(dirpath, CODE_OFFSETS_FILE), dtype=np.int64)
+
+    def close(self):
+        for mm in (self.texts, self.codes):
+            if isinstance(mm, mmap.mmap):
+                mm.close()
+
+    def __len__(self):
+        return len(self.text_offsets) - 1
+
+    def code_at(self, i):
+        return self.codes[self.code_offsets[i]:self.code_offsets[i+1]].decode("utf8")
+
+    # コピーせずにmmap上のUTF-8のバイト列を返す
+    def text_bytes_at(self, i):
+        return memoryview(self.texts)[self.text_offsets[i]:self.text_offsets[i+1]]
+
+    def text_at(self, i):
+        return self.texts[self.text_offsets[i]:self.text_offsets[i+1]].decode("utf8")
+
+    def _bisect(self, key, lo=0):
+        hi = len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.codes[self.code_offsets[mid]:self.code_offsets[mid+1]] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def index_of(self, code, default=None):
+        key = code.encode("utf8")
+        i = self._bisect(key)
+        if i < len(self) and self.codes[self.code_offsets[i]:self.code_offsets[i+1]] == key:
+            return i
+        return default
+
+    def __contains__(self, code):
+        return self.index_of(code) is not None
+
+    def get(self, code, default=None):
+        i = self.index_of(code)
+        return default if i is None else self.text_at(i)
+
+    def __getitem__(self, code):
+        i = self.index_of(code)
+        if i is None:
+            raise KeyError(code)
+        return self.text_at(i)
+
+    # 昇順に並べたキーを順に探すので、前のキーの位置から二分探索を始められる
+    def get_many(self, codes, default=None):
+        found = dict()
+        lo = 0
+        for code in sorted(set(codes), key=lambda c: c.encode("utf8")):
+            key = code.encode("utf8")
+            lo = self._bisect(key, lo)
+            if lo < len(self) and self.codes[self.code_offsets[lo]:self.code_offsets[lo+1]] == key:
+                found[code] = self.text_at(lo)
+        return [found.get(code, default) for code in codes]
+
+    def _range(self, prefix=None, start=None, stop=None):
+        lo, hi = 0, len(self)
+        # KVSDict._iteratorと同じく、prefixの範囲を[prefix, prefix_stop(prefix))とする
+        if prefix is not None and len(prefix) > 0:
+            key = prefix.encode("utf8")
+            lo = self._bisect(key)
+            stop_key = prefix_stop(key)
+            if stop_key is not None:
+                hi = self._bisect(stop_key, lo)
+        if start is not None:
+            lo = max(lo, self._bisect(start.encode("utf8")))
+        if stop is not None:
+            hi = min(hi, self._bisect(stop.encode("utf8")))
+        return range(lo, max(lo, hi))
+
+    def keys(self, prefix=None, start=None, stop=None, reverse=False):
+        indices = self._range(prefix, start, stop)
+        return (self.code_at(i) for i in (reversed(indices) if reverse else indices))
+
+    def values(self, prefix=None, start=None, stop=None, reverse=False):
+        indices = self._range(prefix, start, stop)
+        return (self.text_at(i) for i in (reversed(indices) if reverse else indices))
+
+    def items(self, prefix=None, start=None, stop=None, reverse=False):
+        indices = self._range(prefix, start, stop)
+        return ((self.code_at(i), self.text_at(i)) for i in (reversed(indices) if reverse else indices))
@@ -1,21 +1,48 @@
 from abc import abstractmethod
+from functools import lru_cache
 import unicodedata
 from .myexceptions import *
 from .lawdata import ElementNumber
 
+NORMALIZE_CACHE_SIZE = 65536
+
+# NFKCで正規化し前後の空白を除く
+# ASCIIだけの文字列や正規化済みの文字列はnormalizeを呼ばない
+# 定型文(「公布の日から施行する」など)が多いので結果をキャッシュする
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def normalize_str(s):
+    if not s.isascii() and not unicodedata.is_normalized("NFKC", s):
+        s = unicodedata.normalize("NFKC", s)
+    return s.strip()
+
+# 同じ親を持つ要素間の順序
+def sibling_key(elem):
+    return (elem.LEVEL, elem.SUBLEVEL, elem.num.key)
+
 # 要素の基底クラス
+# キャッシュはすべて__slots__の明示的なフィールドで持つ
+# (__slots__だけで構成したコンパクトな要素クラスはetypes.make_compact_etypesで生成する)
 class TreeElement(object):
+    __slots__ = ("parent", "_num", "_children", "_text", "_code", "_is_vnode", "_sort_key")
+    CACHE_DEFAULTS = {"_num": None, "_children": None, "_text": None, "_code": None, "_is_vnode": False, "_sort_key": None}
     LEVEL = 0
     SUBLEVEL = 0
     PARENT_CANDIDATES = ()
     CHILDREN_PATTERNS = ()
     JNAME = ""
+    # 子要素の生成に使うetypeの辞書(Noneの場合は定義モジュールのもの)
+    ETYPES_DICT = None
+    # 走査時にrelease=Trueとした場合に手放す値
+    RELEASE_TAGS = ("children", "text")
 
     def __init__(self, parent=None):
         self.parent = parent
         self._num = None
         self._children = None
         self._text = None
+        self._code = None
+        self._is_vnode = False
+        self._sort_key = None
 
     @classmethod
     def convert(cls, src_elem):
@@ -52,18 +79,29 @@ class TreeElement(object):
 
     @property
     def is_vnode(self):
-        if "_is_vnode" not in self.__dict__:
-            self._is_vnode = False
-        return self._is_vnode    
-    
+        return self._is_vnode
+
     @property
     def code(self):
-        if "_code" not in self.__dict__:
-            nums = [self.num.main_num] + self.num.branch_nums
-            self._code = self.parent.code + "/{etype}({num})".format(etype=self.etype.__name__, num="_".join([str(n) for n in nums]))
+        if self._code is None:
+            self._code = self.etype.build_code(self.parent.code, self.num)
         return self._code
 
+    # 根からの(LEVEL, SUBLEVEL, 要素番号)の列
+    # 比較・ハッシュはすべてこのタプルで行う
+    @property
+    def sort_key(self):
+        if self._sort_key is None:
+            head = (self.lawdata.code,) if self.parent is None else self.parent.sort_key
+            self._sort_key = head + (sibling_key(self),)
+        return self._sort_key
+
+    @classmethod
+    def build_code(cls, parent_code, num):
+        return parent_code + "/{etype}({num})".format(etype=cls.__name__, num=str(num))
+
     # 呼び出し時に読み出す(children, name, text)
+    # childrenは構築時に文書順に並べてあるので、走査時にソートする必要はない
     @property
     def children(self):
         if self._children is None:
@@ -92,12 +130,12 @@ class TreeElement(object):
             return self.parent.name
         if "branch" in self.JNAME:
             return self.JNAME.format(
-                num=int(self.num.main_num),
-                branch="の".join(map(lambda x: int(x), self.num.branch_nums))
+                num=self.num.main_num,
+                branch="".join(["の{}".format(n) for n in self.num.branch_nums])
             )
         elif "num" in self.JNAME:
             return self.JNAME.format(
-                num=int(self.num.main_num)
+                num=self.num.main_num
             )
         else:
             return self.JNAME
@@ -117,7 +155,7 @@ class TreeElement(object):
 
     @classmethod
     def preprocess_str(self, s):
-        return unicodedata.normalize("NFKC", s).strip()
+        return normalize_str(s)
 
     def _read_num(self):
         return ElementNumber("1")
@@ -132,17 +170,11 @@ class TreeElement(object):
 
     # 子要素を探索
     # 継承先でこのメソッドを書き換えるのは非推奨
-    def _find_children(self):
+    def _find_children(self, children_list=None):
         children = dict()
-        for child in self._read_children_list():
-            # 要素の重複がないかチェック
-            #print(child, child.etype.__name__)
-            if child in children.values():
-                raise HieralchyError(
-                    self.lawdata,
-                    "element number duplication: {0} in {1}".format(str(child), str(list(map(lambda x: str(x), children.values()))))
-                )
-            children[child.name] = child
+        children_list = self._read_children_list() if children_list is None else children_list
+        for child in sorted(children_list, key=sibling_key):
+            self._append_child(children, child)
         """
         # 兄弟関係が不正でないかチェック
         etypes = set(map(lambda x: x.etype, children))
@@ -155,6 +187,22 @@ class TreeElement(object):
         """
         return children
 
+    def _append_child(self, children, child):
+        # 要素の重複がないかチェック
+        # 兄弟間で等しい要素はetypeと番号が同じなので、名前も同じになる
+        #print(child, child.etype.__name__)
+        dup = children.get(child.name, None)
+        if dup is not None and dup.etype == child.etype and dup.num == child.num:
+            raise HieralchyError(
+                self.lawdata,
+                "element number duplication: {0} in {1}".format(str(child), str(list(map(lambda x: str(x), children.values()))))
+            )
+        children[child.name] = child
+
+    # 構築後に子要素を文書順に並べ直す
+    def _sort_children(self):
+        self._children = dict(sorted(self._children.items(), key=lambda item: sibling_key(item[1])))
+
     def is_leaf(self):
         return len(self.children) == 0
 
@@ -174,7 +222,11 @@ class TreeElement(object):
 
         return copy
 
-    def depth_first_search(self, target_etype, valid_vnode=False):
+    # release: 返し終えた部分木の要素のキャッシュを手放す(Trueの場合はRELEASE_TAGS、タプルの場合はその値)
+    # retain: 手放さない要素を選ぶ関数(elem -> bool)
+    # 読み直せる値(_is_reloadable)だけを手放し、再びアクセスした時に読み直す
+    # ただしXMLの要素は手放すと読み直せない(XMLExpansion.releaseを参照)
+    def depth_first_search(self, target_etype, valid_vnode=False, release=None, retain=None):
         assert issubclass(target_etype, TreeElement), "target_etype must be a subclass of TreeElement (given {})".format(target_etype.__class__.__name__)
         #print(target_etype.__name__, target_etype.LEVEL, "vs.", self.etype.__name__, self.etype.LEVEL)
         if target_etype.LEVEL == self.etype.LEVEL:
@@ -186,15 +238,17 @@ class TreeElement(object):
         elif target_etype.LEVEL >= self.etype.LEVEL:
             yielded_flag = False
             iter_flag = False
-            for child in sorted(self.children.values()):
+            for child in self.children.values():
                 iter_flag = True
                 if child.etype.LEVEL < target_etype.LEVEL:
-                    yield from child.depth_first_search(target_etype, valid_vnode)
+                    yield from child.depth_first_search(target_etype, valid_vnode, release, retain)
                     yielded_flag = True
+                    child._release_visited(release, retain)
                 elif child.etype.LEVEL == target_etype.LEVEL:
                     if child.SUBLEVEL == target_etype.SUBLEVEL:
                         yield child
                         yielded_flag = True
+                    child._release_visited(release, retain)
                 else:
                     yielded_flag = True
                     if valid_vnode:
@@ -205,10 +259,22 @@ class TreeElement(object):
                 yield self.get_virtual_node(target_etype)
                 return
 
-    def depth_first_iteration(self):
+    # releaseとretainはdepth_first_searchと同じ(走査を始めた要素自身は手放さない)
+    def depth_first_iteration(self, release=None, retain=None):
         yield self
-        for child in sorted(self.children.values()):
-            yield from child.depth_first_iteration()
+        for child in self.children.values():
+            yield from child.depth_first_iteration(release, retain)
+            child._release_visited(release, retain)
+
+    def _release_visited(self, release, retain):
+        if release is None or release is False or self.is_vnode:
+            return
+        if retain is not None and retain(self):
+            return
+        self.release(*(() if release is True else release))
+
+    def release(self, *value_tags):
+        self.delete_values(*(value_tags or self.RELEASE_TAGS))
 
     def iter_sentences(self):
         for child in self.depth_first_iteration():
@@ -223,62 +289,65 @@ class TreeElement(object):
         for elem in self.depth_first_iteration():
             elem.delete_values(*value_tags)
 
+    # 読み直せない値(パース時に一度だけ設定した文・子要素など)はdelete_valuesで消さない
+    def _is_reloadable(self, value_tag):
+        return True
+
     def delete_values(self, *value_tags):
         for vt in value_tags:
-            if "_"+vt in self.__dict__:
-                del self.__dict__["_"+vt]
-            if vt in self.__dict__:
-                del self.__dict__[vt]
+            if vt in ("text", "children") and not self._is_reloadable(vt):
+                continue
+            for name in ("_"+vt, vt):
+                if name in self.CACHE_DEFAULTS:
+                    setattr(self, name, self.CACHE_DEFAULTS[name])
+                elif name in getattr(self, "__dict__", {}):
+                    del self.__dict__[name]
+
+    # __slots__導入前にpickleされた要素(すべて__dict__に入っている)も読めるようにする
+    # 子要素が文書順に並んでいない可能性があるので並べ直す
+    def __setstate__(self, state):
+        legacy = not isinstance(state, tuple)
+        if not legacy:
+            dict_state, slots_state = state
+            state = dict(dict_state or {}, **(slots_state or {}))
+        for name, default in self.CACHE_DEFAULTS.items():
+            setattr(self, name, default)
+        for name, val in state.items():
+            setattr(self, name, val)
+        if legacy and self._children is not None:
+            self._sort_children()
 
     def _comparable_check(self, elem):
-        #assert elem.__class__ in ((self.etype,) + self.BROTHER_CANDIDATES), "cannot compare {} and {}".format(self.etype, elem.__class__)
-        assert hasattr(self, "num"), "cannot compare elements without element number "+str(self)
-        assert hasattr(elem, "num"), "cannot compare elements without element number "+str(elem)
+        assert isinstance(elem, TreeElement), "cannot compare {} with {}".format(self.etype.__name__, elem.__class__.__name__)
 
     def __eq__(self, elem):
-        if id(self) == id(elem):
+        if self is elem:
             return True
-        self._comparable_check(elem)
-        if self.etype != elem.etype:
-            return False
-        if self.num.num != elem.num.num:
+        if not isinstance(elem, TreeElement):
             return False
-        return self.parent == elem.parent
+        return self.etype == elem.etype and self.sort_key == elem.sort_key
 
     def __ne__(self, elem):
         return not self == elem
 
     def __lt__(self, elem):
         self._comparable_check(elem)
-        if self.etype.LEVEL > elem.etype.LEVEL:
-            return self.parent > elem
-        elif self.etype.LEVEL < elem.etype.LEVEL:
-            return self > elem.parent
-        elif self.parent == elem.parent:
-            if self.etype.LEVEL != elem.etype.LEVEL:
-                raise HieralchyError(
-                    self.lawdata,
-                    "Unexpected element occured in the same layer "+str(self.etype)+" "+str(elem.etype)
-                    )
-            if self.etype.SUBLEVEL == self.etype.SUBLEVEL:
-                return self.num.num < elem.num.num
-            else:
-                return self.etype.SUBLEVEL < self.etype.SUBLEVEL
-        return self.parent < elem.parent
+        return self.sort_key < elem.sort_key
 
     def __le__(self, elem):
-        if self == elem:
-            return True
-        return self < elem
+        self._comparable_check(elem)
+        return self.sort_key <= elem.sort_key
 
     def __gt__(self, elem):
-        return not self <= elem
+        self._comparable_check(elem)
+        return self.sort_key > elem.sort_key
 
     def __ge__(self, elem):
-        return not self < elem
+        self._comparable_check(elem)
+        return self.sort_key >= elem.sort_key
 
     def __hash__(self):
-        return hash(self.code)
+        return hash(self.sort_key)
 
     # "X法第n条第m項"のように出力
     def __str__(self):
@@ -0,0 +1,235 @@
+import os
+import mmap
+import pickle
+import struct
+import numpy as np
+from . import etypes
+from .lawdata import SourceInterface, ElementNumber
+from .flattree import FlatTree, ETYPE_NAMES
+from .jstatute_dict import file_digest
+from .xmltree.xml_lawdata import ReikiXMLReader
+
+# 木一つを前順の配列で保存するファイル形式
+# ヘッダ: MAGIC, VERSION, 要素数, 枝番号の桁数, 文の区画のバイト数, metaの区画のバイト数
+# 続けて以下の区画を8バイト境界に揃えて並べる(metaはlawdataとetype名のリストをpickleしたもの)
+MAGIC = b"JSTF"
+VERSION = 1
+HEADER = struct.Struct("<4sIQQQQ")
+EXT = ".jstf"
+
+def _sections(count, branch_width):
+    return [
+        ("parents", np.int32, count),
+        ("etype_ids", np.int16, count),
+        ("main_nums", np.int32, count),
+        ("branch_nums", np.int32, count * branch_width),
+        ("subtree_ends", np.int32, count),
+        ("text_offsets", np.int64, count + 1),
+        ]
+
+def _align(offset):
+    return (offset + 7) // 8 * 8
+
+# 各区画の(名前, dtype, 要素数, 開始位置)と、文の区画・metaの区画の開始位置
+def _layout(count, branch_width, text_size):
+    offset = HEADER.size
+    layout = []
+    for name, dtype, length in _sections(count, branch_width):
+        offset = _align(offset)
+        layout.append((name, dtype, length, offset))
+        offset += np.dtype(dtype).itemsize * length
+    text_start = _align(offset)
+    return layout, text_start, _align(text_start + text_size)
+
+# 一時ファイルに書いてから置き換えるので、読み出し中のプロセスが書きかけのファイルを開くことはない
+def write_tree_file(path, tree, lawdata=None):
+    lawdata = tree.lawdata if lawdata is None else lawdata
+    flat = FlatTree.from_tree(tree)
+    texts = [t.encode("utf8") for t in flat.get_texts(np.arange(len(flat)))]
+    text_offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+    np.cumsum([len(t) for t in texts], out=text_offsets[1:])
+    arrays = {
+        "parents": flat.parents,
+        "etype_ids": flat.etype_ids,
+        "main_nums": flat.main_nums,
+        "branch_nums": flat.branch_nums,
+        "subtree_ends": flat.subtree_ends,
+        "text_offsets": text_offsets,
+        }
+    meta = pickle.dumps({"lawdata": lawdata, "etypes": ETYPE_NAMES})
+    branch_width = flat.branch_nums.shape[1]
+    layout, text_start, meta_start = _layout(len(flat), branch_width, int(text_offsets[-1]))
+    tmp_path = "{0}.{1}.tmp".format(path, os.getpid())
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(flat), branch_width, int(text_offsets[-1]), len(meta)))
+        for name, dtype, length, offset in layout:
+            f.write(b"\x00" * (offset - f.tell()))
+            f.write(np.ascontiguousarray(arrays[name], dtype=dtype).tobytes())
+        f.write(b"\x00" * (text_start - f.tell()))
+        f.write(b"".join(texts))
+        f.write(b"\x00" * (meta_start - f.tell()))
+        f.write(meta)
+    os.replace(tmp_path, path)
+
+def dump_reader(reader, path):
+    write_tree_file(path, reader.get_tree(), reader.lawdata)
+
+# TreeFileの配列から子要素・文を必要になった時に読む要素
+class TreeFileExpansion(object):
+    __slots__ = ()
+
+    @classmethod
+    def vnode_inheritance(cls, parent):
+        child = cls.inheritance(parent, error_ok=True)
+        child._file = None
+        child._index = -1
+        return child
+
+    def _read_children_list(self):
+        tree_file, i = self._file, self._index
+        # 前順なので、最初の子はi+1、次の兄弟は部分木の終わりにある
+        j, end = i + 1, tree_file.subtree_ends[i]
+        while j < end:
+            child = tree_file.etype_classes[tree_file.etype_ids[j]].inheritance(self)
+            child._file = tree_file
+            child._index = j
+            child._num = tree_file.get_num(j)
+            yield child
+            j = tree_file.subtree_ends[j]
+
+    def _read_num(self):
+        return self._file.get_num(self._index)
+
+    # 書き出す時点で正規化済みの文(TreeElement.text)を保存しているので、読み出し時には正規化しない
+    @property
+    def text(self):
+        if self._text is None:
+            self._text = self._read_text()
+        return self._text
+
+    def _read_text(self):
+        if self._file is None:
+            return ""
+        return self._file.get_text(self._index)
+
+views = etypes.make_compact_etypes(vars(etypes), mixins=(TreeFileExpansion,), slots=("_file", "_index"), namespace="views", module=__name__)
+
+# write_tree_fileで書いたファイルをmmapで開く
+# 配列はmmap上にあり、get_treeは根だけを作る(子要素・文は走査した部分だけ読む)
+class TreeFile(object):
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            count, branch_width, text_size, meta_size = self._read_header()
+        except ValueError:
+            self.mm.close()
+            raise
+        layout, text_start, meta_start = _layout(count, branch_width, text_size)
+        for name, dtype, length, offset in layout:
+            setattr(self, name, np.frombuffer(self.mm, dtype=dtype, count=length, offset=offset))
+        self.branch_nums = self.branch_nums.reshape(count, branch_width)
+        self.text_start = text_start
+        meta = pickle.loads(self.mm[meta_start:meta_start+meta_size])
+        self.lawdata = meta["lawdata"]
+        self.etype_classes = [getattr(views, name) for name in meta["etypes"]]
+
+    def _read_header(self):
+        if self.mm.size() < HEADER.size:
+            raise ValueError("{} is not a tree file".format(self.path))
+        magic, version, count, branch_width, text_size, meta_size = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError("{} is not a tree file".format(self.path))
+        if version != VERSION:
+            raise ValueError("Unsupported tree file version: {0} ({1})".format(version, self.path))
+        return count, branch_width, text_size, meta_size
+
+    # 配列はmmapを参照しているので、先に手放してから閉じる
+    def close(self):
+        for name, _, _ in _sections(0, 0):
+            setattr(self, name, None)
+        self.mm.close()
+
+    def __len__(self):
+        return len(self.parents)
+
+    def get_num(self, i):
+        return ElementNumber.from_key((int(self.main_nums[i]),) + tuple(int(n) for n in self.branch_nums[i]))
+
+    def get_text(self, i):
+        start = self.text_start
+        return self.mm[start+self.text_offsets[i]:start+self.text_offsets[i+1]].decode("utf8")
+
+    def get_tree(self, lawdata=None):
+        root = self.etype_classes[self.etype_ids[0]](self.lawdata if lawdata is None else lawdata)
+        root._file = self
+        root._index = 0
+        return root
+
+# XMLファイルの内容のハッシュ値と形式のバージョンをファイル名とするTreeFileの置き場
+class TreeFileCache(object):
+    def __init__(self, dirpath):
+        self.dirpath = os.path.abspath(dirpath)
+        os.makedirs(self.dirpath, exist_ok=True)
+
+    def path_for(self, digest):
+        return os.path.join(self.dirpath, digest[:2], "{0}.v{1}{2}".format(digest, VERSION, EXT))
+
+    def _write(self, reader, path):
+        reader.open()
+        if reader.is_closed():
+            return False
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            dump_reader(reader, path)
+        finally:
+            reader.close()
+        return True
+
+    # readerが読むファイルのTreeFileを返す(なければ読んで書き出す)
+    # 既存のファイルが壊れている・形式が違う場合は書き直す
+    # 読めなかった場合はNone
+    def open(self, reader):
+        path = self.path_for(file_digest(reader.path))
+        if os.path.exists(path):
+            try:
+                return TreeFile(path)
+            except ValueError:
+                pass
+        if not self._write(reader, path):
+            return None
+        return TreeFile(path)
+
+# XMLを読む代わりにTreeFileCacheのファイルを読むReader
+# JSFMultiExecutorなどにはfunctools.partial(CachedXMLReader, cache_dir=...)として渡す
+class CachedXMLReader(SourceInterface):
+    def __init__(self, path, cache_dir, reader_cls=ReikiXMLReader):
+        self.path = os.path.abspath(path)
+        self.cache = TreeFileCache(cache_dir)
+        self.reader = reader_cls(self.path)
+        self.tree_file = None
+
+    def open(self):
+        self.tree_file = self.cache.open(self.reader)
+
+    def close(self):
+        if self.tree_file is not None:
+            self.tree_file.close()
+        self.tree_file = None
+
+    def is_closed(self):
+        return self.tree_file is None
+
+    # 例規コードはパスから決まるので、同じ内容の別のファイルのキャッシュからは名前と番号だけを使う
+    def read_lawdata(self):
+        stored = self.tree_file.lawdata
+        if not hasattr(self.reader, "_read_lawdata_from_path"):
+            return stored
+        lawdata = self.reader._read_lawdata_from_path()
+        lawdata.name = stored.name
+        lawdata.lawnum = stored.lawnum
+        return lawdata
+
+    def get_tree(self):
+        return self.tree_file.get_tree(self.lawdata)
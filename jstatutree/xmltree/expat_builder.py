@@ -0,0 +1,91 @@
+import xml.parsers.expat
+from jstatutree.lawdata import ElementNumber
+from jstatutree.myexceptions import XMLStructureError
+from . import xml_etypes
+
+# expatのイベントから一度の走査で要素木を組み立てる
+# ElementTreeを経由しないので、num, text, childrenはすべて構築時に埋まっている
+class _BuildFrame(object):
+    def __init__(self, tag, node=None):
+        self.tag = tag
+        self.node = node
+        self.capture = None
+        self.texts = []
+        self.child_started = False
+        self.auto_index = dict()
+
+class ExpatTreeBuilder(object):
+    def __init__(self, etypes=None):
+        etypes = xml_etypes.get_etypes() if etypes is None else etypes
+        self.root_etype = etypes[0]
+        self.etypes_dict = {etype.__name__: etype for etype in etypes}
+        self.root = None
+        self.law_name = None
+        self.lawnum = None
+        self._stack = []
+
+    def parse_file(self, path):
+        parser = xml.parsers.expat.ParserCreate()
+        parser.buffer_text = True
+        parser.StartElementHandler = self._start
+        parser.EndElementHandler = self._end
+        parser.CharacterDataHandler = self._chardata
+        with open(path, "rb") as f:
+            try:
+                parser.ParseFile(f)
+            except xml.parsers.expat.ExpatError as e:
+                raise XMLStructureError(error_detail="{0}: {1}".format(path, e))
+        if self.root is None:
+            raise XMLStructureError(error_detail="{} has no {} element".format(path, self.root_etype.__name__))
+        return self.root
+
+    def _read_num(self, attrs, auto_index):
+        numstr = attrs.get('Num', None)
+        if numstr is None:
+            return ElementNumber(auto_index)
+        # LawElementNumberErrorにはXMLReaderBase._build_expatで例規の情報を付ける
+        return ElementNumber(numstr)
+
+    def _start(self, tag, attrs):
+        parent = self._stack[-1] if len(self._stack) > 0 else None
+        frame = _BuildFrame(tag)
+        if parent is None:
+            pass
+        elif len(self._stack) == 1:
+            if tag == self.root_etype.__name__ and self.root is None:
+                node = self.root_etype(None)
+                node.root = None
+                node._num = self._read_num(attrs, 1)
+                node._children = dict()
+                frame.node = self.root = node
+        elif parent.node is not None:
+            if tag in self.etypes_dict:
+                parent.auto_index[tag] = parent.auto_index.get(tag, 0) + 1
+                frame.node = self.etypes_dict[tag].inheritance_from_values(
+                    parent.node,
+                    self._read_num(attrs, parent.auto_index[tag])
+                    )
+            elif parent.node is self.root and tag == "LawNum":
+                frame.capture = "lawnum"
+            elif parent.node.parent is self.root and parent.tag == "LawBody" and tag == "LawTitle":
+                frame.capture = "law_name"
+        if parent is not None:
+            parent.child_started = True
+        self._stack.append(frame)
+
+    def _chardata(self, data):
+        frame = self._stack[-1]
+        if not frame.child_started and (frame.node is not None or frame.capture is not None):
+            frame.texts.append(data)
+
+    def _end(self, tag):
+        frame = self._stack.pop()
+        text = "".join(frame.texts)
+        if frame.node is not None:
+            frame.node._text = frame.node.preprocess_str(text)
+            frame.node._sort_children()
+            parent = frame.node.parent
+            if parent is not None:
+                parent._append_child(parent._children, frame.node)
+        elif frame.capture is not None and getattr(self, frame.capture) is None and len(text) > 0:
+            setattr(self, frame.capture, text)
@@ -1,7 +1,7 @@
 import sys, os
 from jstatutree import etypes
 from jstatutree.lawdata import ElementNumber
-from jstatutree.myexceptions import LawElementNumberError
+from jstatutree.myexceptions import LawElementNumberError, ReleasedElementError
 
 def get_text(b, e_val):
     if b is not None and b.text is not None and len(b.text) > 0:
@@ -12,7 +12,12 @@ def get_text(b, e_val):
 def get_etypes():
     return etypes.get_etypes_core(globals())
 
+def get_compact_etypes():
+    return etypes.get_etypes_core(vars(compact))
+
 class XMLExpansion(object):
+    __slots__ = ()
+
     @classmethod
     def convert(cls, *args, **kwargs):
         raise Exception("Cannot convert from other tree elements to xml tree elements.")
@@ -28,13 +33,24 @@ class XMLExpansion(object):
         child.num = ElementNumber(auto_index)
         return child
 
+    # パース済みの値から要素を生成する(ExpatTreeBuilder用)
+    @classmethod
+    def inheritance_from_values(cls, parent, num):
+        child = super(XMLExpansion, cls).inheritance(parent)
+        child.root = None
+        child._num = num
+        child._children = dict()
+        return child
+
     def _read_children_list(self):
+        self._check_released()
+        etypes_dict = globals() if self.ETYPES_DICT is None else self.ETYPES_DICT
         auto_index = dict()
         for f in list(self.root):
-            if f.tag not in globals():
+            if f.tag not in etypes_dict:
                 continue
             auto_index[f.tag] = auto_index.get(f.tag, 0) + 1
-            yield globals()[f.tag].inheritance(self, f, auto_index[f.tag])
+            yield etypes_dict[f.tag].inheritance(self, f, auto_index[f.tag])
 
     @property
     def num(self):
@@ -48,6 +64,8 @@ class XMLExpansion(object):
                 self._num = auto_index
 
     def _read_num(self):
+        if self.root is None:
+            return None
         numstr = self.root.attrib.get('Num', None)
         if numstr is None:
             return None
@@ -57,8 +75,34 @@ class XMLExpansion(object):
             raise LawElementNumberError(self.lawdata, **e.__dict__)
 
     def _read_text(self):
+        if not self.is_vnode:
+            self._check_released()
         return get_text(self.root, "")
 
+    # ExpatTreeBuilderで作った要素は文・子要素を必ず持つので、ここで読むのはreleaseでXMLの要素を手放した場合だけ
+    def _check_released(self):
+        if self.root is None:
+            raise ReleasedElementError(
+                self.lawdata,
+                "{} has been released by a traversal. Reopen the reader to read it again.".format(self.code)
+                )
+
+    # ExpatTreeBuilderで作った要素(root=None)の文・子要素はXMLから読み直せない
+    def _is_reloadable(self, value_tag):
+        return self.root is not None
+
+    # 子要素を手放した場合はXMLの要素も空にして親から外す(root_etreeが部分木を持ち続けないようにする)
+    # 以降この要素の子要素は読み直せないので、もう一度走査する場合はReaderを開き直す
+    def release(self, *value_tags):
+        super().release(*value_tags)
+        if self.root is None or self._children is not None:
+            return
+        parent_root = getattr(self.parent, "root", None)
+        if parent_root is not None:
+            parent_root.remove(self.root)
+        self.root.clear()
+        self.root = None
+
 class Law(XMLExpansion, etypes.Law):
     pass
 
@@ -135,4 +179,6 @@ class Subitem5Sentence(XMLExpansion, etypes.Subitem5Sentence):
     pass
 
 class Sentence(XMLExpansion, etypes.Sentence):
-    pass
\ No newline at end of file
+    pass
+
+compact = etypes.make_compact_etypes(globals(), mixins=(XMLExpansion,), slots=("root",))
@@ -4,8 +4,11 @@ import unicodedata
 import re
 import inspect
 import xml.etree.ElementTree as ET
-from jstatutree.lawdata import SourceInterface, ReikiData, LawData
+from collections import namedtuple
+from jstatutree.lawdata import SourceInterface, ReikiData, LawData, ElementNumber
+from jstatutree.myexceptions import HieralchyError, LawElementNumberError
 from . import xml_etypes as etypes
+from .expat_builder import ExpatTreeBuilder
 
 def get_text(b, e_val):
     if b is not None and b.text is not None and len(b.text) > 0:
@@ -14,38 +17,85 @@ def get_text(b, e_val):
         return e_val
 
 ETYPES = etypes.get_etypes()
+COMPACT_ETYPES = etypes.get_compact_etypes()
+ETYPES_DICT = {etype.__name__: etype for etype in ETYPES}
+
+LevelElement = namedtuple("LevelElement", ["code", "etype", "num", "text", "sentences"])
+
+# iterparseで開いている要素の情報
+class _StreamFrame(object):
+    def __init__(self, elem, etype=None, code=None):
+        self.elem = elem
+        self.etype = etype
+        self.code = code
+        self.num = None
+        self.auto_index = dict()
+        self.sentences = None
 
 class XMLReaderBase(SourceInterface):
-    def __init__(self, path):
+    BACKENDS = ("etree", "expat")
+
+    def __init__(self, path, backend="etree", compact=False):
+        assert backend in self.BACKENDS, "Invalid backend: {}".format(backend)
         self.path = os.path.abspath(path)
+        self.backend = backend
+        self.etypes = COMPACT_ETYPES if compact else ETYPES
         self.file = None
         self.root_etree = None
+        self.expat_builder = None
 
     def open(self):
         try:
-            with open(self.path) as f:
-                s = f.read()
-            self.root_etree = ET.fromstring(s)
+            if self.backend == "expat":
+                self.expat_builder = self._build_expat()
+            else:
+                with open(self.path) as f:
+                    s = f.read()
+                self.root_etree = ET.fromstring(s)
         except Exception as e:
             print(e)
             print("Parse error")
 
+    # 番号の誤りは構築中に見つかるので、それまでに読めた例規名・例規番号を付けて投げ直す
+    def _build_expat(self):
+        builder = ExpatTreeBuilder(self.etypes)
+        try:
+            builder.parse_file(self.path)
+        except LawElementNumberError as e:
+            self.expat_builder = builder
+            try:
+                lawdata = self.read_lawdata()
+            finally:
+                self.expat_builder = None
+            raise LawElementNumberError(lawdata, **e.__dict__)
+        return builder
+
     def close(self):
         self.root_etree = None
+        self.expat_builder = None
 
     def is_closed(self):
-        return self.root_etree is None
+        return self.root_etree is None and self.expat_builder is None
 
     def get_tree(self):
-        root = ETYPES[0](self.lawdata)
+        if self.expat_builder is not None:
+            root = self.expat_builder.root
+            root.lawdata = self.lawdata
+            return root
+        root = self.etypes[0](self.lawdata)
         root.root = self.root_etree.find("./Law")
         return root
 
     def _read_law_name(self):
+        if self.expat_builder is not None:
+            return self.expat_builder.law_name
         return get_text(self.root_etree.find('Law/LawBody/LawTitle'), None)
 
     def _read_lawnum(self):
-        lawnum_text = get_text(self.root_etree.find('Law/LawNum'), "")
+        if self.expat_builder is not None:
+            lawnum_text = "" if self.expat_builder.lawnum is None else self.expat_builder.lawnum
+        else:
+            lawnum_text = get_text(self.root_etree.find('Law/LawNum'), "")
         lawnum_text = unicodedata.normalize("NFKC", lawnum_text)
         return None if len(lawnum_text) == 0 else lawnum_text
 
@@ -56,16 +106,86 @@ class XMLReaderBase(SourceInterface):
 
         return lawdata
 
+    def _stream_lawdata(self):
+        return self.lawdata
+
+    # ファイル全体を木に展開せず、target_etypeの要素を読み終えた順に返す
+    # 返した要素の部分木はその場で破棄する
+    def iterparse_elements(self, target_etype):
+        target_name = target_etype if isinstance(target_etype, str) else target_etype.__name__
+        assert target_name in ETYPES_DICT, "Invalid target etype: {}".format(target_name)
+        root_code = self._stream_lawdata().code
+        stack = []
+        target_frame = None
+        for event, elem in ET.iterparse(self.path, events=("start", "end")):
+            if event == "start":
+                frame = _StreamFrame(elem)
+                if len(stack) == 0:
+                    pass
+                elif len(stack) == 1:
+                    if elem.tag == ETYPES[0].__name__ and stack[0].auto_index.get(elem.tag, 0) == 0:
+                        stack[0].auto_index[elem.tag] = 1
+                        frame.etype = ETYPES[0]
+                        frame.num = self._stream_num(elem, 1)
+                        frame.code = frame.etype.build_code(root_code, frame.num)
+                elif stack[-1].etype is not None and elem.tag in ETYPES_DICT:
+                    parent = stack[-1]
+                    frame.etype = ETYPES_DICT[elem.tag]
+                    if not issubclass(parent.etype, frame.etype.PARENT_CANDIDATES):
+                        raise HieralchyError(
+                            self._stream_lawdata(),
+                            "invalid hieralchy "+parent.etype.__name__ + " -> " + frame.etype.__name__
+                        )
+                    parent.auto_index[elem.tag] = parent.auto_index.get(elem.tag, 0) + 1
+                    frame.num = self._stream_num(elem, parent.auto_index[elem.tag])
+                    frame.code = frame.etype.build_code(parent.code, frame.num)
+                if frame.etype is not None and frame.etype.__name__ == target_name and target_frame is None:
+                    target_frame = frame
+                    frame.sentences = []
+                stack.append(frame)
+                continue
+            frame = stack.pop()
+            if frame.etype is not None:
+                text = frame.etype.preprocess_str(get_text(elem, ""))
+                if target_frame is not None and frame.etype.__name__ == "Sentence":
+                    target_frame.sentences.append(text)
+                if frame is target_frame:
+                    target_frame = None
+                    yield LevelElement(frame.code, frame.etype, frame.num, text, frame.sentences)
+            if target_frame is None and len(stack) > 0:
+                elem.clear()
+                stack[-1].elem.remove(elem)
+
+    def _stream_num(self, elem, auto_index):
+        numstr = elem.attrib.get('Num', None)
+        if numstr is None:
+            return ElementNumber(auto_index)
+        try:
+            return ElementNumber(numstr)
+        except LawElementNumberError as e:
+            raise LawElementNumberError(self._stream_lawdata(), **e.__dict__)
+
 class ReikiXMLReader(XMLReaderBase):
     def read_lawdata(self):
+        lawdata = self._read_lawdata_from_path()
+        lawdata.name = self._read_law_name()
+        lawdata.lawnum = self._read_lawnum()
+
+        return lawdata
+
+    def _read_lawdata_from_path(self):
         lawdata =ReikiData()
         # reikicodeの設定
         p, file = os.path.split(self.path)
         lawdata.file_code = os.path.splitext(file)[0]
         p, lawdata.municipality_code = os.path.split(p)
         _, lawdata.prefecture_code = os.path.split(p)
-
-        lawdata.name = self._read_law_name()
-        lawdata.lawnum = self._read_lawnum()
-
         return lawdata
+
+    # 例規コードはパスから決まるので、ストリーミング時にファイル全体を読む必要はない
+    def _stream_lawdata(self):
+        if self.__dict__.get("_lawdata", None) is not None:
+            return self._lawdata
+        if "_stream_lawdata_cache" not in self.__dict__:
+            self._stream_lawdata_cache = self._read_lawdata_from_path()
+        return self._stream_lawdata_cache
@@ -0,0 +1,50 @@
+import unittest
+import sys, os
+sys.path.append(
+    os.path.split(os.path.split(os.path.abspath(__file__))[0])[0]
+    )
+from jstatutree.xmltree import xml_lawdata
+from jstatutree.flattree import FlatTree
+from jstatutree import etypes
+
+class FlatTreeTestCase(unittest.TestCase):
+    def setUp(self):
+        testset_path = os.path.join(os.path.dirname(__file__), "testset/01/010001/0001.xml")
+        self.rr = xml_lawdata.ReikiXMLReader(testset_path)
+        self.rr.open()
+        self.tree = self.rr.get_tree()
+        self.flat = FlatTree.from_trees([self.tree, self.tree])
+
+    def tearDown(self):
+        self.rr.close()
+
+    def test_structure(self):
+        elems = list(self.tree.depth_first_iteration())
+        self.assertEqual(len(self.flat), 2 * len(elems))
+        self.assertEqual(list(self.flat.root_indices), [0, len(elems)])
+        self.assertEqual(self.flat.get_codes(range(len(elems))), [e.code for e in elems])
+        self.assertEqual([self.flat.get_text(i) for i in range(len(elems))], [e.text for e in elems])
+        for i, e in enumerate(elems):
+            self.assertEqual(self.flat.get_num(i), e.num)
+            self.assertEqual(self.flat.subtree_ends[i] - i, len(list(e.depth_first_iteration())))
+
+    def test_depth_first_search(self):
+        for target_etype in etypes.get_etypes():
+            correct = []
+            for e in self.tree.depth_first_search(target_etype):
+                if len(correct) == 0 or correct[-1] != e.code:
+                    correct.append(e.code)
+            indices = self.flat.depth_first_search(target_etype)
+            self.assertEqual(self.flat.get_codes(indices), correct * 2)
+            self.assertEqual(list(self.flat.count_per_tree(target_etype)), [len(correct)] * 2)
+
+    def test_texts(self):
+        self.assertEqual(list(self.flat.iter_sentences()), list(self.tree.iter_sentences()) * 2)
+        indices, texts = self.flat.aggregate_texts(etypes.Article)
+        correct = ["".join(e.iter_sentences()) for e in self.tree.depth_first_search(etypes.Article)]
+        self.assertEqual(texts, correct * 2)
+        _, lengths = self.flat.aggregate_text_lengths(etypes.Article)
+        self.assertEqual(list(lengths), [len(t) for t in correct] * 2)
+
+if __name__ == "__main__":
+    unittest.main()
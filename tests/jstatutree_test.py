@@ -4,9 +4,12 @@ sys.path.append(
     )
 from jstatutree.lawdata import LawData, ReikiData, ElementNumber
 from jstatutree.etypes import get_etypes
+from jstatutree.myexceptions import ReleasedElementError
 from jstatutree.xmltree import xml_etypes, xml_lawdata
 import unittest
+import unicodedata
 from decimal import Decimal
+import pickle
 
 class GetClassesTestCase(unittest.TestCase):
     def test_get_classes(self):
@@ -84,8 +87,9 @@ class ElementNumberTestCase(unittest.TestCase):
     def check_valid_values(self, v, *correct_nums):
         n = ElementNumber(v)
         self.assertEqual(n.main_num, correct_nums[0])
-        for bn in enumerate(n.branch_nums):
-            self.assertTrue(isinstance(bn, correct_nums[1+i]))
+        self.assertEqual(len(n.branch_nums), len(correct_nums)-1)
+        for i, bn in enumerate(n.branch_nums):
+            self.assertEqual(bn, correct_nums[1+i])
 
     def test_init(self):
         self.check_valid_values(0, 0)
@@ -96,8 +100,29 @@ class ElementNumberTestCase(unittest.TestCase):
         self.check_valid_values("100", 100)
         self.check_valid_values("1_1", 1, 1)
         self.check_valid_values("1_1_1", 1, 1, 1)
+        self.check_valid_values("3_0", 3)
+        self.check_valid_values("", 1)
+        self.check_valid_values(Decimal("3.002"), 3, 2)
+        self.assertRaises(Exception, lambda: ElementNumber("1-1"))
+        self.assertRaises(TypeError, lambda: ElementNumber(1.5))
+
+    def test_order(self):
+        nums = [ElementNumber(v) for v in ["2", "1_1", "10", "1", "1_1_1", "1_2"]]
+        self.assertEqual([str(n) for n in sorted(nums)], ["1", "1_1", "1_1_1", "1_2", "2", "10"])
+        self.assertEqual(ElementNumber("3_0"), ElementNumber(3))
+        self.assertEqual(hash(ElementNumber("3_0")), hash(ElementNumber(3)))
+        self.assertNotEqual(ElementNumber("3_1"), ElementNumber(3))
+        self.assertEqual(ElementNumber("1_1").num, Decimal("1.001"))
+
+    def test_interning(self):
+        self.assertIs(ElementNumber(1), ElementNumber("1"))
+        self.assertIs(ElementNumber(200), ElementNumber(Decimal(200)))
+        self.assertIs(pickle.loads(pickle.dumps(ElementNumber(3))), ElementNumber(3))
+        self.assertEqual(pickle.loads(pickle.dumps(ElementNumber("3_2"))).key, (3, 2))
 from jstatutree.xmltree import xml_lawdata
 from jstatutree.xmltree import xml_etypes
+from jstatutree.mltree import ml_etypes
+import tracemalloc
 
 class VirtualEtypesTestCase(unittest.TestCase):
     def setUp(self):
@@ -157,6 +182,127 @@ class VirtualEtypesTestCase(unittest.TestCase):
 
 
 
+class NormalizeTestCase(unittest.TestCase):
+    def test_normalize_str(self):
+        from jstatutree.tree_element import normalize_str
+        for s in ["", " abc ", "第一条　", "（ＡＢＣ）ｶﾞ", "公布の日から施行する", "①\n"]:
+            self.assertEqual(normalize_str(s), unicodedata.normalize("NFKC", s).strip())
+
+class SortKeyTestCase(unittest.TestCase):
+    def setUp(self):
+        testset_path = os.path.join(os.path.dirname(__file__), "testset/01/010001/0001.xml")
+        self.rr = xml_lawdata.ReikiXMLReader(testset_path)
+        self.rr.open()
+
+    def test_order(self):
+        elems = list(self.rr.get_tree().depth_first_iteration())
+        shuffled = elems[1::2] + elems[::2]
+        self.assertEqual([e.code for e in sorted(shuffled)], [e.code for e in elems])
+        self.assertTrue(elems[0] < elems[1] <= elems[1] < elems[-1])
+        self.assertTrue(elems[-1] > elems[3] >= elems[3])
+
+    def test_eq_hash(self):
+        elems = list(self.rr.get_tree().depth_first_iteration())
+        other_elems = list(self.rr.get_tree().depth_first_iteration())
+        self.assertEqual(elems, other_elems)
+        self.assertEqual(set(elems), set(other_elems))
+        self.assertNotEqual(elems[3], elems[4])
+        self.assertEqual(len(set(elems)), len(elems))
+        ml_elems = list(ml_etypes.convert_recursively(self.rr.get_tree()).depth_first_iteration())
+        self.assertEqual([e.sort_key for e in ml_elems], [e.sort_key for e in elems])
+        self.assertNotEqual(ml_elems[3], elems[3])
+
+    def test_sort_key(self):
+        article = next(self.rr.get_tree().depth_first_search(xml_etypes.Article))
+        self.assertEqual(
+            article.sort_key,
+            ("01/010001/0001", (0, 0, (1,)), (1, 0, (1,)), (2, 0, (1,)), (8, 0, (1,)))
+            )
+
+class CompactLayoutTestCase(unittest.TestCase):
+    def setUp(self):
+        self.testset_path = os.path.join(os.path.dirname(__file__), "testset/01/010001/0001.xml")
+
+    def get_tree(self, compact, backend="etree"):
+        rr = xml_lawdata.ReikiXMLReader(self.testset_path, backend=backend, compact=compact)
+        rr.open()
+        return rr.get_tree()
+
+    def test_compact_tree(self):
+        for backend in xml_lawdata.XMLReaderBase.BACKENDS:
+            tree = self.get_tree(False, backend)
+            compact_tree = self.get_tree(True, backend)
+            self.assertFalse(hasattr(compact_tree, "__dict__"))
+            self.assertEqual(
+                [(e.code, e.etype.__name__, e.text) for e in compact_tree.depth_first_iteration()],
+                [(e.code, e.etype.__name__, e.text) for e in tree.depth_first_iteration()]
+                )
+            self.assertEqual(
+                [e.code for e in compact_tree.depth_first_search(xml_etypes.compact.Item, valid_vnode=True)],
+                [e.code for e in tree.depth_first_search(xml_etypes.Item, valid_vnode=True)]
+                )
+
+    def test_release(self):
+        for compact in [False, True]:
+            article_etype = xml_etypes.compact.Article if compact else xml_etypes.Article
+            expected = [(e.code, e.text) for e in self.get_tree(compact).depth_first_iteration()]
+            tree = self.get_tree(compact)
+            self.assertEqual([(e.code, e.text) for e in tree.depth_first_iteration(release=True)], expected)
+            for child in tree.children.values():
+                self.assertIsNone(child._children)
+                self.assertIsNone(child.root)
+            self.assertEqual([c.tag for c in tree.root if c.tag == "LawBody"], [])
+            tree = self.get_tree(compact)
+            self.assertEqual(
+                [e.code for e in tree.depth_first_iteration(release=("text",))],
+                [code for code, text in expected]
+                )
+            self.assertEqual([(e.code, e.text) for e in tree.depth_first_iteration()], expected)
+            tree = self.get_tree(compact)
+            articles = list(tree.depth_first_search(article_etype, release=True, retain=lambda e: e.etype == article_etype))
+            self.assertEqual(
+                [(e.code, e.text) for a in articles for e in a.depth_first_iteration()],
+                [(code, text) for code, text in expected if "/Article(" in code]
+                )
+            tree = self.get_tree(compact)
+            articles = list(tree.depth_first_search(article_etype, release=True))
+            self.assertRaises(ReleasedElementError, lambda: articles[0].children)
+            self.assertRaises(ReleasedElementError, lambda: articles[0].text)
+            # expatで作った木は読み直せないので何も手放さない
+            tree = self.get_tree(compact, "expat")
+            self.assertEqual([(e.code, e.text) for e in tree.depth_first_iteration(release=True)], expected)
+            self.assertEqual([(e.code, e.text) for e in tree.depth_first_iteration()], expected)
+
+    def test_delete_values(self):
+        for backend in xml_lawdata.XMLReaderBase.BACKENDS:
+            for compact in [False, True]:
+                tree = self.get_tree(compact, backend)
+                expected = [(e.code, e.text) for e in tree.depth_first_iteration()]
+                elem = list(tree.depth_first_iteration())[7]
+                code, text = elem.code, elem.text
+                elem.delete_values_recursively("code", "text", "children")
+                self.assertEqual(elem.code, code)
+                self.assertEqual(elem.text, text)
+                tree.delete_values_recursively("text")
+                self.assertEqual([(e.code, e.text) for e in tree.depth_first_iteration()], expected)
+                tree.delete_values_recursively("children")
+                self.assertEqual([(e.code, e.text) for e in tree.depth_first_iteration()], expected)
+
+    def measure_bytes_per_node(self, compact, copies=200):
+        src = self.get_tree(False, "expat")
+        node_count = len(list(src.depth_first_iteration()))
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        trees = [ml_etypes.convert_recursively(src, compact=compact) for _ in range(copies)]
+        after = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return (after - before) / (node_count * len(trees))
+
+    def test_memory(self):
+        default_size = self.measure_bytes_per_node(False)
+        compact_size = self.measure_bytes_per_node(True)
+        print("bytes per node: {0:.1f} (default) -> {1:.1f} (compact)".format(default_size, compact_size))
+        self.assertLess(compact_size, default_size)
 
 if __name__ == "__main__":
     unittest.main()
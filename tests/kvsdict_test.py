@@ -2,7 +2,8 @@ import sys, os
 sys.path.append(
     os.path.split(os.path.split(os.path.abspath(__file__))[0])[0]
     )
-from jstatutree.kvsdict import KVSDict, KVSPrefixDict
+from jstatutree.kvsdict import KVSDict, KVSPrefixDict, KVSValuesCounter, CODECS
+from collections import Counter
 import unittest
 import shutil
 import time
@@ -136,6 +137,282 @@ class KVSDictTestCase(unittest.TestCase):
         self.assertKeyValue({})
         print("{size} data has registerd in {sec} sec with batch".format(size=SIZE, sec=time.time()-t))
 
+class RangeScanTestCase(unittest.TestCase):
+    def setUp(self):
+        self.kvsdict = KVSDict(path=DB_PATH)
+        self.pfdict = KVSPrefixDict(self.kvsdict, prefix="lawdata-")
+        self.codes = ["01/010001/0001", "01/010001/0002", "01/010002/0001", "02/020001/0001"]
+        for code in self.codes:
+            self.pfdict[code] = code
+        self.kvsdict["other"] = "other"
+
+    def tearDown(self):
+        self.kvsdict.close()
+        shutil.rmtree(DB_PATH)
+
+    def test_prefix(self):
+        self.assertEqual(list(self.pfdict.keys(prefix="01/010001/")), self.codes[:2])
+        self.assertEqual(list(self.pfdict.values(prefix="01/")), self.codes[:3])
+        self.assertEqual(list(self.pfdict.items(prefix="03/")), [])
+        self.assertEqual(list(self.pfdict.keys(prefix="01/", reverse=True)), self.codes[2::-1])
+        self.assertEqual(list(self.kvsdict.keys(prefix="lawdata-02")), ["lawdata-02/020001/0001"])
+        self.assertEqual(len(list(self.kvsdict.keys(prefix=""))), 5)
+
+    def test_range(self):
+        self.assertEqual(list(self.pfdict.keys(start="01/010001/0002", stop="02")), self.codes[1:3])
+        self.assertEqual(list(self.pfdict.keys(start="01/010002")), self.codes[2:])
+        self.assertEqual(list(self.pfdict.keys(prefix="01/", start="01/010002")), self.codes[2:3])
+        self.assertEqual(list(self.pfdict.keys(prefix="01/", stop="01/010002")), self.codes[:2])
+        self.assertEqual(list(self.pfdict.keys(prefix="02/", stop="01/")), [])
+        self.assertEqual(list(self.kvsdict.keys(start="m")), ["other"])
+        with self.pfdict.snapshot() as ss:
+            self.assertEqual(list(ss.keys(prefix="01/010001/", reverse=True)), self.codes[1::-1])
+
+class GetManyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.kvsdict = KVSDict(path=DB_PATH)
+        self.pfdict = KVSPrefixDict(self.kvsdict, prefix="a-")
+
+    def tearDown(self):
+        self.kvsdict.close()
+        shutil.rmtree(DB_PATH)
+
+    def test_get_many(self):
+        self.pfdict.write_batch_mapping({str(i): i for i in range(0, 100, 2)})
+        self.kvsdict["b"] = "b"
+        keys = ["10", "3", "98", "10", "99", "0", "a"]
+        self.assertEqual(self.pfdict.get_many(keys), [10, None, 98, 10, None, 0, None])
+        self.assertEqual(self.pfdict.get_many(keys, default=-1), [10, -1, 98, 10, -1, 0, -1])
+        self.assertEqual(self.kvsdict.get_many(["b", "a-2", "c"]), ["b", 2, None])
+        self.assertEqual(self.pfdict.get_many([]), [])
+        cache = self.pfdict.enable_cache(max_entries=100)
+        self.pfdict.get("10")
+        self.assertEqual(self.pfdict.get_many(keys), [10, None, 98, 10, None, 0, None])
+        self.assertEqual(self.pfdict.get_many(keys), [10, None, 98, 10, None, 0, None])
+        self.assertEqual(cache.hits, len(keys) + 2)
+
+    def test_benchmark(self):
+        import random
+        SIZE = 100000
+        self.pfdict.write_batch_mapping({"01/{0:06d}/{1:04d}".format(i // 100, i % 100): "hoge"*20 for i in range(SIZE)})
+        keys = ["01/{0:06d}/{1:04d}".format(i // 100, i % 100) for i in random.sample(range(SIZE), 10000)]
+        t = time.time()
+        single = [self.pfdict.get(k) for k in keys]
+        print("get: {} sec".format(time.time()-t))
+        t = time.time()
+        many = self.pfdict.get_many(keys)
+        print("get_many: {} sec".format(time.time()-t))
+        self.assertEqual(single, many)
+
+class CountTestCase(unittest.TestCase):
+    def tearDown(self):
+        shutil.rmtree(DB_PATH)
+
+    def test_count(self):
+        kvsdict = KVSDict(path=DB_PATH)
+        pfdict = KVSPrefixDict(kvsdict, prefix="a-")
+        nested = KVSPrefixDict(pfdict, prefix="b-")
+        kvsdict["x"] = 1
+        kvsdict["x"] = 2
+        pfdict["x"] = 1
+        del pfdict["y"]
+        with nested.write_batch() as wb:
+            for i in range(10):
+                wb[str(i)] = i
+            wb["0"] = 0
+            del wb["1"]
+            del wb["2"]
+            wb["2"] = 2
+        with pfdict.write_batch() as wb:
+            sub = nested.write_batch(wb=wb)
+            del wb["x"]
+            del sub["3"]
+        self.assertEqual((len(kvsdict), len(pfdict), len(nested)), (9, 8, 8))
+        kvsdict.close()
+        kvsdict = KVSDict(path=DB_PATH)
+        pfdict = KVSPrefixDict(kvsdict, prefix="a-")
+        self.assertEqual((len(kvsdict), len(pfdict)), (9, 8))
+        self.assertEqual(len(list(pfdict.keys())), 8)
+        # 件数の記録がない辞書は最初のlen()で数える
+        other = KVSPrefixDict(kvsdict, prefix="a-b")
+        self.assertEqual(len(other), 8)
+        other["-10"] = 10
+        nested = KVSPrefixDict(pfdict, prefix="b-")
+        self.assertEqual((len(kvsdict), len(pfdict), len(nested), len(other)), (10, 9, 9, 9))
+        kvsdict.close()
+
+    def test_is_new(self):
+        kvsdict = KVSDict(path=DB_PATH)
+        pfdict = KVSPrefixDict(kvsdict, prefix="a-")
+        with pfdict.write_batch() as wb:
+            for i in range(5):
+                wb.put(str(i), i, is_new=True)
+            # 同じバッチで書いたキーはis_newでも二重に数えない
+            wb.put("0", 0, is_new=True)
+            del wb["1"]
+            nested = KVSPrefixDict(pfdict, prefix="b-")
+            wb.put("b-0", 0, is_new=True)
+        self.assertEqual((len(kvsdict), len(pfdict), len(nested)), (5, 5, 1))
+        self.assertEqual(len(list(pfdict.keys())), 5)
+        kvsdict.close()
+
+    def test_approximate_size(self):
+        kvsdict = KVSDict(path=DB_PATH)
+        pfdict = KVSPrefixDict(kvsdict, prefix="a-")
+        pfdict.write_batch_mapping({str(i): "hoge"*100 for i in range(10000)})
+        kvsdict["b"] = "fuga"
+        kvsdict.db.compact_range()
+        self.assertGreater(pfdict.approximate_size(), 100000)
+        self.assertGreaterEqual(kvsdict.approximate_size(), pfdict.approximate_size())
+        self.assertEqual(KVSPrefixDict(kvsdict, prefix="c-").approximate_size(), 0)
+        kvsdict.close()
+
+class CacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.kvsdict = KVSDict(path=DB_PATH)
+        self.pfdict = KVSPrefixDict(self.kvsdict, prefix="a-")
+
+    def tearDown(self):
+        self.kvsdict.close()
+        shutil.rmtree(DB_PATH)
+
+    def test_hit_and_invalidate(self):
+        cache = self.pfdict.enable_cache(max_entries=10)
+        self.pfdict["x"] = [1]
+        self.assertEqual(self.pfdict["x"], [1])
+        self.assertIs(self.pfdict["x"], self.pfdict["x"])
+        self.assertIsNone(self.pfdict.get("y"))
+        self.assertIsNone(self.pfdict.get("y"))
+        self.assertEqual((cache.hits, cache.misses), (3, 2))
+        self.pfdict["x"] = [2]
+        self.assertEqual(self.pfdict["x"], [2])
+        self.kvsdict["a-x"] = [3]
+        self.assertEqual(self.pfdict["x"], [3])
+        with self.kvsdict.write_batch() as wb:
+            sub = self.pfdict.write_batch(wb=wb)
+            sub["y"] = "y"
+            del wb["a-x"]
+            self.assertIsNone(self.pfdict.get("y"))
+        self.assertEqual(self.pfdict.get("y"), "y")
+        self.assertRaises(KeyError, self.pfdict.__getitem__, "x")
+        self.pfdict.disable_cache()
+        self.assertEqual(self.pfdict.get("y"), "y")
+
+    def test_limits(self):
+        cache = self.pfdict.enable_cache(max_entries=3)
+        for i in range(5):
+            self.pfdict[str(i)] = i
+            self.pfdict[str(i)]
+        self.assertEqual(list(cache.entries.keys()), [b"2", b"3", b"4"])
+        cache = self.pfdict.enable_cache(max_bytes=100)
+        self.pfdict.write_batch_mapping({str(i): "a"*30 for i in range(5)})
+        for i in range(5):
+            self.pfdict[str(i)]
+        self.assertLessEqual(cache.nbytes, 100)
+        self.assertEqual(len(cache), 100 // len(self.pfdict.codec.dumps("a"*30)))
+
+class ValuesCounterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.kvsdict = KVSDict(path=DB_PATH)
+        self.src = {"{:05d}".format(i): "文{}".format(i % 37) for i in range(5000)}
+        self.kvsdict.write_batch_mapping(self.src)
+        self.counter_path = os.path.join(TEST_PATH, "Counter-testdb.ldb")
+
+    def tearDown(self):
+        self.kvsdict.close()
+        shutil.rmtree(DB_PATH)
+        shutil.rmtree(self.counter_path)
+
+    def test_count(self):
+        expected = Counter(self.src.values())
+        counter = KVSValuesCounter(self.kvsdict, max_entries=10)
+        self.assertEqual(counter.to_dict(), dict(expected))
+        self.assertEqual(len(counter), 37)
+        counter.close()
+        counter = KVSValuesCounter(self.kvsdict, overwrite=True, proc_count=2)
+        self.assertEqual(counter.to_dict(), dict(expected))
+        counter.close()
+
+    def test_incremental(self):
+        counter = KVSValuesCounter(self.kvsdict)
+        new = {"{:05d}".format(i): "新しい文" for i in range(5000, 5010)}
+        self.kvsdict.write_batch_mapping(new)
+        counter.add_from_kvs(self.kvsdict, start="05000")
+        self.assertEqual(counter["新しい文"], 10)
+        counter.update(["文0", "文0"])
+        counter.subtract({"新しい文": 10})
+        self.assertEqual(counter.get("新しい文"), None)
+        self.assertEqual(counter["文0"], Counter(self.src.values())["文0"] + 2)
+        self.assertRaises(ValueError, counter.subtract, ["新しい文"])
+        counter.close()
+
+    def test_benchmark(self):
+        for kwargs in ({}, {"max_entries": 100}, {"proc_count": 2}):
+            t = time.time()
+            KVSValuesCounter(self.kvsdict, overwrite=True, **kwargs).close()
+            print("count {0} values {1}: {2} sec".format(len(self.src), kwargs, time.time()-t))
+
+class CodecTestCase(unittest.TestCase):
+    def tearDown(self):
+        shutil.rmtree(DB_PATH)
+
+    def test_roundtrip(self):
+        samples = {
+            "pickle": {"a": [1, 2]},
+            "marshal": [("Article", (1, 2)), ("Paragraph", (1,))],
+            "utf8": "第一条の文",
+            "strlist": ["a/Law(1)", "", "b/Article(2)"],
+            "bytes": b"\x00\x01",
+            }
+        kvsdict = KVSDict(path=DB_PATH)
+        for name, val in samples.items():
+            pfdict = KVSPrefixDict(kvsdict, prefix=name+"-", codec=name)
+            pfdict["key"] = val
+            with pfdict.write_batch() as wb:
+                wb["batch"] = val
+            self.assertEqual(pfdict["key"], val)
+            self.assertEqual(list(pfdict.values()), [val, val])
+            with pfdict.snapshot() as ss:
+                self.assertEqual(ss["batch"], val)
+        self.assertEqual(KVSPrefixDict(kvsdict, prefix="strlist-", codec="strlist")["key"], samples["strlist"])
+        self.assertRaises(ValueError, KVSPrefixDict(kvsdict, prefix="strlist-", codec="strlist").__setitem__, "bad", ["a\x00b"])
+        self.assertEqual(len(kvsdict), len(samples)*2)
+        kvsdict.close()
+
+    def test_recorded_codec(self):
+        kvsdict = KVSDict(path=DB_PATH)
+        pfdict = KVSPrefixDict(kvsdict, prefix="s-", codec="utf8")
+        pfdict["hoge"] = "hogehoge"
+        kvsdict.close()
+        kvsdict = KVSDict(path=DB_PATH)
+        pfdict = KVSPrefixDict(kvsdict, prefix="s-")
+        self.assertEqual(pfdict.codec.name, "utf8")
+        self.assertEqual(pfdict["hoge"], "hogehoge")
+        self.assertRaises(ValueError, KVSPrefixDict, kvsdict, prefix="s-", codec="pickle")
+        self.assertEqual(list(kvsdict.keys()), ["s-hoge"])
+        kvsdict.close()
+
+    def test_benchmark(self):
+        SIZE = 20000
+        samples = {
+            "utf8": {str(i): "第{}条の本文".format(i)*5 for i in range(SIZE)},
+            "marshal": {str(i): [("Article", (i,)), ("Paragraph", (1, 2))] for i in range(SIZE)},
+            "strlist": {str(i): ["01/010001/0001/Law(1)/Article({})".format(j) for j in range(5)] for i in range(SIZE)},
+            }
+        kvsdict = KVSDict(path=DB_PATH)
+        for name, d in samples.items():
+            for codec in (name, "pickle"):
+                pfdict = KVSPrefixDict(kvsdict, prefix=codec+"-"+name+"-", codec=codec)
+                t = time.time()
+                pfdict.write_batch_mapping(d)
+                write_sec = time.time() - t
+                t = time.time()
+                for _ in pfdict.values():
+                    pass
+                read_sec = time.time() - t
+                size = sum(len(CODECS[codec].dumps(v)) for v in d.values())
+                print("{0:>8}/{1:<8} write {2:.3f} sec, read {3:.3f} sec, {4} bytes".format(name, codec, write_sec, read_sec, size))
+        kvsdict.close()
 
 if __name__ == "__main__":
     unittest.main()
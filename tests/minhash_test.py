@@ -0,0 +1,105 @@
+import sys, os
+sys.path.append(
+    os.path.split(os.path.split(os.path.abspath(__file__))[0])[0]
+    )
+from jstatutree.minhash import MinHashLSH, MinHasher, shingle_hashes, estimate_similarity, element_text
+from jstatutree.xmltree import xml_lawdata
+from jstatutree.mltree import ml_etypes
+from jstatutree import etypes
+import unittest
+import shutil
+import random
+import time
+
+TEST_PATH = os.path.dirname(__file__)
+INDEX_PATH = os.path.join(TEST_PATH, "testlsh.ldb")
+
+def random_text(rng, size):
+    chars = "あいうえおかきくけこさしすせそたちつてと条例規則町長村長公布施行"
+    return "".join(rng.choice(chars) for _ in range(size))
+
+class MinHasherTestCase(unittest.TestCase):
+    def test_signature(self):
+        hasher = MinHasher(num_perm=256)
+        rng = random.Random(0)
+        base = random_text(rng, 2000)
+        near = base[:1800] + random_text(rng, 200)
+        self.assertEqual(estimate_similarity(hasher.signature(base), hasher.signature(base)), 1.0)
+        a, b = set(shingle_hashes(base)), set(shingle_hashes(near))
+        jaccard = len(a & b) / len(a | b)
+        self.assertAlmostEqual(estimate_similarity(hasher.signature(base), hasher.signature(near)), jaccard, delta=0.1)
+        self.assertLess(estimate_similarity(hasher.signature(base), hasher.signature(random_text(rng, 2000))), 0.1)
+        self.assertEqual(len(shingle_hashes("")), 0)
+        self.assertEqual(len(shingle_hashes("あい")), 1)
+
+class MinHashLSHTestCase(unittest.TestCase):
+    def setUp(self):
+        self.lsh = MinHashLSH(INDEX_PATH)
+        rng = random.Random(1)
+        self.model = random_text(rng, 1000)
+        self.texts = {
+            "01/010001/0001": self.model,
+            "01/010002/0001": self.model[:950] + random_text(rng, 50),
+            "02/020001/0001": self.model[:900] + random_text(rng, 100),
+            "03/030001/0001": random_text(rng, 1000),
+            }
+        for code, text in self.texts.items():
+            self.lsh.add(code, text)
+
+    def tearDown(self):
+        self.lsh.close()
+        shutil.rmtree(INDEX_PATH)
+
+    def test_query(self):
+        results = self.lsh.query(self.model, threshold=0.5)
+        self.assertEqual([code for code, _ in results], ["01/010001/0001", "01/010002/0001", "02/020001/0001"])
+        self.assertEqual(results[0][1], 1.0)
+        self.assertEqual(self.lsh.query(self.model, exclude="01/010001/0001")[0][0], "01/010002/0001")
+
+    def test_all_pairs(self):
+        pairs = sorted(self.lsh.all_pairs(threshold=0.5))
+        self.assertEqual([(a, b) for a, b, _ in pairs], [
+            ("01/010001/0001", "01/010002/0001"),
+            ("01/010001/0001", "02/020001/0001"),
+            ("01/010002/0001", "02/020001/0001"),
+            ])
+        self.assertEqual(list(self.lsh.all_pairs(threshold=0.5, max_bucket_size=1)), [])
+
+    def test_update(self):
+        self.lsh.remove("01/010002/0001")
+        self.lsh.add("02/020001/0001", random_text(random.Random(2), 1000))
+        self.assertEqual([code for code, _ in self.lsh.query(self.model, threshold=0.5)], ["01/010001/0001"])
+        self.assertEqual(list(self.lsh.all_pairs(threshold=0.5)), [])
+        self.assertEqual(len(self.lsh), 3)
+        self.lsh.close()
+        self.assertRaises(ValueError, MinHashLSH, INDEX_PATH, bands=16)
+        self.lsh = MinHashLSH(INDEX_PATH)
+        self.assertEqual(len(self.lsh), 3)
+
+    def test_tree(self):
+        reader = xml_lawdata.ReikiXMLReader(os.path.join(TEST_PATH, "testset/01/010001/0001.xml"))
+        reader.open()
+        tree = ml_etypes.convert_recursively(reader.get_tree())
+        reader.close()
+        self.lsh.add_tree(tree, target_etype=etypes.Article)
+        articles = list(tree.depth_first_search(etypes.Article))
+        self.assertEqual(len(self.lsh), len(self.texts) + len(articles))
+        for article in articles:
+            results = self.lsh.query(element_text(article))
+            self.assertEqual(results[0], (article.code, 1.0))
+            self.assertEqual(self.lsh.query_tree(article), results[1:])
+
+    def test_benchmark(self):
+        rng = random.Random(3)
+        models = [random_text(rng, 2000) for _ in range(20)]
+        t = time.time()
+        for i in range(1000):
+            model = models[i % len(models)]
+            self.lsh.add("99/{:06d}/0001".format(i), model[:1900] + random_text(rng, 100))
+        print("add 1000 ordinances: {:.3f} sec".format(time.time()-t))
+        t = time.time()
+        pairs = list(self.lsh.all_pairs(threshold=0.8))
+        print("all_pairs: {0} pairs in {1:.3f} sec".format(len(pairs), time.time()-t))
+
+if __name__ == "__main__":
+    unittest.main()
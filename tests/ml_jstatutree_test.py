@@ -5,21 +5,25 @@ from jstatutree.xmltree import xml_etypes
 from jstatutree.mltree import ml_lawdata
 from jstatutree.mltree import ml_etypes
 from jstatutree.lawdata import LawData
+from jstatutree.jstatute_dict import JSFMultiExecutor
 import shutil
+import tempfile
 
 TEST_PATH = os.path.dirname(__file__)
 DB_PATH = os.path.join(TEST_PATH, "testdb")
 class ReikiKVSReaderTestCase(unittest.TestCase):
+    LAYOUT = "tree"
+
     def setUp(self):
         testset_path = os.path.join(os.path.dirname(__file__), "testset/01/010001/0001.xml")
         self.xml_rr = xml_lawdata.ReikiXMLReader(testset_path)
         self.xml_rr.open()
         assert self.xml_rr.get_tree() is not None, "test set path is invalid.\n"+str(testset_path)
 
-        writer = ml_lawdata.JStatutreeKVS(DB_PATH)
-        writer.set_from_reader(self.xml_rr)
+        self.writer = ml_lawdata.JStatutreeKVS(DB_PATH, layout=self.LAYOUT)
+        self.writer.set_from_reader(self.xml_rr)
         #print("writer: ",list(writer["lawdata"].items()))
-        self.rr = ml_lawdata.ReikiKVSReader(code="01/010001/0001", db=writer)
+        self.rr = ml_lawdata.ReikiKVSReader(code="01/010001/0001", db=self.writer)
         #print("reader: ",list(self.rr.db["lawdata"].items()))
 
     def test_get_lawdata(self):
@@ -29,6 +33,64 @@ class ReikiKVSReaderTestCase(unittest.TestCase):
         self.assertEqual(ld.name, "法令名")
         self.assertEqual(ld.lawnum, "法令番号")
 
+    def test_range_scan(self):
+        self.assertEqual(list(self.writer.law_codes(prefix="01/010001/")), ["01/010001/0001"])
+        self.assertEqual(list(self.writer.law_codes(prefix="01/010002/")), [])
+        article_code = "01/010001/0001/Law(1)/LawBody(1)/MainProvision(1)/Article(2)"
+        self.assertEqual(
+            sorted(text for code, text in self.writer.sentences_under(article_code)),
+            sorted(e.text for e in self.rr.get_tree().depth_first_iteration() if e.code.startswith(article_code+"/") and len(e.text) > 0)
+            )
+
+    def test_read_many(self):
+        code = "01/010001/0001"
+        expected = [(e.code, e.text) for e in self.rr.get_tree().depth_first_iteration()]
+        readers = ml_lawdata.ReikiKVSReader.read_many([code, code], db=self.writer, with_texts=True)
+        self.assertEqual([r.lawdata.name for r in readers], ["法令名", "法令名"])
+        node_dict, sentence_dict = self.writer["node"], self.writer["sentence"]
+        node_dict.get = sentence_dict.get = None
+        for reader in readers:
+            self.assertEqual([(e.code, e.text) for e in reader.get_tree().depth_first_iteration()], expected)
+        del node_dict.get, sentence_dict.get
+        self.assertRaises(KeyError, ml_lawdata.ReikiKVSReader.read_many, [code, "01/010001/9999"], self.writer)
+
+    def test_cache(self):
+        self.writer.enable_cache(max_entries=100)
+        for _ in range(3):
+            rr = ml_lawdata.ReikiKVSReader(code="01/010001/0001", db=self.writer)
+            self.assertEqual(rr.lawdata.name, "法令名")
+            self.assertEqual(len(list(rr.get_tree().depth_first_iteration())), len(list(self.rr.get_tree().depth_first_iteration())))
+        stats = self.writer.cache_stats()
+        self.assertGreater(stats["lawdata"][0], 0)
+        self.assertEqual(stats["lawdata"][1], 1)
+        self.xml_rr.lawdata.name = "変更後"
+        self.writer.set_from_reader(self.xml_rr)
+        self.assertEqual(ml_lawdata.ReikiKVSReader(code="01/010001/0001", db=self.writer).lawdata.name, "変更後")
+
+    def test_release(self):
+        expected = [(e.code, e.text) for e in self.rr.get_tree().depth_first_iteration()]
+        self.writer.enable_cache(max_entries=100)
+        for _ in range(2):
+            tree = ml_lawdata.ReikiKVSReader(code="01/010001/0001", db=self.writer).get_tree()
+            self.assertEqual([(e.code, e.text) for e in tree.depth_first_iteration(release=True)], expected)
+            for child in tree.children.values():
+                self.assertIsNone(child._text)
+                self.assertEqual(child._children is None, self.LAYOUT == "node")
+            self.assertEqual([(e.code, e.text) for e in tree.depth_first_iteration()], expected)
+        # 手放せるかどうかの判定でnodeを読まない(子要素を持つ要素ごとに一度だけ読む)
+        node_dict = self.writer["node"]
+        reads = []
+        node_get = node_dict.get
+        node_dict.get = lambda *args: reads.append(args[0]) or node_get(*args)
+        tree = ml_lawdata.ReikiKVSReader(code="01/010001/0001", db=self.writer).get_tree()
+        list(tree.depth_first_iteration(release=True))
+        del node_dict.get
+        self.assertEqual(len(reads), len(set(reads)))
+        # DBを持たない木は何も手放さない
+        tree = ml_etypes.convert_recursively(self.xml_rr.get_tree())
+        self.assertEqual([(e.code, e.text) for e in tree.depth_first_iteration(release=True)], expected)
+        self.assertEqual([(e.code, e.text) for e in tree.depth_first_iteration()], expected)
+
     def element_match(self, elem, etype, num, text):
         self.assertEqual(etype, elem.etype)
         self.assertEqual(num, int(elem.num.num))
@@ -81,6 +143,7 @@ class ReikiKVSReaderTestCase(unittest.TestCase):
     def tearDown(self):
         self.xml_rr.close()
         self.rr.close()
+        self.writer.close()
         shutil.rmtree(DB_PATH)
 
     def velement_match(self, elem, etype, num=0, text="", is_vnode=True):
@@ -125,5 +188,173 @@ class ReikiKVSReaderTestCase(unittest.TestCase):
             ]
             )
 
+class NodeLayoutReikiKVSReaderTestCase(ReikiKVSReaderTestCase):
+    LAYOUT = "node"
+
+    def test_lazy_read(self):
+        read_codes = []
+        node_dict = self.writer["node"]
+        def get(key, default=None):
+            read_codes.append(key)
+            return type(node_dict).get(node_dict, key, default)
+        node_dict.get = get
+        tree = self.rr.get_tree()
+        article = tree.children[""].children[""].children["第2条"]
+        paragraph = article.children["第2項"]
+        self.assertEqual(
+            [s.text for s in paragraph.children[""].children.values()],
+            ["第二項本文", "第二項但し書き"]
+            )
+        self.assertEqual(read_codes, [
+            "01/010001/0001",
+            "01/010001/0001/Law(1)",
+            "01/010001/0001/Law(1)/LawBody(1)",
+            "01/010001/0001/Law(1)/LawBody(1)/MainProvision(1)",
+            "01/010001/0001/Law(1)/LawBody(1)/MainProvision(1)/Article(2)",
+            "01/010001/0001/Law(1)/LawBody(1)/MainProvision(1)/Article(2)/Paragraph(2)",
+            "01/010001/0001/Law(1)/LawBody(1)/MainProvision(1)/Article(2)/Paragraph(2)/ParagraphSentence(1)",
+            ])
+        self.assertTrue(self.writer["root"].is_empty())
+
+class JStatutreeKVSTestCase(unittest.TestCase):
+    def setUp(self):
+        testset_path = os.path.join(os.path.dirname(__file__), "testset/01/010001/0001.xml")
+        self.xml_rr = xml_lawdata.ReikiXMLReader(testset_path)
+        self.xml_rr.open()
+
+    def tearDown(self):
+        self.xml_rr.close()
+        shutil.rmtree(DB_PATH)
+
+    def test_single_db(self):
+        kvs = ml_lawdata.JStatutreeKVS(DB_PATH)
+        kvs.set_from_reader(self.xml_rr)
+        self.assertEqual(os.listdir(DB_PATH), [ml_lawdata.JStatutreeKVS.DBNAME])
+        self.assertEqual(
+            kvs["sentence"]["01/010001/0001/Law(1)/LawBody(1)/MainProvision(1)/Article(2)/Paragraph(2)/ParagraphSentence(1)/Sentence(2)"],
+            "第二項但し書き"
+            )
+        kvs.close()
+
+    def test_atomic_batch(self):
+        kvs = ml_lawdata.JStatutreeKVS(DB_PATH)
+        def write_and_fail():
+            with kvs.write_batch() as wb:
+                wb.set_from_reader(self.xml_rr)
+                raise RuntimeError("interrupted")
+        self.assertRaises(RuntimeError, write_and_fail)
+        for name in ml_lawdata.JStatutreeKVS.DICT_NAMES:
+            self.assertTrue(kvs[name].is_empty())
+        kvs.close()
+
+    def test_normalize_sentences(self):
+        kvs = ml_lawdata.JStatutreeKVS(DB_PATH, layout="node")
+        kvs.set_from_reader(self.xml_rr)
+        code = "01/010001/0001/Law(1)/LawBody(1)/MainProvision(1)/Article(2)/Paragraph(2)/ParagraphSentence(1)/Sentence(2)"
+        self.assertEqual(kvs.normalize_sentences(), 0)
+        kvs["sentence"][code] = " 第二項但し書き（ＡＢＣ） "
+        kvs["sentence"][code + "/Sentence(1)"] = "　"
+        self.assertEqual(kvs.normalize_sentences(prefix="01/010001/"), 2)
+        self.assertEqual(kvs["sentence"][code], "第二項但し書き(ABC)")
+        self.assertIsNone(kvs["sentence"].get(code + "/Sentence(1)"))
+        tree = ml_lawdata.ReikiKVSReader(code="01/010001/0001", db=kvs).get_tree()
+        self.assertIn("第二項但し書き(ABC)", list(tree.iter_texts()))
+        kvs.close()
+
+    def test_legacy_store(self):
+        lawdata_dict = ml_lawdata.KVSDict(path=os.path.join(DB_PATH, "lawdata.ldb"))
+        lawdata_dict["01/010001/0001"] = self.xml_rr.lawdata
+        lawdata_dict.close()
+        kvs = ml_lawdata.JStatutreeKVS(DB_PATH)
+        self.assertIsNone(kvs.db)
+        self.assertEqual(kvs["lawdata"]["01/010001/0001"].name, "法令名")
+        kvs.set_from_reader(self.xml_rr)
+        self.assertEqual(ml_lawdata.ReikiKVSReader(code="01/010001/0001", db=kvs).get_tree().code, "01/010001/0001/Law(1)")
+        kvs.close()
+
+DATASET_PATH = os.path.join(TEST_PATH, "testset")
+class JSFMultiExecutorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.kvs = ml_lawdata.JStatutreeKVS(DB_PATH)
+
+    def tearDown(self):
+        self.kvs.close()
+        shutil.rmtree(DB_PATH)
+
+    def test_setup_from_basepath(self):
+        progress = []
+        executor = JSFMultiExecutor(self.kvs, proc_count=2, batch_size=1)
+        stats = executor.setup_from_basepath(DATASET_PATH, callback=progress.append, callback_interval=1)
+        self.assertTrue(str(stats).startswith("1/1 files (1 written, 0 failed, 0 unchanged, 0 removed)"))
+        self.assertEqual(stats.submitted, 1)
+        self.assertEqual(stats.written, 1)
+        self.assertEqual(stats.failed, 0)
+        self.assertEqual(len(progress), 1)
+        rr = ml_lawdata.ReikiKVSReader(code="01/010001/0001", db=self.kvs)
+        self.assertEqual(rr.lawdata.name, "法令名")
+        tree = rr.get_tree()
+        self.assertEqual(
+            [e.text for e in tree.depth_first_iteration() if e.etype is ml_etypes.Sentence][:3],
+            ["第一項本文", "第一項本文", "第二項本文"]
+            )
+
+    def test_parse_error(self):
+        missing_path = os.path.join(DATASET_PATH, "01/010001/9999.xml")
+        executor = JSFMultiExecutor(self.kvs, proc_count=1)
+        stats = executor.add_tree_sources_from_paths([missing_path])
+        self.assertEqual(stats.failed, 1)
+        self.assertEqual(stats.written, 0)
+        self.assertEqual(stats.errors[0][0], missing_path)
+
+class IncrementalIngestTestCase(unittest.TestCase):
+    PROVISO_CODE = "01/010001/0001/Law(1)/LawBody(1)/MainProvision(1)/Article(2)/Paragraph(2)/ParagraphSentence(1)/Sentence(2)"
+
+    def setUp(self):
+        self.basepath = tempfile.mkdtemp()
+        shutil.copytree(DATASET_PATH, os.path.join(self.basepath, "testset"))
+        self.basepath = os.path.join(self.basepath, "testset")
+        self.xml_path = os.path.join(self.basepath, "01/010001/0001.xml")
+        self.kvs = ml_lawdata.JStatutreeKVS(DB_PATH)
+        self.executor = JSFMultiExecutor(self.kvs, proc_count=1)
+
+    def tearDown(self):
+        self.kvs.close()
+        shutil.rmtree(DB_PATH)
+        shutil.rmtree(os.path.dirname(self.basepath))
+
+    def update(self):
+        stats = self.executor.update_from_basepath(self.basepath)
+        return (stats.written, stats.unchanged, stats.removed)
+
+    def test_update(self):
+        self.assertEqual(self.update(), (1, 0, 0))
+        entry = self.kvs["manifest"][self.xml_path]
+        self.assertEqual(entry[3], "01/010001/0001")
+        self.assertEqual(self.update(), (0, 1, 0))
+        # 内容が同じなら更新時刻が変わっても読み直さない
+        os.utime(self.xml_path, ns=(entry[1] + 10**9, entry[1] + 10**9))
+        self.assertEqual(self.update(), (0, 1, 0))
+        self.assertEqual(self.kvs["manifest"][self.xml_path][1], entry[1] + 10**9)
+        sentence_count = len(self.kvs["sentence"])
+        with open(self.xml_path, encoding="utf8") as f:
+            xml = f.read()
+        with open(self.xml_path, "w", encoding="utf8") as f:
+            f.write(xml.replace('<Sentence Num="2" Function="Proviso">第二項但し書き</Sentence>', ""))
+        self.assertEqual(self.update(), (1, 0, 0))
+        self.assertIsNone(self.kvs["sentence"].get(self.PROVISO_CODE))
+        self.assertEqual(len(self.kvs["sentence"]), sentence_count - 1)
+        os.remove(self.xml_path)
+        self.assertEqual(self.update(), (0, 0, 1))
+        for name in ml_lawdata.JStatutreeKVS.DICT_NAMES:
+            self.assertTrue(self.kvs[name].is_empty())
+
+    def test_resume(self):
+        # 書き込み前に中断した場合、次の実行で読み直す
+        self.executor._write_batch = lambda *args: (_ for _ in ()).throw(RuntimeError("interrupted"))
+        self.assertRaises(RuntimeError, self.update)
+        self.assertTrue(self.kvs["manifest"].is_empty())
+        del self.executor._write_batch
+        self.assertEqual(self.update(), (1, 0, 0))
+
 if __name__ == "__main__":
     unittest.main()
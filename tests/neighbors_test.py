@@ -0,0 +1,116 @@
+import unittest
+import sys, os
+sys.path.append(
+    os.path.split(os.path.split(os.path.abspath(__file__))[0])[0]
+    )
+import shutil
+import time
+import numpy as np
+from jstatutree.xmltree import xml_lawdata
+from jstatutree.mltree import ml_lawdata
+from jstatutree.mltree.vectorizer import HashingVectorizer, export_features, CSRArrays
+from jstatutree.mltree import neighbors
+from jstatutree.mltree.neighbors import VectorSearch, load_elements
+from jstatutree import etypes
+
+TEST_PATH = os.path.dirname(__file__)
+DB_PATH = os.path.join(TEST_PATH, "testdb")
+FEATURES_PATH = os.path.join(TEST_PATH, "testfeatures")
+
+def brute_force(matrix, query, k):
+    norms = np.linalg.norm(matrix, axis=1)
+    scores = matrix @ query / np.where(norms > 0, norms, 1) / np.linalg.norm(query)
+    scores[norms == 0] = -np.inf
+    order = np.lexsort((np.arange(len(scores)), -scores))[:k]
+    return [i for i in order if scores[i] > -np.inf]
+
+class VectorSearchTestCase(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.matrix = rng.randn(1000, 16).astype(np.float32)
+        self.matrix[7] = 0
+        self.codes = ["01/010001/{:04d}/Law(1)".format(i) for i in range(1000)]
+
+    def test_search(self):
+        search = VectorSearch(self.matrix, self.codes, block_size=128, n_jobs=4)
+        queries = np.random.RandomState(1).randn(5, 16)
+        results = search.search_batch(queries, k=10)
+        for query, result in zip(queries, results):
+            self.assertEqual([code for code, _ in result], [self.codes[i] for i in brute_force(self.matrix, query, 10)])
+            self.assertTrue(all(a[1] >= b[1] for a, b in zip(result, result[1:])))
+        codes = lambda result: [code for code, _ in result]
+        self.assertEqual(codes(search.search(queries[0], k=10)), codes(results[0]))
+        self.assertEqual(codes(search.search(queries[0], k=10, exclude={results[0][0][0]})), codes(search.search(queries[0], k=11))[1:])
+        similar = search.search_codes(self.codes[:3], k=5)
+        for code, result in zip(self.codes[:3], similar):
+            self.assertNotIn(code, [c for c, _ in result])
+            self.assertEqual(len(result), 5)
+
+    def test_memory_limit(self):
+        queries = np.random.RandomState(5).randn(10, 16)
+        expected = VectorSearch(self.matrix, self.codes).search_batch(queries, k=10)
+        search = VectorSearch(self.matrix, self.codes, n_jobs=4, memory_limit=4 * 4 * (4*16 + 12*3), query_chunk=3)
+        self.assertEqual(search._block_rows(3, 4), 4)
+        # ブロックごとの上位はその都度まとめ、候補はk+除外数件を超えない
+        sizes = []
+        merge_top = neighbors._merge_top
+        def recording_merge_top(*args):
+            merged = merge_top(*args)
+            sizes.append(len(merged[0]))
+            return merged
+        neighbors._merge_top = recording_merge_top
+        try:
+            results = search.search_batch(queries, k=10, exclude=[{self.codes[q]} for q in range(10)])
+        finally:
+            neighbors._merge_top = merge_top
+        self.assertGreater(len(sizes), 100)
+        self.assertEqual(max(sizes), 11)
+        for q, (result, full) in enumerate(zip(results, expected)):
+            self.assertEqual([code for code, _ in result], [code for code, _ in full if code != self.codes[q]][:10])
+
+    def test_sparse(self):
+        dense = np.where(np.abs(self.matrix) > 1, self.matrix, 0).astype(np.float32)
+        rows, cols = np.nonzero(dense)
+        csr = CSRArrays(
+            data=dense[rows, cols], indices=cols.astype(np.int32),
+            indptr=np.concatenate(([0], np.cumsum(np.bincount(rows, minlength=len(dense))))), shape=dense.shape
+            )
+        query = np.random.RandomState(2).randn(16)
+        self.assertEqual(
+            [code for code, _ in VectorSearch(csr, self.codes, block_size=100).search(query, k=10)],
+            [code for code, _ in VectorSearch(dense, self.codes).search(query, k=10)]
+            )
+
+    def test_benchmark(self):
+        matrix = np.random.RandomState(3).randn(200000, 64).astype(np.float32)
+        codes = [str(i) for i in range(len(matrix))]
+        search = VectorSearch(matrix, codes, block_size=16384)
+        queries = np.random.RandomState(4).randn(100, 64)
+        t = time.time()
+        search.search_batch(queries, k=20)
+        print("100 queries over {0} vectors: {1:.3f} sec".format(len(matrix), time.time()-t))
+
+class ElementSearchTestCase(unittest.TestCase):
+    def setUp(self):
+        reader = xml_lawdata.ReikiXMLReader(os.path.join(TEST_PATH, "testset/01/010001/0001.xml"))
+        reader.open()
+        self.kvs = ml_lawdata.JStatutreeKVS(DB_PATH)
+        self.kvs.set_from_reader(reader)
+        reader.close()
+
+    def tearDown(self):
+        self.kvs.close()
+        shutil.rmtree(DB_PATH)
+        shutil.rmtree(FEATURES_PATH)
+
+    def test_search_articles(self):
+        export_features(self.kvs, FEATURES_PATH, etypes.Article, vectorizer=HashingVectorizer(n_features=256))
+        search = VectorSearch.load(FEATURES_PATH)
+        result = search.search_codes([search.codes[0]], k=3)[0]
+        elements = load_elements(self.kvs, [code for code, _ in result])
+        self.assertEqual([e.code for e in elements], [code for code, _ in result])
+        self.assertTrue(all(e.etype.__name__ == "Article" for e in elements))
+        self.assertRaises(KeyError, load_elements, self.kvs, [search.codes[0] + "/Paragraph(99)"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+import sys, os
+sys.path.append(
+    os.path.split(os.path.split(os.path.abspath(__file__))[0])[0]
+    )
+from jstatutree.ngram_index import NgramIndex, encode_postings, decode_postings
+from jstatutree.mltree import ml_lawdata
+from jstatutree.jstatute_dict import JSFMultiExecutor
+import unittest
+import shutil
+import random
+import time
+
+TEST_PATH = os.path.dirname(__file__)
+DB_PATH = os.path.join(TEST_PATH, "testdb")
+INDEX_PATH = os.path.join(TEST_PATH, "testindex.ldb")
+
+class PostingsTestCase(unittest.TestCase):
+    def test_roundtrip(self):
+        for ids in ([], [0], [1, 2, 300], [5, 127, 128, 16384, 2**40]):
+            self.assertEqual(list(decode_postings(encode_postings(ids))), ids)
+        self.assertEqual(encode_postings([1, 2, 300]), b"\x01\x01\xaa\x02")
+
+class NgramIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.index = NgramIndex(INDEX_PATH, n=2)
+        self.sentences = {
+            "a/Sentence(1)": "この条例は、公布の日から施行する。",
+            "a/Sentence(2)": "町長は、規則で定める。",
+            "b/Sentence(1)": "この規則は、公布の日から施行する。",
+            "b/Sentence(2)": "ＡＢＣ",
+            }
+        for code, text in self.sentences.items():
+            self.index.add(code, text)
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(INDEX_PATH)
+
+    def test_search(self):
+        self.assertEqual(self.index.search("公布の日"), ["a/Sentence(1)", "b/Sentence(1)"])
+        self.assertEqual(self.index.search("条例は"), ["a/Sentence(1)"])
+        self.assertEqual(self.index.search("規則"), ["a/Sentence(2)", "b/Sentence(1)"])
+        self.assertEqual(self.index.search("規則", limit=1), ["a/Sentence(2)"])
+        self.assertEqual(self.index.search("。"), ["a/Sentence(1)", "a/Sentence(2)", "b/Sentence(1)"])
+        self.assertEqual(self.index.search("ABC"), ["b/Sentence(2)"])
+        self.assertEqual(self.index.search("施行しない"), [])
+        # n-gramは全て含むが連続していない
+        self.assertEqual(self.index.search("町長は、公布"), [])
+
+    def test_update(self):
+        self.index.add("a/Sentence(2)", "村長が定める。")
+        self.index.remove("b/Sentence(1)")
+        self.assertEqual(self.index.search("規則"), [])
+        self.assertEqual(self.index.search("村長"), ["a/Sentence(2)"])
+        self.assertEqual(len(self.index), 3)
+        self.index.optimize()
+        self.assertEqual(self.index.search("公布"), ["a/Sentence(1)"])
+        self.index.close()
+        self.assertRaises(ValueError, NgramIndex, INDEX_PATH, n=3)
+        self.index = NgramIndex(INDEX_PATH, n=2)
+        self.assertEqual(self.index.search("村長"), ["a/Sentence(2)"])
+        self.index.add("c/Sentence(1)", "村長")
+        self.assertEqual(self.index.search("村長"), ["a/Sentence(2)", "c/Sentence(1)"])
+        self.index.add("c/Sentence(1)", "")
+        self.assertEqual(self.index.search("村長"), ["a/Sentence(2)"])
+
+    def test_benchmark(self):
+        chars = "あいうえおかきくけこさしすせそ条例規則町長公布施行"
+        SIZE = 20000
+        t = time.time()
+        for i in range(SIZE):
+            self.index.add("c/Sentence({})".format(i), "".join(random.choice(chars) for _ in range(40)))
+        self.index.flush()
+        print("index {0} sentences: {1:.3f} sec".format(SIZE, time.time()-t))
+        t = time.time()
+        hits = self.index.search("条例規則")
+        print("search: {0} hits in {1:.3f} sec".format(len(hits), time.time()-t))
+
+class IngestIndexTestCase(unittest.TestCase):
+    def tearDown(self):
+        shutil.rmtree(DB_PATH)
+        shutil.rmtree(INDEX_PATH)
+
+    def test_executor(self):
+        kvs = ml_lawdata.JStatutreeKVS(DB_PATH)
+        index = NgramIndex(INDEX_PATH)
+        JSFMultiExecutor(kvs, proc_count=1, index=index).setup_from_basepath(os.path.join(TEST_PATH, "testset"))
+        self.assertEqual(
+            index.search("第二項但し書き"),
+            ["01/010001/0001/Law(1)/LawBody(1)/MainProvision(1)/Article(2)/Paragraph(2)/ParagraphSentence(1)/Sentence(2)"]
+            )
+        self.assertEqual(len(index), sum(1 for _ in kvs["sentence"].keys()))
+        index.close()
+        kvs.close()
+
+if __name__ == "__main__":
+    unittest.main()
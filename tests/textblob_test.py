@@ -0,0 +1,78 @@
+import unittest
+import sys, os
+sys.path.append(
+    os.path.split(os.path.split(os.path.abspath(__file__))[0])[0]
+    )
+import shutil
+from jstatutree.xmltree import xml_lawdata
+from jstatutree.mltree import ml_lawdata
+from jstatutree.textblob import TextBlobWriter, TextBlob
+
+TEST_PATH = os.path.dirname(__file__)
+DB_PATH = os.path.join(TEST_PATH, "testdb")
+BLOB_PATH = os.path.join(TEST_PATH, "testblob")
+
+class TextBlobTestCase(unittest.TestCase):
+    def tearDown(self):
+        shutil.rmtree(BLOB_PATH)
+
+    def test_lookup(self):
+        items = [("a/1", "第一条"), ("a/2", ""), ("a/2/x", "ｘ"), ("b", "公布の日から施行する")]
+        with TextBlobWriter(BLOB_PATH) as writer:
+            for code, text in items:
+                writer.add(code, text)
+            self.assertRaises(AssertionError, writer.add, "a", "")
+        blob = TextBlob(BLOB_PATH)
+        self.assertEqual(len(blob), 4)
+        self.assertEqual(blob["a/2/x"], "ｘ")
+        self.assertEqual(blob.get("a/2"), "")
+        self.assertIsNone(blob.get("a/3"))
+        self.assertRaises(KeyError, blob.__getitem__, "a")
+        self.assertEqual(blob.index_of("b"), 3)
+        self.assertEqual(bytes(blob.text_bytes_at(0)), "第一条".encode("utf8"))
+        self.assertEqual(blob.get_many(["b", "c", "a/1"], default=""), ["公布の日から施行する", "", "第一条"])
+        self.assertEqual(list(blob.items()), items)
+        self.assertEqual(list(blob.keys(prefix="a/2")), ["a/2", "a/2/x"])
+        self.assertEqual(list(blob.keys(prefix="a/")), ["a/1", "a/2", "a/2/x"])
+        self.assertEqual(list(blob.keys(prefix="a/2/", start="a/2/y")), [])
+        self.assertEqual(list(blob.keys(start="a/2", stop="b", reverse=True)), ["a/2/x", "a/2"])
+        blob.close()
+
+    def test_empty(self):
+        TextBlobWriter(BLOB_PATH).close()
+        blob = TextBlob(BLOB_PATH)
+        self.assertEqual(len(blob), 0)
+        self.assertIsNone(blob.get("a"))
+        self.assertEqual(list(blob.items()), [])
+
+class KVSTextBlobTestCase(unittest.TestCase):
+    def setUp(self):
+        reader = xml_lawdata.ReikiXMLReader(os.path.join(TEST_PATH, "testset/01/010001/0001.xml"))
+        reader.open()
+        self.kvs = ml_lawdata.JStatutreeKVS(DB_PATH, layout="node")
+        self.kvs.set_from_reader(reader)
+        reader.close()
+
+    def tearDown(self):
+        self.kvs.close()
+        shutil.rmtree(DB_PATH)
+        shutil.rmtree(BLOB_PATH)
+
+    def test_read_through_blob(self):
+        code = "01/010001/0001"
+        expected = [(e.code, e.text) for e in ml_lawdata.ReikiKVSReader(code=code, db=self.kvs).get_tree().depth_first_iteration()]
+        count = self.kvs.export_text_blob(BLOB_PATH)
+        self.assertEqual(count, len(self.kvs["sentence"]))
+        self.kvs.open_text_blob(BLOB_PATH)
+        self.assertIsInstance(self.kvs["sentence"], TextBlob)
+        self.kvs.kvsdicts["sentence"].get = None
+        tree = ml_lawdata.ReikiKVSReader(code=code, db=self.kvs).get_tree()
+        self.assertEqual([(e.code, e.text) for e in tree.depth_first_iteration()], expected)
+        readers = ml_lawdata.ReikiKVSReader.read_many([code], db=self.kvs, with_texts=True)
+        self.assertEqual([(e.code, e.text) for e in readers[0].get_tree().depth_first_iteration()], expected)
+        del self.kvs.kvsdicts["sentence"].get
+        self.assertEqual(self.kvs.delete_tree(code), list(self.kvs.text_blob.keys(prefix=code + "/")))
+        self.assertEqual(len(self.kvs.kvsdicts["sentence"]), 0)
+
+if __name__ == "__main__":
+    unittest.main()
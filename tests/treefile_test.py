@@ -0,0 +1,139 @@
+import unittest
+import sys, os
+sys.path.append(
+    os.path.split(os.path.split(os.path.abspath(__file__))[0])[0]
+    )
+import shutil
+import time
+import functools
+import pickle
+from jstatutree.xmltree import xml_lawdata, xml_etypes
+from jstatutree.mltree import ml_lawdata
+from jstatutree.jstatute_dict import JSFMultiExecutor, file_digest
+from jstatutree.treefile import TreeFile, TreeFileCache, CachedXMLReader, write_tree_file, views, VERSION
+
+TEST_PATH = os.path.dirname(__file__)
+DB_PATH = os.path.join(TEST_PATH, "testdb")
+CACHE_PATH = os.path.join(TEST_PATH, "testtreecache")
+TESTSET_PATH = os.path.join(TEST_PATH, "testset")
+XML_PATH = os.path.join(TESTSET_PATH, "01/010001/0001.xml")
+
+def summary(tree):
+    return [(e.code, e.etype.__name__, e.text) for e in tree.depth_first_iteration()]
+
+class CountingReader(xml_lawdata.ReikiXMLReader):
+    opened = []
+
+    def open(self):
+        self.opened.append(self.path)
+        super().open()
+
+class TreeFileTestCase(unittest.TestCase):
+    def setUp(self):
+        os.makedirs(CACHE_PATH, exist_ok=True)
+        self.reader = xml_lawdata.ReikiXMLReader(XML_PATH)
+        self.reader.open()
+        CountingReader.opened = []
+
+    def tearDown(self):
+        self.reader.close()
+        shutil.rmtree(CACHE_PATH)
+
+    def test_round_trip(self):
+        path = os.path.join(CACHE_PATH, "0001.jstf")
+        write_tree_file(path, self.reader.get_tree())
+        tree_file = TreeFile(path)
+        self.assertEqual(len(tree_file), len(summary(self.reader.get_tree())))
+        self.assertEqual(tree_file.lawdata.name, "法令名")
+        tree = tree_file.get_tree()
+        self.assertEqual(summary(tree), summary(self.reader.get_tree()))
+        self.assertEqual(
+            [e.code for e in tree.depth_first_search(views.Item, valid_vnode=True)],
+            [e.code for e in self.reader.get_tree().depth_first_search(xml_etypes.Item, valid_vnode=True)]
+            )
+        self.assertEqual(summary(ml_lawdata.ml_etypes.convert_recursively(tree)), summary(self.reader.get_tree()))
+        self.assertIs(pickle.loads(pickle.dumps(views.Article)), views.Article)
+
+    def test_lazy(self):
+        path = os.path.join(CACHE_PATH, "0001.jstf")
+        write_tree_file(path, self.reader.get_tree())
+        tree = TreeFile(path).get_tree()
+        article = tree.children[""].children[""].children["第2条"]
+        self.assertIsNone(article._children)
+        self.assertIsNone(tree.children[""].children[""].children["第1条"]._children)
+        self.assertEqual(
+            [s.text for s in article.children["第2項"].children[""].children.values()],
+            ["第二項本文", "第二項但し書き"]
+            )
+
+    def test_invalid_file(self):
+        path = os.path.join(CACHE_PATH, "0001.jstf")
+        write_tree_file(path, self.reader.get_tree())
+        with open(path, "r+b") as f:
+            f.seek(4)
+            f.write(b"\x63")
+        self.assertRaises(ValueError, TreeFile, path)
+        self.assertRaises(ValueError, TreeFile, XML_PATH)
+
+    def test_cache(self):
+        reader_cls = functools.partial(CachedXMLReader, cache_dir=CACHE_PATH, reader_cls=CountingReader)
+        for _ in range(2):
+            reader = reader_cls(XML_PATH)
+            reader.open()
+            self.assertEqual(reader.lawdata.code, "01/010001/0001")
+            self.assertEqual(reader.lawdata.name, "法令名")
+            self.assertEqual(summary(reader.get_tree()), summary(self.reader.get_tree()))
+            reader.close()
+        self.assertEqual(CountingReader.opened, [XML_PATH])
+        self.assertEqual(len(os.listdir(CACHE_PATH)), 1)
+        self.assertIsNone(TreeFileCache(CACHE_PATH).open(CountingReader(os.path.join(TEST_PATH, "__init__.py"))))
+
+    def test_cache_version(self):
+        cache = TreeFileCache(CACHE_PATH)
+        path = cache.path_for(file_digest(XML_PATH))
+        self.assertIn(".v{}.".format(VERSION), os.path.basename(path))
+        os.makedirs(os.path.dirname(path))
+        write_tree_file(path, self.reader.get_tree())
+        with open(path, "r+b") as f:
+            f.seek(4)
+            f.write(b"\x63")
+        reader = CachedXMLReader(XML_PATH, cache_dir=CACHE_PATH, reader_cls=CountingReader)
+        reader.open()
+        self.assertEqual(CountingReader.opened, [XML_PATH])
+        self.assertEqual(summary(reader.get_tree()), summary(self.reader.get_tree()))
+        tree_file = reader.tree_file
+        reader.close()
+        self.assertTrue(tree_file.mm.closed)
+        self.assertIsNone(tree_file.parents)
+        TreeFile(path).close()
+
+    def test_executor(self):
+        reader_cls = functools.partial(CachedXMLReader, cache_dir=CACHE_PATH)
+        for _ in range(2):
+            kvs = ml_lawdata.JStatutreeKVS(DB_PATH)
+            stats = JSFMultiExecutor(kvs, proc_count=1, reader_cls=reader_cls).setup_from_basepath(TESTSET_PATH)
+            self.assertEqual(stats.failed, 0)
+            self.assertEqual(
+                summary(ml_lawdata.ReikiKVSReader(code="01/010001/0001", db=kvs).get_tree()),
+                summary(self.reader.get_tree())
+                )
+            kvs.close()
+            shutil.rmtree(DB_PATH)
+
+    def test_benchmark(self):
+        path = os.path.join(CACHE_PATH, "0001.jstf")
+        write_tree_file(path, self.reader.get_tree())
+        start = time.time()
+        for _ in range(50):
+            reader = xml_lawdata.ReikiXMLReader(XML_PATH)
+            reader.open()
+            summary(reader.get_tree())
+        xml_time = time.time() - start
+        start = time.time()
+        for _ in range(50):
+            summary(TreeFile(path).get_tree())
+        file_time = time.time() - start
+        print("xml: {0:.4f}s, tree file: {1:.4f}s".format(xml_time, file_time))
+
+if __name__ == "__main__":
+    unittest.main()
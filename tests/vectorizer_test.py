@@ -0,0 +1,75 @@
+import unittest
+import sys, os
+sys.path.append(
+    os.path.split(os.path.split(os.path.abspath(__file__))[0])[0]
+    )
+import shutil
+import numpy as np
+from jstatutree.xmltree import xml_lawdata
+from jstatutree.mltree import ml_lawdata
+from jstatutree.mltree.vectorizer import HashingVectorizer, iter_level_texts, export_features, load_features
+from jstatutree import etypes
+
+TEST_PATH = os.path.dirname(__file__)
+DB_PATH = os.path.join(TEST_PATH, "testdb")
+FEATURES_PATH = os.path.join(TEST_PATH, "testfeatures")
+
+class HashingVectorizerTestCase(unittest.TestCase):
+    def test_transform(self):
+        vectorizer = HashingVectorizer(n_features=64)
+        matrix = vectorizer.transform(["公布の日から施行する", "公布の日から施行する", "", "あ"])
+        self.assertEqual(matrix.shape, (4, 64))
+        self.assertEqual(matrix.dtype, np.float32)
+        np.testing.assert_array_equal(matrix[0], matrix[1])
+        self.assertAlmostEqual(float(np.linalg.norm(matrix[0])), 1.0, places=5)
+        self.assertEqual(np.count_nonzero(matrix[2]), 0)
+        self.assertEqual(np.count_nonzero(matrix[3]), 1)
+        indices, values = HashingVectorizer(n_features=2**20, ngram_range=(2, 2), norm=None, alternate_sign=False).transform_one("ああああ")
+        self.assertEqual(list(values), [3.0])
+
+class ExportFeaturesTestCase(unittest.TestCase):
+    def setUp(self):
+        reader = xml_lawdata.ReikiXMLReader(os.path.join(TEST_PATH, "testset/01/010001/0001.xml"))
+        reader.open()
+        self.kvs = ml_lawdata.JStatutreeKVS(DB_PATH, layout="node")
+        self.kvs.set_from_reader(reader)
+        self.tree = reader.get_tree()
+        reader.close()
+
+    def tearDown(self):
+        self.kvs.close()
+        shutil.rmtree(DB_PATH)
+        if os.path.exists(FEATURES_PATH):
+            shutil.rmtree(FEATURES_PATH)
+
+    def test_iter_level_texts(self):
+        articles = list(self.tree.depth_first_search(etypes.Article))
+        items = list(iter_level_texts(self.kvs, etypes.Article))
+        self.assertEqual([code for code, _ in items], [e.code for e in articles])
+        self.assertEqual(
+            [text for _, text in items],
+            ["".join(s.text for s in e.depth_first_iteration() if s.etype.__name__ == "Sentence") for e in articles]
+            )
+
+    def test_export(self):
+        vectorizer = HashingVectorizer(n_features=128)
+        items = list(iter_level_texts(self.kvs, etypes.Sentence))
+        rows = export_features(self.kvs, FEATURES_PATH, etypes.Sentence, vectorizer=vectorizer)
+        matrix, codes = load_features(FEATURES_PATH)
+        self.assertIsInstance(matrix, np.memmap)
+        self.assertEqual(matrix.shape, (rows, 128))
+        self.assertEqual(codes, [code for code, _ in items])
+        np.testing.assert_array_equal(matrix, vectorizer.transform(text for _, text in items))
+        shutil.rmtree(FEATURES_PATH)
+        export_features(self.kvs, FEATURES_PATH, etypes.Sentence, vectorizer=vectorizer, sparse=True)
+        csr, codes = load_features(FEATURES_PATH)
+        self.assertEqual(csr.shape, matrix.shape)
+        dense = np.zeros(csr.shape, dtype=np.float32)
+        for i in range(csr.shape[0]):
+            dense[i, csr.indices[csr.indptr[i]:csr.indptr[i+1]]] = csr.data[csr.indptr[i]:csr.indptr[i+1]]
+        np.testing.assert_array_equal(dense, matrix)
+        self.assertEqual(export_features(self.kvs, FEATURES_PATH, etypes.Law, prefix="02/"), 0)
+        self.assertEqual(load_features(FEATURES_PATH)[0].shape, (0, 1024))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,12 @@
 import unittest
 import sys, os
+import shutil
+import tempfile
+import io
+import contextlib
 from jstatutree.xmltree import xml_lawdata as lawdata
 from jstatutree.xmltree import xml_etypes as etype
+from jstatutree.myexceptions import LawElementNumberError
 
 class ReikiXMLReaderTestCase(unittest.TestCase):
     def setUp(self):
@@ -66,9 +71,108 @@ class ReikiXMLReaderTestCase(unittest.TestCase):
             #print((child, int(child.num.num), child.text), answers[i])
             self.element_match(child, *answers[i])
 
+    def iterparse_test_unit(self, target_etype):
+        tree = self.rr.get_tree()
+        correct = [
+            (e.code, e.etype, int(e.num.num), e.text, list(e.iter_sentences()))
+            for e in tree.depth_first_search(target_etype)
+            ]
+        streamed = [
+            (e.code, e.etype, int(e.num.num), e.text, e.sentences)
+            for e in self.rr.iterparse_elements(target_etype)
+            ]
+        self.assertEqual(streamed, correct)
+
+    def test_iterparse_elements(self):
+        self.iterparse_test_unit(etype.Law)
+        self.iterparse_test_unit(etype.Article)
+        self.iterparse_test_unit(etype.ArticleCaption)
+        self.iterparse_test_unit(etype.Sentence)
+
+    def test_iterparse_elements_without_open(self):
+        rr = lawdata.ReikiXMLReader(self.rr.path)
+        codes = [e.code for e in rr.iterparse_elements("Article")]
+        self.assertTrue(rr.is_closed())
+        self.assertEqual(codes, [
+            "01/010001/0001/Law(1)/LawBody(1)/MainProvision(1)/Article(1)",
+            "01/010001/0001/Law(1)/LawBody(1)/MainProvision(1)/Article(2)"
+            ])
+
     def tearDown(self):
         self.rr.close()
 
+class ExpatReikiXMLReaderTestCase(ReikiXMLReaderTestCase):
+    def setUp(self):
+        testset_path = os.path.join(os.path.dirname(__file__), "testset/01/010001/0001.xml")
+        self.rr = lawdata.ReikiXMLReader(testset_path, backend="expat")
+        self.rr.open()
+        assert self.rr.get_tree() is not None, "test set path is invalid.\n"+str(testset_path)
+
+    def test_same_as_etree(self):
+        etree_rr = lawdata.ReikiXMLReader(self.rr.path)
+        etree_rr.open()
+        for target_etype in [etype.Article, etype.Item, etype.Subitem1, etype.Sentence]:
+            self.assertEqual(
+                [(e.code, e.text, e.is_vnode) for e in self.rr.get_tree().depth_first_search(target_etype, valid_vnode=True)],
+                [(e.code, e.text, e.is_vnode) for e in etree_rr.get_tree().depth_first_search(target_etype, valid_vnode=True)]
+                )
+        etree_rr.close()
+UNORDERED_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<Laws>
+<Law Num="">
+	<LawNum>法令番号</LawNum>
+	<LawBody>
+		<LawTitle>法令名</LawTitle>
+		<MainProvision>
+			<Article Num="2"><Paragraph Num="1"><ParagraphSentence><Sentence>第二条</Sentence></ParagraphSentence></Paragraph></Article>
+			<Article Num="1_2"><Paragraph Num="1"><ParagraphSentence><Sentence>第一条の二</Sentence></ParagraphSentence></Paragraph></Article>
+			<Article Num="1"><Paragraph Num="1"><ParagraphSentence><Sentence>第一条</Sentence></ParagraphSentence></Paragraph><ArticleCaption>見出し</ArticleCaption></Article>
+		</MainProvision>
+	</LawBody>
+</Law>
+</Laws>
+"""
+
+class ChildrenOrderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "01", "010002", "0001.xml")
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, "w", encoding="utf8") as f:
+            f.write(UNORDERED_XML)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_children_order(self):
+        for backend in lawdata.XMLReaderBase.BACKENDS:
+            rr = lawdata.ReikiXMLReader(self.path, backend=backend)
+            rr.open()
+            tree = rr.get_tree()
+            main_provision = list(tree.depth_first_search(etype.MainProvision))[0]
+            self.assertEqual(list(main_provision.children.keys()), ["第1条", "第1条の2", "第2条"])
+            article = main_provision.children["第1条"]
+            self.assertEqual([c.etype for c in article.children.values()], [etype.ArticleCaption, etype.Paragraph])
+            self.assertEqual(list(tree.iter_sentences()), ["第一条", "第一条の二", "第二条"])
+            rr.close()
+
+    # 番号の誤りはどちらのバックエンドでも例規の情報付きで報告する
+    def test_number_error(self):
+        with open(self.path, "w", encoding="utf8") as f:
+            f.write(UNORDERED_XML.replace('Num="1_2"', 'Num="1-2"'))
+        rr = lawdata.ReikiXMLReader(self.path)
+        rr.open()
+        with self.assertRaises(LawElementNumberError) as cm:
+            list(rr.get_tree().depth_first_iteration())
+        rr.close()
+        self.assertIn("法令名", str(cm.exception))
+        self.assertIn("01/010002/0001", str(cm.exception))
+        rr = lawdata.ReikiXMLReader(self.path, backend="expat")
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            rr.open()
+        self.assertTrue(rr.is_closed())
+        self.assertIn(str(cm.exception), out.getvalue())
 
 if __name__ == "__main__":
     unittest.main()